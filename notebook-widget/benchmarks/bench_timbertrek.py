@@ -0,0 +1,310 @@
+"""Benchmark each stage of the TimberTrek pipeline on synthetic Rashomon tries
+and the bundled examples, and compare the results with stored baselines.
+
+Run it from the notebook-widget directory:
+
+    python -m benchmarks.bench_timbertrek
+    python -m benchmarks.bench_timbertrek --cases car compas
+    python -m benchmarks.bench_timbertrek --update-baselines
+"""
+
+import argparse
+import gc
+import hashlib
+import os
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+from json import dump, dumps, load
+
+from timbertrek import timbertrek
+from benchmarks.synthetic import make_synthetic_data, make_synthetic_trie
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+EXAMPLE_DIR = os.path.join(BENCHMARK_DIR, "..", "example")
+BASELINE_FILE = os.path.join(BENCHMARK_DIR, "baselines.json")
+
+# Synthetic cases: make_synthetic_trie() and make_synthetic_data() arguments
+SYNTHETIC_CASES = {
+    "synthetic-small": {
+        "trie": {"tree_num": 1000, "max_depth": 3, "width": 8},
+        "data": {"sample_num": 2000},
+    },
+    "synthetic-medium": {
+        "trie": {"tree_num": 10000, "max_depth": 4, "width": 12},
+        "data": {"sample_num": 5000},
+    },
+    "synthetic-wide": {
+        "trie": {"tree_num": 5000, "max_depth": 5, "width": 20, "duplicate_rate": 0},
+        "data": {"sample_num": 5000},
+    },
+    "synthetic-duplicate": {
+        "trie": {"tree_num": 5000, "max_depth": 4, "width": 6, "duplicate_rate": 0.5},
+        "data": {"sample_num": 5000},
+    },
+}
+
+# Bundled examples: (trie json, dataset csv)
+EXAMPLE_CASES = {
+    "car": ("car_0.15_0.015.json", "car_data.csv"),
+    "compas": ("compas_0.01_0.05.json", "compas_data.csv"),
+}
+
+
+def load_case(name):
+    """Load the trie and the dataset of a benchmark case.
+
+    Args:
+        name (str): Case name in SYNTHETIC_CASES or EXAMPLE_CASES
+
+    Returns:
+        dict: Rashomon trie
+        pd.DataFrame: Dataset with the label as the last column
+    """
+
+    if name in SYNTHETIC_CASES:
+        case = SYNTHETIC_CASES[name]
+        trie = make_synthetic_trie(**case["trie"])
+        data_df = make_synthetic_data(**case["data"])
+        return trie, data_df
+
+    trie_file, data_file = EXAMPLE_CASES[name]
+    with open(os.path.join(EXAMPLE_DIR, trie_file), "r") as fp:
+        trie = load(fp)
+    data_df = pd.read_csv(os.path.join(EXAMPLE_DIR, data_file))
+    return trie, data_df
+
+
+def measure(func, repeat=1):
+    """Measure the wall time and the peak traced memory of a function.
+
+    Args:
+        func (function): Function without arguments
+        repeat (int): # timed runs; the fastest run is reported
+
+    Returns:
+        Any: Return value of the last run
+        float: Wall time in seconds
+        int: Peak memory allocated during the run in bytes
+    """
+
+    # Time without tracemalloc, which slows down allocations
+    best_time = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        best_time = min(best_time, time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, best_time, peak_memory
+
+
+def get_result_digest(decision_paths):
+    """Hash decision paths for comparison. Children of a rule trie node are
+    sorted first, because their order depends on set iteration order.
+
+    Args:
+        decision_paths (dict): Decision paths generated by
+            transform_trie_to_rules()
+
+    Returns:
+        str: Hex digest
+    """
+
+    def sort_rule_node(node):
+        if "c" not in node:
+            return dict(node)
+        children = [sort_rule_node(c) for c in node["c"]]
+        children.sort(key=lambda c: dumps(c, sort_keys=True))
+        return {**node, "c": children}
+
+    decision_paths = dict(decision_paths)
+    decision_paths["trie"] = sort_rule_node(decision_paths["trie"])
+
+    digest = hashlib.sha1(dumps(decision_paths, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def run_case(name, repeat=1):
+    """Run every pipeline stage on a benchmark case.
+
+    Args:
+        name (str): Case name
+        repeat (int): # timed runs of each stage
+
+    Returns:
+        dict: {'treeNum', 'sampleNum', 'digest', 'stages': {stage: {'time',
+            'peakMemory'}}}
+    """
+
+    trie, data_df = load_case(name)
+    data = data_df.to_numpy()
+    x_all, y_all = data[:, :-1], data[:, -1]
+    stages = {}
+
+    def run_stage(stage, func):
+        result, wall_time, peak_memory = measure(func, repeat)
+        stages[stage] = {"time": wall_time, "peakMemory": peak_memory}
+        return result
+
+    new_trie = run_stage("transform_trie", lambda: timbertrek.transform_trie(trie))
+
+    def build_tree_map():
+        tree_map = {"count": 0, "map": {}}
+        timbertrek.build_tree_map(new_trie, tree_map)
+        return tree_map
+
+    tree_map = run_stage("build_tree_map", build_tree_map)
+    run_stage(
+        "get_decision_rule_hierarchy_dict",
+        lambda: timbertrek.get_decision_rule_hierarchy_dict(trie),
+    )
+    tree_map_hierarchy = run_stage(
+        "get_tree_map_hierarchy", lambda: timbertrek.get_tree_map_hierarchy(tree_map)
+    )
+
+    def count_leaf_samples():
+        for tree_entry in tree_map_hierarchy.values():
+            timbertrek.count_leaf_samples(tree_entry[0], x_all, y_all)
+
+    run_stage("count_leaf_samples", count_leaf_samples)
+
+    decision_paths = run_stage(
+        "transform_trie_to_rules",
+        lambda: timbertrek.transform_trie_to_rules(trie, data_df, quiet=True),
+    )
+
+    try:
+        timbertrek._get_js_bundle_base64()
+        run_stage("_make_html", lambda: timbertrek._make_html(decision_paths, 500))
+    except FileNotFoundError:
+        # The JS bundle is only available after building the widget
+        run_stage(
+            "_make_html (shared bundle)",
+            lambda: timbertrek._make_html(decision_paths, 500, shared_bundle=True),
+        )
+
+    return {
+        "treeNum": len(decision_paths["treeMap"]),
+        "sampleNum": len(data_df),
+        "digest": get_result_digest(decision_paths),
+        "stages": stages,
+    }
+
+
+def compare_baseline(name, result, baseline, tolerance):
+    """Compare a case result with its baseline.
+
+    Args:
+        name (str): Case name
+        result (dict): Result generated by run_case()
+        baseline (dict): Stored result of the same case
+        tolerance (float): Max allowed ratio of time or memory to the baseline
+
+    Returns:
+        [str]: Regression messages
+    """
+
+    messages = []
+    if result["digest"] != baseline["digest"]:
+        messages.append(f"{name}: decision paths differ from the baseline")
+
+    for stage, metrics in result["stages"].items():
+        base_metrics = baseline["stages"].get(stage)
+        if base_metrics is None:
+            continue
+
+        for metric in ["time", "peakMemory"]:
+            # Ignore noise in stages that are too fast to time reliably
+            if metric == "time" and base_metrics[metric] < 0.01:
+                continue
+            if base_metrics[metric] == 0:
+                continue
+
+            ratio = metrics[metric] / base_metrics[metric]
+            if ratio > tolerance:
+                messages.append(
+                    f"{name}: {stage} {metric} is {ratio:.2f}x of the baseline"
+                )
+
+    return messages
+
+
+def print_result(name, result, baseline=None):
+    print(f"\n{name} ({result['treeNum']} trees, {result['sampleNum']} samples)")
+    print(f"{'stage':<36}{'time (s)':>12}{'peak (MB)':>12}{'vs base':>10}")
+
+    for stage, metrics in result["stages"].items():
+        speedup = ""
+        if baseline is not None and stage in baseline["stages"]:
+            base_time = baseline["stages"][stage]["time"]
+            speedup = f"{base_time / max(metrics['time'], 1e-9):.2f}x"
+
+        print(
+            f"{stage:<36}{metrics['time']:>12.4f}"
+            f"{metrics['peakMemory'] / 2**20:>12.2f}{speedup:>10}"
+        )
+
+
+def main(argv=None):
+    all_cases = list(SYNTHETIC_CASES) + list(EXAMPLE_CASES)
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", nargs="+", choices=all_cases, default=all_cases)
+    parser.add_argument("--repeat", type=int, default=1, help="# timed runs")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.5,
+        help="max time or memory ratio to the baseline before it is a regression",
+    )
+    parser.add_argument(
+        "--update-baselines",
+        action="store_true",
+        help="store the results of the cases as the new baselines",
+    )
+    args = parser.parse_args(argv)
+
+    baselines = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, "r") as fp:
+            baselines = load(fp)
+
+    messages = []
+    for name in args.cases:
+        result = run_case(name, args.repeat)
+        print_result(name, result, baselines.get(name))
+
+        if args.update_baselines:
+            baselines[name] = result
+        elif name in baselines:
+            messages += compare_baseline(name, result, baselines[name], args.tolerance)
+
+    if args.update_baselines:
+        with open(BASELINE_FILE, "w") as fp:
+            dump(baselines, fp, indent=2, sort_keys=True)
+            fp.write("\n")
+        print(f"\nSaved baselines to {BASELINE_FILE}")
+        return 0
+
+    print()
+    for message in messages:
+        print(message)
+    print(f"{len(messages)} regressions")
+
+    return 1 if len(messages) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""Generate synthetic binarized datasets and Rashomon tries in the GOSDT trie
+format, so that we can benchmark TimberTrek at any scale."""
+
+import numpy as np
+import pandas as pd
+
+
+def make_synthetic_data(sample_num=10000, feature_num=20, random_state=0):
+    """Generate a binarized dataset. The label depends on the first features,
+    so that trees have different accuracies.
+
+    Args:
+        sample_num (int): # rows. Defaults to 10000.
+        feature_num (int): # binary features. Defaults to 20.
+        random_state (int): Random seed. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: Dataframe with binary features 'f0:1', 'f1:1', ..., and
+            the label as the last column
+    """
+
+    rng = np.random.default_rng(random_state)
+    x_all = rng.integers(0, 2, size=(sample_num, feature_num), dtype=np.int8)
+
+    # Noisy majority vote of the first three features
+    votes = x_all[:, : min(3, feature_num)].sum(axis=1)
+    noise = rng.random(sample_num) < 0.1
+    y_all = ((votes * 2 > min(3, feature_num)) ^ noise).astype(np.int8)
+
+    columns = [f"f{i}:1" for i in range(feature_num)] + ["label"]
+    return pd.DataFrame(np.column_stack([x_all, y_all]), columns=columns)
+
+
+def _make_tree(rng, features, depth, max_depth, split_rate=0.7):
+    """Generate a random tree as nested tuples (feature, true child, false
+    child), where a leaf is its label string '-2' (positive) or '-1'
+    (negative).
+    """
+
+    if depth > 0 and (depth >= max_depth or rng.random() > split_rate):
+        return "-2" if rng.random() < 0.5 else "-1"
+
+    feature = int(rng.choice(features))
+    return (
+        feature,
+        _make_tree(rng, features, depth + 1, max_depth, split_rate),
+        _make_tree(rng, features, depth + 1, max_depth, split_rate),
+    )
+
+
+def _swap_root_split(tree):
+    """Get an equivalent tree by swapping the root split with the split of
+    its children, if both children split on the same feature.
+
+    Returns:
+        tuple: Equivalent tree, or None if the root cannot be swapped
+    """
+
+    feature, left, right = tree
+    if isinstance(left, str) or isinstance(right, str) or left[0] != right[0]:
+        return None
+    if left[0] == feature:
+        return None
+
+    return (
+        left[0],
+        (feature, left[1], right[1]),
+        (feature, left[2], right[2]),
+    )
+
+
+def encode_tree(tree):
+    """Encode a tree as its GOSDT trie strings: the root feature, followed by
+    one string per BFS level with the (true, false) children of each split.
+
+    Args:
+        tree (tuple): Tree generated by _make_tree()
+
+    Returns:
+        [str]: Tree strings
+    """
+
+    tree_strings = [str(tree[0])]
+    cur_level = [tree]
+
+    while len(cur_level) > 0:
+        values, next_level = [], []
+        for node in cur_level:
+            for child in node[1:]:
+                if isinstance(child, str):
+                    values.append(child)
+                else:
+                    values.append(str(child[0]))
+                    next_level.append(child)
+
+        tree_strings.append(" ".join(values))
+        cur_level = next_level
+
+    return tree_strings
+
+
+def _count_leaves(tree):
+    if isinstance(tree, str):
+        return 1
+    return _count_leaves(tree[1]) + _count_leaves(tree[2])
+
+
+def make_synthetic_trie(
+    tree_num=1000,
+    max_depth=4,
+    width=8,
+    duplicate_rate=0.1,
+    feature_num=20,
+    regularization=0.01,
+    random_state=0,
+):
+    """Generate a Rashomon trie in the GOSDT trie format.
+
+    Args:
+        tree_num (int): # trees. Defaults to 1000.
+        max_depth (int): Max depth of trees, where the root is at depth 0.
+            Defaults to 4.
+        width (int): # features that trees can split on. A smaller width
+            makes trees share more trie prefixes and decision rules.
+            Defaults to 8.
+        duplicate_rate (float): Share of trees that are equivalent to an
+            earlier tree (same predictions with the root split swapped with
+            its children's split). Defaults to 0.1.
+        feature_num (int): # features in the dataset. Defaults to 20.
+        regularization (float): Complexity penalty per leaf. Defaults to 0.01.
+        random_state (int): Random seed. Defaults to 0.
+
+    Returns:
+        dict: Rashomon trie
+    """
+
+    rng = np.random.default_rng(random_state)
+    features = rng.choice(feature_num, size=min(width, feature_num), replace=False)
+
+    trie = {}
+    seen_trees = set()
+    swappable_trees = []
+    max_tries = tree_num * 100
+
+    while len(seen_trees) < tree_num and max_tries > 0:
+        max_tries -= 1
+
+        if len(swappable_trees) > 0 and rng.random() < duplicate_rate:
+            tree = _swap_root_split(swappable_trees.pop())
+        elif max_depth >= 2 and len(features) >= 2 and rng.random() < duplicate_rate:
+            # Make a tree that a later tree can duplicate
+            root_feature, child_feature = rng.choice(features, size=2, replace=False)
+            leaves = [_make_tree(rng, features, 2, max_depth) for _ in range(4)]
+            tree = (
+                int(root_feature),
+                (int(child_feature), leaves[0], leaves[1]),
+                (int(child_feature), leaves[2], leaves[3]),
+            )
+        else:
+            tree = _make_tree(rng, features, 0, max_depth)
+
+        if tree in seen_trees:
+            continue
+
+        seen_trees.add(tree)
+        swapped_tree = _swap_root_split(tree)
+        if swapped_tree is not None and swapped_tree not in seen_trees:
+            swappable_trees.append(tree)
+
+        complexity = round(regularization * _count_leaves(tree), 5)
+        loss = round(rng.uniform(0.1, 0.2), 5)
+
+        cur_node = trie
+        for tree_string in encode_tree(tree):
+            cur_node = cur_node.setdefault(tree_string, {})
+        cur_node.update(
+            {"complexity": complexity, "loss": loss, "objective": complexity + loss}
+        )
+
+    return trie
@@ -2,20 +2,1252 @@
 
 """Tests for `timbertrek` package."""
 
-
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
+import urllib.error
+import urllib.request
+from contextlib import redirect_stderr
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
 
 from timbertrek import timbertrek
 
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+
+def _make_leaf(objective):
+    return {"complexity": 0.02, "loss": objective - 0.02, "objective": objective}
+
+
+def _naive_leaf_counts(tree_strings, x_all, y_all):
+    """Classify each sample one by one, as a reference for the vectorized
+    routing. Returns {leaf path: [# samples, # correct]}."""
+
+    root = timbertrek.get_hierarchy_tree(tree_strings)
+    counts = {}
+
+    for x, y in zip(x_all, y_all):
+        node, path = root, ""
+        while node["f"][0] not in ("+", "-"):
+            if x[int(node["f"][0])] == 1:
+                node, path = node["c"][0], path + "l"
+            else:
+                node, path = node["c"][1], path + "r"
+
+        cur_count = counts.setdefault(path, [0, 0])
+        cur_count[0] += 1
+        cur_count[1] += int((1 if node["f"][0] == "+" else 0) == y)
+
+    return counts
+
+
+def _leaf_counts(root, path=""):
+    if root["f"][0] in ("+", "-"):
+        return {path: root["f"][1:]}
+
+    counts = _leaf_counts(root["c"][0], path + "l")
+    counts.update(_leaf_counts(root["c"][1], path + "r"))
+    return counts
+
 
 class TestTimbertrek(unittest.TestCase):
     """Tests for `timbertrek` package."""
 
     def setUp(self):
         """Set up test fixtures, if any."""
+        rng = np.random.default_rng(0)
+        self.x_all = rng.integers(0, 2, size=(500, 5))
+        self.y_all = rng.integers(0, 2, size=500)
+
+        # Two trees sharing the same root split
+        self.trie = {
+            "0": {
+                "-2 1": {"-1 -2": _make_leaf(0.2)},
+                "1 2": {
+                    "3 -1 3 -2": {"-2 -1 -1 -2": _make_leaf(0.3)},
+                },
+            }
+        }
+
+        columns = [f"f{i}:1" for i in range(5)] + ["label"]
+        self.data_df = pd.DataFrame(
+            np.column_stack([self.x_all, self.y_all]), columns=columns
+        )
 
     def tearDown(self):
         """Tear down test fixtures, if any."""
 
     def test_000_something(self):
         """Test something."""
+
+    def test_compile_tree(self):
+        """Nodes are numbered in BFS order with children after parents."""
+        root = timbertrek.get_hierarchy_tree(["0", "-2 1", "-1 -2"])
+        nodes, features, lefts, rights, labels = timbertrek.compile_tree(root)
+
+        self.assertEqual(len(nodes), 5)
+        self.assertEqual(features.tolist(), [0, -1, 1, -1, -1])
+        self.assertEqual(lefts.tolist(), [1, -1, 3, -1, -1])
+        self.assertEqual(rights.tolist(), [2, -1, 4, -1, -1])
+        self.assertEqual(labels.tolist(), [-1, 1, -1, 0, 1])
+
+    def test_count_leaf_samples(self):
+        """Leaf counts match a per-sample traversal, even when two nodes share
+        the same feature, side, and depth."""
+        tree_strings = ["0", "1 2", "3 -1 3 -2", "-2 -1 -1 -2"]
+        root = timbertrek.get_hierarchy_tree(tree_strings)
+        acc = timbertrek.count_leaf_samples(root, self.x_all, self.y_all)
+
+        expected = _naive_leaf_counts(tree_strings, self.x_all, self.y_all)
+        self.assertEqual(_leaf_counts(root), expected)
+        self.assertEqual(root["f"], ["0", 500, -1])
+
+        total_correct = sum(c[1] for c in expected.values())
+        self.assertEqual(acc, round(total_correct / 500, 5))
+
+    def test_count_leaf_samples_non_binary(self):
+        """Samples with a non-binary feature value are not routed."""
+        x_all = np.array([[1], [0], [2]])
+        y_all = np.array([1, 1, 1])
+        root = timbertrek.get_hierarchy_tree(["0", "-2 -1"])
+        acc = timbertrek.count_leaf_samples(root, x_all, y_all)
+
+        self.assertEqual(root["f"], ["0", 2, -1])
+        self.assertEqual(root["c"][0]["f"], ["+", 1, 1])
+        self.assertEqual(root["c"][1]["f"], ["-", 1, 0])
+        self.assertEqual(acc, round(1 / 3, 5))
+
+    def test_count_leaf_samples_packed(self):
+        """Bit-packed counting gives the same annotations as the dense one."""
+        tree_strings = ["0", "1 2", "3 -1 3 -2", "-2 -1 -1 -2"]
+
+        # 500 samples do not fill the last 64-bit word
+        packed_data = timbertrek.pack_binary_data(self.x_all, self.y_all)
+        self.assertEqual(packed_data["x"].shape, (5, 8))
+
+        root = timbertrek.get_hierarchy_tree(tree_strings)
+        acc = timbertrek.count_leaf_samples(root, self.x_all, self.y_all)
+        packed_root = timbertrek.get_hierarchy_tree(tree_strings)
+        packed_acc = timbertrek.count_leaf_samples_packed(packed_root, packed_data)
+
+        self.assertEqual(packed_root, root)
+        self.assertEqual(packed_acc, acc)
+
+    def test_pack_binary_data_non_binary(self):
+        """Bit packing rejects non-binary data."""
+        with self.assertRaises(ValueError):
+            timbertrek.pack_binary_data(np.array([[0], [2]]), np.array([0, 1]))
+
+    def test_rule_cache(self):
+        """Trees sharing a path in a different split order hit the cache, and
+        cached counts match uncached ones."""
+        packed_data = timbertrek.pack_binary_data(self.x_all, self.y_all)
+        rule_cache = timbertrek.make_rule_cache(max_size=100)
+
+        tree_strings_1 = ["0", "1 2", "-1 -2 -2 -1"]
+        tree_strings_2 = ["0", "1 2", "-2 -1 -1 -2"]
+        tree_strings_3 = ["1", "0 -1", "-1 -2"]
+
+        for tree_strings in [tree_strings_1, tree_strings_2, tree_strings_3]:
+            root = timbertrek.get_hierarchy_tree(tree_strings)
+            acc = timbertrek.count_leaf_samples_packed(root, packed_data, rule_cache)
+
+            expected_root = timbertrek.get_hierarchy_tree(tree_strings)
+            expected_acc = timbertrek.count_leaf_samples(
+                expected_root, self.x_all, self.y_all
+            )
+            self.assertEqual(root, expected_root)
+            self.assertEqual(acc, expected_acc)
+
+        # Tree 2 reuses all 7 rules of tree 1; tree 3 reuses the root and
+        # {1t, 0t} (same as {0t, 1t} in tree 1)
+        stats = timbertrek.get_rule_cache_stats(rule_cache)
+        self.assertEqual(stats["hits"], 7 + 2)
+        self.assertEqual(stats["misses"], 7 + 3)
+        self.assertEqual(stats["size"], 10)
+
+    def test_rule_cache_eviction(self):
+        """The cache keeps at most max_size rules."""
+        packed_data = timbertrek.pack_binary_data(self.x_all, self.y_all)
+        rule_cache = timbertrek.make_rule_cache(max_size=3)
+
+        root = timbertrek.get_hierarchy_tree(["0", "1 2", "-1 -2 -2 -1"])
+        timbertrek.count_leaf_samples_packed(root, packed_data, rule_cache)
+
+        stats = timbertrek.get_rule_cache_stats(rule_cache)
+        self.assertEqual(stats["size"], 3)
+        self.assertEqual(stats["evictions"], 4)
+
+    def test_transform_trie_to_rules_parallel(self):
+        """Parallel evaluation gives the same decision paths as the serial one."""
+        serial_paths = timbertrek.transform_trie_to_rules(self.trie, self.data_df)
+
+        for pack_bits in [False, True]:
+            parallel_paths = timbertrek.transform_trie_to_rules(
+                self.trie, self.data_df, pack_bits=pack_bits, n_jobs=2
+            )
+            self.assertEqual(parallel_paths["treeMap"], serial_paths["treeMap"])
+            self.assertEqual(
+                list(parallel_paths["treeMap"]), list(serial_paths["treeMap"])
+            )
+
+        # Workers get the decoded node tables of each chunk
+        tree_map = timbertrek.compile_tree_map(self.trie)["map"]
+        tree_items = [
+            (tid, strings, None, (None, timbertrek.decode_tree(strings)))
+            for tid, (strings, _) in tree_map.items()
+        ]
+        tids, offsets, *tables = timbertrek._pack_tree_chunk(tree_items)
+        self.assertEqual(tids, list(tree_map))
+        for i, (_, _, _, (_, tree_table)) in enumerate(tree_items):
+            for table, expected in zip(tables, tree_table):
+                np.testing.assert_array_equal(
+                    table[offsets[i] : offsets[i + 1]], expected
+                )
+
+    def test_stream_trie_trees(self):
+        """Streaming yields the same trees as build_tree_map()."""
+        trie_json = json.dumps(self.trie, indent=2)
+        tree_map = {"count": 0, "map": {}}
+        timbertrek.build_tree_map(timbertrek.transform_trie(self.trie), tree_map)
+
+        # Tiny chunks split keys and numbers across reads
+        for trie_file in [io.StringIO(trie_json), io.BytesIO(trie_json.encode())]:
+            trees = list(timbertrek.stream_trie_trees(trie_file, chunk_size=3))
+            self.assertEqual(
+                [[strings, round(objective, 5)] for strings, objective in trees],
+                list(tree_map["map"].values()),
+            )
+
+    def test_count_leaf_samples_sparse(self):
+        """Sparse columns give the same counts as dense ones, including values
+        that cannot be routed and columns with a non-zero fill value."""
+        x_all = self.x_all.astype(float)
+        x_all[::7, 1] = 2
+        x_all[::11, 3] = np.nan
+
+        columns = {}
+        for i in range(x_all.shape[1]):
+            fill_value = np.nan if i == 3 else 0
+            columns[i] = pd.arrays.SparseArray(x_all[:, i], fill_value=fill_value)
+        x_sparse = pd.DataFrame(columns)
+
+        tree_strings = ["0", "1 2", "3 -1 3 -2", "-2 -1 -1 -2"]
+        root = timbertrek.get_hierarchy_tree(tree_strings)
+        acc = timbertrek.count_leaf_samples(root, x_all, self.y_all)
+
+        # Reuse the packed data, so the second tree reads cached columns
+        sparse_x = timbertrek.pack_sparse_data(x_sparse, cache_size=2)
+        for _ in range(2):
+            sparse_root = timbertrek.get_hierarchy_tree(tree_strings)
+            sparse_acc = timbertrek.count_leaf_samples(
+                sparse_root, sparse_x, self.y_all
+            )
+            self.assertEqual(sparse_root, root)
+            self.assertEqual(sparse_acc, acc)
+        self.assertEqual(len(sparse_x["cache"]), 2)
+
+    def test_transform_trie_to_rules_sparse(self):
+        """A data frame with sparse columns gives the same decision paths."""
+        sparse_df = self.data_df.astype(
+            {c: pd.SparseDtype("int64", 0) for c in self.data_df.columns[:-1]}
+        )
+        expected_paths = timbertrek.transform_trie_to_rules(
+            self.trie, self.data_df, quiet=True
+        )
+
+        for n_jobs in [1, 2]:
+            sparse_paths = timbertrek.transform_trie_to_rules(
+                self.trie, sparse_df, n_jobs=n_jobs, quiet=True
+            )
+            self.assertEqual(sparse_paths, expected_paths)
+
+        with self.assertRaises(ValueError):
+            timbertrek.transform_trie_to_rules(self.trie, sparse_df, pack_bits=True)
+
+    @unittest.skipIf(scipy is None, "scipy is not installed")
+    def test_transform_trie_to_rules_scipy_sparse(self):
+        """A scipy.sparse matrix needs feature names but gives the same
+        decision paths."""
+        data = scipy.sparse.csr_matrix(self.data_df.to_numpy())
+        feature_names = self.data_df.columns[:-1].tolist()
+
+        with self.assertRaises(ValueError):
+            timbertrek.transform_trie_to_rules(self.trie, data, quiet=True)
+
+        sparse_paths = timbertrek.transform_trie_to_rules(
+            self.trie, data, feature_names=feature_names, quiet=True
+        )
+        self.assertEqual(
+            sparse_paths,
+            timbertrek.transform_trie_to_rules(self.trie, self.data_df, quiet=True),
+        )
+
+    def test_transform_tries_to_rules(self):
+        """A batch evaluates shared trees once and gives the same decision
+        paths as converting each trie on its own."""
+        tighter_trie = {"0": {"-2 1": {"-1 -2": _make_leaf(0.2)}}}
+        other_trie = {
+            "0": {"-2 1": {"-1 -2": _make_leaf(0.25)}},
+            "1": {"-1 -2": _make_leaf(0.22)},
+        }
+        tries = {"loose": self.trie, "tight": tighter_trie, "other": other_trie}
+
+        for n_jobs in [1, 2]:
+            batch_paths, stats = timbertrek.transform_tries_to_rules(
+                tries, self.data_df, n_jobs=n_jobs, quiet=True, return_stats=True
+            )
+            self.assertEqual(list(batch_paths), list(tries))
+            self.assertEqual(stats["treeNum"], 5)
+            self.assertEqual(stats["uniqueTreeNum"], 3)
+
+            for name, trie in tries.items():
+                expected_paths = timbertrek.transform_trie_to_rules(
+                    trie, self.data_df, quiet=True
+                )
+                self.assertEqual(batch_paths[name], expected_paths)
+
+        # A list of tries, including a streamed one, gives a list of outputs
+        batch_paths = timbertrek.transform_tries_to_rules(
+            [self.trie, io.StringIO(json.dumps(tighter_trie))],
+            self.data_df,
+            quiet=True,
+        )
+        self.assertEqual(list(batch_paths[1]["treeMap"]), [1])
+
+        # Outputs do not share trees, so updating one leaves the others as
+        # they are
+        tree_0 = batch_paths[0]["treeMap"][1][0]
+        tree_1 = batch_paths[1]["treeMap"][1][0]
+        self.assertIsNot(tree_0, tree_1)
+        self.assertEqual(tree_0, tree_1)
+
+        expected_tree = json.loads(json.dumps(tree_1))
+        timbertrek.update_decision_paths(batch_paths[0], self.data_df.iloc[:100])
+        self.assertNotEqual(tree_0, expected_tree)
+        self.assertEqual(tree_1, expected_tree)
+
+    def test_transform_trie_to_rules_stream(self):
+        """A streamed trie gives the same decision paths as a loaded one."""
+        loaded_paths = timbertrek.transform_trie_to_rules(self.trie, self.data_df)
+        streamed_paths = timbertrek.transform_trie_to_rules(
+            io.StringIO(json.dumps(self.trie)), self.data_df
+        )
+        self.assertEqual(streamed_paths, loaded_paths)
+
+    def test_compile_tree_map(self):
+        """The one-pass compiler gives the same tree map as the old chain."""
+        tree_map = {"count": 0, "map": {}}
+        timbertrek.build_tree_map(timbertrek.transform_trie(self.trie), tree_map)
+        self.assertEqual(timbertrek.compile_tree_map(self.trie), tree_map)
+
+    def test_compile_tree_map_deep(self):
+        """The compiler does not recurse, so deep tries do not overflow."""
+        trie = _make_leaf(0.1)
+        for _ in range(5000):
+            trie = {"-2 -1": trie}
+
+        tree_map = timbertrek.compile_tree_map(trie)
+        self.assertEqual(tree_map["count"], 1)
+        self.assertEqual(len(tree_map["map"][1][0]), 5000)
+
+    def test_compile_tree_arrays(self):
+        """Packed trees store each distinct key once and export the same map."""
+        trie_json = json.dumps(self.trie)
+        tree_map = timbertrek.compile_tree_map(self.trie)
+
+        tree_stream = timbertrek.select_trie_trees(
+            timbertrek.stream_trie_trees(io.StringIO(trie_json))
+        )
+        tree_arrays = timbertrek.compile_tree_arrays(tree_stream)
+        self.assertEqual(len(tree_arrays["offsets"]), tree_arrays["count"] + 1)
+        self.assertEqual(len(tree_arrays["strings"]), len(set(tree_arrays["strings"])))
+        self.assertEqual(len(tree_arrays["tokens"]), tree_arrays["offsets"][-1])
+
+        exported = timbertrek.export_tree_map(tree_arrays)
+        for tid, tree_entry in exported["map"].items():
+            self.assertEqual(tree_entry, tree_map["map"][tid])
+
+        # Streamed keys are interned, so equal strings are the same object
+        trees = list(timbertrek.stream_trie_trees(io.StringIO(trie_json)))
+        last_strings = {}
+        for tree_strings, _ in trees:
+            for tree_string in tree_strings:
+                last_strings.setdefault(tree_string, tree_string)
+                self.assertIs(last_strings[tree_string], tree_string)
+
+    def test_decision_rule_hierarchy_dedup(self):
+        """Without positions, a tree only appears once at each rule end."""
+        trie = {"0": {"-2 1": {"-1 -2": _make_leaf(0.2)}}}
+        hierarchy, _ = timbertrek.get_decision_rule_hierarchy_dict(
+            trie, keep_position=False
+        )
+
+        self.assertEqual(len(hierarchy["c"]), 1)
+        node_0 = hierarchy["c"][0]
+        self.assertEqual(node_0["f"], "0")
+        self.assertEqual(sorted(c["f"] for c in node_0["c"]), ["1", "_"])
+
+        node_1 = [c for c in node_0["c"] if c["f"] == "1"][0]
+        self.assertEqual(node_1["c"], [{"f": "_", "t": 1}])
+
+    def test_decode_tree_wide_level(self):
+        """One string can hold any number of pairs."""
+        # Four nodes at depth 2 are split by a single 8-value string
+        tree_strings = ["0", "1 2", "3 4 5 6", "-2 -1 -1 -2 -2 -1 -1 -2"]
+        features, lefts, rights, labels = timbertrek.decode_tree(tree_strings)
+
+        self.assertEqual(features.tolist()[:7], [0, 1, 2, 3, 4, 5, 6])
+        self.assertEqual(lefts.tolist()[:7], [1, 3, 5, 7, 9, 11, 13])
+        self.assertEqual(labels.tolist()[7:], [1, 0, 0, 1, 1, 0, 0, 1])
+
+        rules = timbertrek.get_decision_rules(tree_strings)
+        self.assertEqual(len(rules), 8)
+        self.assertIn((("0t", "1t", "3t"), "+"), rules)
+        self.assertIn((("0f", "2f", "6f"), "+"), rules)
+
+        root = timbertrek.get_hierarchy_tree(tree_strings)
+        self.assertEqual(root["c"][1]["c"][1]["f"], ["6"])
+        self.assertEqual(root["c"][1]["c"][1]["c"][0], {"f": ["-"]})
+
+    def test_decode_tree_invalid(self):
+        """Odd widths and incomplete trees are rejected."""
+        with self.assertRaises(ValueError):
+            timbertrek.decode_tree(["0", "-2 -1 -1"])
+
+        with self.assertRaises(ValueError):
+            timbertrek.decode_tree(["0", "1 -1"])
+
+    def test_canonical_tree_key(self):
+        """Only structurally identical trees share a key."""
+        tree_1 = timbertrek.decode_tree(["0", "1 2", "-2 -1 -1 -2"])
+        tree_2 = timbertrek.decode_tree(["0", "1 2", "-2 -1", "-1 -2"])
+        tree_3 = timbertrek.decode_tree(["0", "-2 1", "-2 2", "-2 -1"])
+        tree_4 = timbertrek.decode_tree(["0", "-2 2", "-2 1", "-2 -1"])
+
+        key_1 = timbertrek.get_canonical_tree_key(tree_1)
+        self.assertEqual(timbertrek.get_canonical_tree_key(tree_2), key_1)
+
+        # Same predictions with the splits in a different order are different
+        # trees with different leaf counts
+        self.assertNotEqual(
+            timbertrek.get_canonical_tree_key(tree_3),
+            timbertrek.get_canonical_tree_key(tree_4),
+        )
+
+    def test_transform_trie_to_rules_dedup(self):
+        """Identical trees point to their representative in treeMap, and other
+        trees keep their own hierarchy trees."""
+        trie = {
+            "0": {
+                "1 2": {
+                    "-2 -1 -1 -2": _make_leaf(0.2),
+                    "-2 -1": {"-1 -2": _make_leaf(0.25)},
+                },
+                "-2 1": {"-2 2": {"-2 -1": _make_leaf(0.2)}},
+                "-2 2": {"-2 1": {"-2 -1": _make_leaf(0.2)}},
+            }
+        }
+        decision_paths = timbertrek.transform_trie_to_rules(trie, self.data_df)
+        dedup_paths = timbertrek.transform_trie_to_rules(
+            trie, self.data_df, dedup_trees=True
+        )
+
+        self.assertEqual(dedup_paths["trie"], decision_paths["trie"])
+        self.assertEqual(dedup_paths["treeMap"][1], decision_paths["treeMap"][1])
+        self.assertEqual(dedup_paths["treeMap"][2][:2], [1, 0.25])
+        self.assertEqual(dedup_paths["treeMap"][2][2], decision_paths["treeMap"][2][2])
+        self.assertEqual(
+            decision_paths["treeMap"][2][0], decision_paths["treeMap"][1][0]
+        )
+
+        for tid in [3, 4]:
+            self.assertEqual(
+                dedup_paths["treeMap"][tid], decision_paths["treeMap"][tid]
+            )
+
+    def test_select_trie_trees(self):
+        """Trees outside the bound are dropped but keep their tree ids."""
+        trie = {
+            "0": {
+                "-2 -1": _make_leaf(0.3),
+                "-1 -2": _make_leaf(0.1),
+                "-2 1": {"-1 -2": _make_leaf(0.2)},
+                "1 -1": {"-2 -1": _make_leaf(0.1)},
+            }
+        }
+        trees = timbertrek.iter_trie_trees
+
+        selected = timbertrek.select_trie_trees(trees(trie), max_objective=0.2)
+        self.assertEqual([tid for tid, _, _ in selected], [2, 3, 4])
+
+        # Ties are broken by tree order
+        selected = timbertrek.select_trie_trees(trees(trie), top_k=2)
+        self.assertEqual([tid for tid, _, _ in selected], [2, 4])
+
+        selected = timbertrek.select_trie_trees(
+            trees(trie), max_objective=0.25, top_k=5
+        )
+        self.assertEqual([tid for tid, _, _ in selected], [2, 3, 4])
+
+    def test_transform_trie_to_rules_top_k(self):
+        """Pruned trees are left out of both the trie and the tree map."""
+        decision_paths = timbertrek.transform_trie_to_rules(self.trie, self.data_df)
+        for kwargs in [{"top_k": 1}, {"max_objective": 0.25}]:
+            pruned_paths = timbertrek.transform_trie_to_rules(
+                self.trie, self.data_df, **kwargs
+            )
+            self.assertEqual(pruned_paths["treeMap"], {1: decision_paths["treeMap"][1]})
+            self.assertEqual(
+                set(timbertrek.get_all_tree_ids(pruned_paths["trie"])), {1}
+            )
+
+    def test_compact_decision_paths(self):
+        """The compact payload decodes back to the same decision paths."""
+        trie = dict(self.trie)
+        trie["1"] = {"-2 2": {"-2 -1": _make_leaf(0.25)}}
+        trie["2"] = {"-2 1": {"-2 -1": _make_leaf(0.25)}}
+
+        for dedup_trees in [False, True]:
+            decision_paths = timbertrek.transform_trie_to_rules(
+                trie, self.data_df, dedup_trees=dedup_trees
+            )
+            compact_data = timbertrek.encode_compact_decision_paths(decision_paths)
+            self.assertEqual(
+                timbertrek.decode_compact_decision_paths(compact_data),
+                decision_paths,
+            )
+
+        with self.assertRaises(ValueError):
+            timbertrek.decode_compact_decision_paths(gzip.compress(b"{}"))
+
+    def test_shared_js_bundle(self):
+        """Shared-bundle widgets reference the bundle injected once."""
+        decision_paths = timbertrek.transform_trie_to_rules(self.trie, self.data_df)
+
+        # The JS bundle is only built for releases
+        timbertrek._js_bundle.update(base64=None, injected=False)
+        self.addCleanup(timbertrek._js_bundle.update, base64=None, injected=False)
+        with mock.patch.object(timbertrek.pkgutil, "get_data") as get_data:
+            get_data.return_value = b"console.log('timbertrek');"
+            bundle_base64 = timbertrek._get_js_bundle_base64()
+            self.assertIs(timbertrek._get_js_bundle_base64(), bundle_base64)
+            self.assertEqual(get_data.call_count, 1)
+
+        inline_html = timbertrek._make_html(decision_paths, 500)
+        shared_html = timbertrek._make_html(decision_paths, 500, shared_bundle=True)
+        self.assertIn(bundle_base64, inline_html)
+        self.assertNotIn(bundle_base64, shared_html)
+
+        with mock.patch.object(timbertrek, "display_html") as display_html:
+            timbertrek.visualize(decision_paths, shared_bundle=True)
+            timbertrek.visualize(decision_paths, shared_bundle=True)
+
+        # One bundle injection and two iframes
+        self.assertEqual(display_html.call_count, 3)
+        self.assertIn(bundle_base64, display_html.call_args_list[0][0][0])
+        self.assertNotIn(bundle_base64, display_html.call_args_list[2][0][0])
+
+    def test_get_rule_subtrie(self):
+        """Truncated nodes count the rules and trees below them."""
+        decision_paths = timbertrek.transform_trie_to_rules(self.trie, self.data_df)
+        trie = decision_paths["trie"]
+
+        self.assertIs(timbertrek.get_rule_subtrie(trie), trie)
+
+        subtrie = timbertrek.get_rule_subtrie(trie, depth=0)
+        leaf_num = len(timbertrek.get_all_tree_ids(trie))
+        self.assertEqual(subtrie, {"f": "root", "c": [], "v": leaf_num, "n": 2})
+
+        subtrie = timbertrek.get_rule_subtrie(trie, [0], depth=1)
+        self.assertEqual(subtrie["f"], trie["c"][0]["f"])
+        self.assertEqual(subtrie["n"], 2)
+        self.assertEqual(len(subtrie["c"]), len(trie["c"][0]["c"]))
+        for c in subtrie["c"]:
+            self.assertEqual(c.get("c", []), [])
+
+        # Precomputed counts give the same subtries as counting on each call
+        node_counts = timbertrek._get_rule_node_counts(trie)
+        for node_path, depth in [([], 0), ([], 2), ([0], 1), ([0, 2], 1)]:
+            self.assertEqual(
+                timbertrek.get_rule_subtrie(trie, node_path, depth, node_counts),
+                timbertrek.get_rule_subtrie(trie, node_path, depth),
+            )
+
+        with self.assertRaises(ValueError):
+            timbertrek.get_rule_subtrie(trie, [5])
+
+    def test_serve_decision_paths(self):
+        """The data server sends parts of the decision paths."""
+        decision_paths = timbertrek.transform_trie_to_rules(self.trie, self.data_df)
+        server = timbertrek.serve_decision_paths(decision_paths)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        def _get(path):
+            with urllib.request.urlopen(server.url + path) as response:
+                return json.loads(response.read())
+
+        meta = _get("/meta")
+        self.assertEqual(meta["treeNum"], 2)
+        self.assertEqual(len(meta["featureMap"]), len(decision_paths["featureMap"]))
+
+        self.assertEqual(
+            _get("/trie?depth=1"),
+            timbertrek.get_rule_subtrie(decision_paths["trie"], depth=1),
+        )
+        self.assertEqual(_get("/trie"), decision_paths["trie"])
+
+        # Node counts are computed once and reused by later requests
+        with mock.patch.object(
+            timbertrek,
+            "_get_rule_node_counts",
+            wraps=timbertrek._get_rule_node_counts,
+        ) as get_counts:
+            self.assertEqual(
+                _get("/trie?path=0&depth=1"),
+                timbertrek.get_rule_subtrie(decision_paths["trie"], [0], 1),
+            )
+            get_counts.reset_mock()
+            _get("/trie?path=0,2&depth=1")
+        get_counts.assert_not_called()
+
+        trees = _get("/trees?ids=2")
+        self.assertEqual(list(trees), ["2"])
+        self.assertEqual(trees["2"], decision_paths["treeMap"][2])
+
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            _get("/trees?ids=3")
+        self.assertEqual(context.exception.code, 400)
+
+        # Requests without the server's token are rejected
+        base_url = server.url.rsplit("/", 1)[0]
+        for url in [base_url + "/meta", base_url + "/wrong-token/meta"]:
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(url)
+            self.assertEqual(context.exception.code, 403)
+
+    def test_visualize_keeps_data_servers(self):
+        """Each served widget keeps its own data server."""
+        decision_paths = timbertrek.transform_trie_to_rules(self.trie, self.data_df)
+        self.addCleanup(timbertrek.stop_data_servers)
+
+        with mock.patch.object(timbertrek, "_make_html", return_value=""):
+            for _ in range(2):
+                timbertrek._make_iframe(
+                    decision_paths, 500, 650, False, False, True, 2, None
+                )
+
+        servers = list(timbertrek._data_servers.values())
+        self.assertEqual(len(servers), 2)
+        self.assertIsNot(servers[0], servers[1])
+        for server in servers:
+            with urllib.request.urlopen(server.url + "/meta", timeout=1) as response:
+                self.assertEqual(json.loads(response.read())["treeNum"], 2)
+
+        timbertrek.stop_data_servers()
+        self.assertEqual(timbertrek._data_servers, {})
+        for server in servers:
+            with self.assertRaises(urllib.error.URLError):
+                urllib.request.urlopen(server.url + "/meta", timeout=1)
+
+    def test_filter_index(self):
+        """The filter index matches the trees it is built from."""
+        decision_paths = timbertrek.transform_trie_to_rules(
+            self.trie, self.data_df, filter_index=True
+        )
+        filter_index = decision_paths["filterIndex"]
+        tree_map = decision_paths["treeMap"]
+
+        self.assertEqual(filter_index["treeIDs"], [1, 2])
+        self.assertEqual(filter_index["heights"], [3, 4])
+
+        # Tree 2 splits on f0 at the root, f1 and f2 at depth 2, and f3 at depth 3
+        self.assertEqual(filter_index["featureTrees"]["0"], [1, 2])
+        self.assertEqual(filter_index["featureTrees"]["3"], [2])
+        self.assertEqual(filter_index["depthFeatureTrees"]["1"], {"0": [1, 2]})
+        self.assertEqual(filter_index["depthFeatureTrees"]["3"], {"3": [2]})
+
+        for tid, min_sample in zip(filter_index["treeIDs"], filter_index["minSamples"]):
+            leaf_counts = _leaf_counts(tree_map[tid][0])
+            self.assertEqual(min_sample, min(c[0] for c in leaf_counts.values()))
+
+        self.assertEqual(
+            filter_index["sortedAccuracies"],
+            sorted(tree_map[tid][2] for tid in tree_map),
+        )
+        self.assertEqual(
+            filter_index["sortedMinSamples"], sorted(filter_index["minSamples"])
+        )
+
+        # The compact payload keeps the filter index
+        compact_data = timbertrek.encode_compact_decision_paths(decision_paths)
+        self.assertEqual(
+            timbertrek.decode_compact_decision_paths(compact_data), decision_paths
+        )
+
+    def test_filter_index_dedup(self):
+        """Deduplicated trees get the same filter index as separate trees."""
+        trie = {
+            "0": {
+                "1 2": {
+                    "-2 -1 -1 -2": _make_leaf(0.2),
+                    "-2 -1": {"-1 -2": _make_leaf(0.25)},
+                },
+                "-2 1": {"-2 2": {"-2 -1": _make_leaf(0.2)}},
+                "-2 2": {"-2 1": {"-2 -1": _make_leaf(0.2)}},
+            }
+        }
+        decision_paths = timbertrek.transform_trie_to_rules(
+            trie, self.data_df, filter_index=True
+        )
+        dedup_paths = timbertrek.transform_trie_to_rules(
+            trie, self.data_df, filter_index=True, dedup_trees=True
+        )
+        self.assertIsInstance(dedup_paths["treeMap"][2][0], int)
+
+        filter_index = decision_paths["filterIndex"]
+        dedup_index = dedup_paths["filterIndex"]
+        for key in filter_index:
+            self.assertEqual(dedup_index[key], filter_index[key])
+
+        # Trees with the same predictions keep their own depth features
+        self.assertEqual(dedup_index["depthFeatureTrees"]["2"]["1"], [1, 2, 3])
+        self.assertEqual(dedup_index["depthFeatureTrees"]["2"]["2"], [1, 2, 4])
+
+    def test_transform_trie_to_rules_cache(self):
+        """A cached result is loaded without evaluating the trees again."""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            decision_paths = timbertrek.transform_trie_to_rules(
+                self.trie, self.data_df, cache_dir=cache_dir
+            )
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            with mock.patch.object(timbertrek, "_evaluate_trees") as evaluate:
+                cached_paths = timbertrek.transform_trie_to_rules(
+                    self.trie, self.data_df, cache_dir=cache_dir
+                )
+            evaluate.assert_not_called()
+            self.assertEqual(cached_paths, decision_paths)
+
+            # Different data or options are different entries
+            data_df = self.data_df.copy()
+            data_df.iloc[0, 0] = 1 - data_df.iloc[0, 0]
+            timbertrek.transform_trie_to_rules(self.trie, data_df, cache_dir=cache_dir)
+            timbertrek.transform_trie_to_rules(
+                self.trie, self.data_df, cache_dir=cache_dir, top_k=1
+            )
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+    def test_transform_trie_to_rules_cache_temp_files(self):
+        """Stale temporary files are removed, and newer ones count toward the
+        size limit."""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            stale_file = os.path.join(cache_dir, "stale.tmp")
+            writing_file = os.path.join(cache_dir, "writing.tmp")
+            for temp_file in [stale_file, writing_file]:
+                with open(temp_file, "wb") as fp:
+                    fp.write(b"0" * 700)
+
+            stale_time = time.time() - timbertrek._CACHE_TEMP_MAX_AGE - 60
+            os.utime(stale_file, (stale_time, stale_time))
+
+            # Each entry is about 500 bytes, so only the newest one fits next
+            # to the file being written
+            for top_k in [1, 2]:
+                timbertrek.transform_trie_to_rules(
+                    self.trie,
+                    self.data_df,
+                    cache_dir=cache_dir,
+                    cache_size_limit=1500,
+                    top_k=top_k,
+                )
+
+            self.assertFalse(os.path.exists(stale_file))
+            self.assertTrue(os.path.exists(writing_file))
+            self.assertEqual(
+                len([name for name in os.listdir(cache_dir) if name.endswith(".ttrk")]),
+                1,
+            )
+
+    def test_transform_trie_to_rules_cache_damaged(self):
+        """A damaged cache entry is a miss, and it is replaced."""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            decision_paths = timbertrek.transform_trie_to_rules(
+                self.trie, self.data_df, cache_dir=cache_dir
+            )
+            cache_file = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+            with open(cache_file, "rb") as fp:
+                compact_data = fp.read()
+
+            payload = gzip.decompress(compact_data)
+            damaged_entries = [
+                # Truncated gzip stream
+                compact_data[: len(compact_data) // 2],
+                # Corrupted deflate data
+                compact_data[:10] + b"\xff" * 16 + compact_data[26:],
+                # Truncated header
+                gzip.compress(payload[:10]),
+                # Header without the arrays
+                gzip.compress(payload[:4] + struct.pack("<II", 1, 2) + b"{}"),
+            ]
+
+            for damaged_data in damaged_entries:
+                with open(cache_file, "wb") as fp:
+                    fp.write(damaged_data)
+
+                self.assertIsNone(
+                    timbertrek._load_cached_decision_paths(
+                        cache_dir, os.path.basename(cache_file)[:-5]
+                    )
+                )
+                self.assertFalse(os.path.exists(cache_file))
+
+                cached_paths = timbertrek.transform_trie_to_rules(
+                    self.trie, self.data_df, cache_dir=cache_dir
+                )
+                self.assertEqual(cached_paths, decision_paths)
+                self.assertTrue(os.path.exists(cache_file))
+
+    def test_hash_trie(self):
+        """Tries are hashed by content and key order."""
+
+        def _get_digest(trie):
+            digest = hashlib.blake2b(digest_size=20)
+            timbertrek._hash_trie(trie, digest)
+            return digest.hexdigest()
+
+        trie = json.loads(json.dumps(self.trie))
+        self.assertEqual(_get_digest(trie), _get_digest(self.trie))
+
+        # Reordered children give different tree ids
+        root_key = next(iter(trie))
+        trie[root_key] = dict(reversed(list(trie[root_key].items())))
+        self.assertNotEqual(_get_digest(trie), _get_digest(self.trie))
+
+        # Nested dicts are not mistaken for their flattened keys
+        self.assertNotEqual(
+            _get_digest({"a": {"b": 1}}), _get_digest({"a": {}, "b": 1})
+        )
+
+    def test_transform_trie_to_rules_cache_eviction(self):
+        """The least recently used results are evicted over the size limit."""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for top_k in [1, 2]:
+                timbertrek.transform_trie_to_rules(
+                    self.trie, self.data_df, cache_dir=cache_dir, top_k=top_k
+                )
+
+            # Each entry is about 500 bytes, so only the newest one fits
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            timbertrek.transform_trie_to_rules(
+                self.trie, self.data_df, cache_dir=cache_dir, cache_size_limit=600
+            )
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+    def test_update_decision_paths(self):
+        """Adding or removing rows gives the same counts as a full evaluation."""
+        head_df, tail_df = self.data_df.iloc[:400], self.data_df.iloc[400:]
+        full_paths = timbertrek.transform_trie_to_rules(
+            self.trie, self.data_df, filter_index=True
+        )
+
+        decision_paths = timbertrek.transform_trie_to_rules(
+            self.trie, head_df, filter_index=True
+        )
+        sample_num = timbertrek.update_decision_paths(decision_paths, tail_df)
+        self.assertEqual(sample_num, 500)
+        self.assertEqual(decision_paths, full_paths)
+
+        sample_num = timbertrek.update_decision_paths(
+            decision_paths, removed_df=tail_df, sample_num=sample_num
+        )
+        self.assertEqual(sample_num, 400)
+        self.assertEqual(
+            decision_paths,
+            timbertrek.transform_trie_to_rules(self.trie, head_df, filter_index=True),
+        )
+
+        # Removing rows that were never counted changes nothing
+        small_paths = timbertrek.transform_trie_to_rules(self.trie, tail_df)
+        with self.assertRaises(ValueError):
+            timbertrek.update_decision_paths(small_paths, removed_df=head_df)
+        self.assertEqual(
+            small_paths, timbertrek.transform_trie_to_rules(self.trie, tail_df)
+        )
+
+    def test_transform_trie_to_rules_approximate(self):
+        """Sampled counts are scaled to the data, and refining makes them exact."""
+        decision_paths = timbertrek.transform_trie_to_rules(self.trie, self.data_df)
+
+        # Sampling all rows gives exact results with empty intervals
+        full_paths = timbertrek.transform_trie_to_rules(
+            self.trie, self.data_df, approximate=True, sample_size=1000
+        )
+        approximation = full_paths.pop("approximation")
+        self.assertEqual(full_paths, decision_paths)
+        self.assertEqual(approximation["sampleNum"], 500)
+        self.assertEqual(approximation["exactNum"], 2)
+        self.assertEqual(approximation["maxError"], 0)
+        for tid, interval in zip(approximation["treeIDs"], approximation["intervals"]):
+            self.assertEqual(interval, [decision_paths["treeMap"][tid][2]] * 2)
+
+        sampled_paths = timbertrek.transform_trie_to_rules(
+            self.trie, self.data_df, approximate=True, sample_size=200
+        )
+        approximation = sampled_paths["approximation"]
+        self.assertEqual(approximation["sampleNum"], 200)
+        self.assertEqual(approximation["dataNum"], 500)
+
+        for tid, interval in zip(approximation["treeIDs"], approximation["intervals"]):
+            tree_entry = sampled_paths["treeMap"][tid]
+            self.assertLessEqual(interval[0], tree_entry[2])
+            self.assertLessEqual(tree_entry[2], interval[1])
+            self.assertLess(interval[1] - interval[0], 0.2)
+            self.assertAlmostEqual(tree_entry[0]["f"][1], 500, delta=5)
+
+        self.assertEqual(approximation["exact"], [False, False])
+        self.assertEqual(approximation["exactNum"], 0)
+
+        timbertrek.refine_decision_paths(sampled_paths, self.data_df, [2])
+        self.assertEqual(sampled_paths["treeMap"][2], decision_paths["treeMap"][2])
+        self.assertEqual(
+            approximation["intervals"][1], [decision_paths["treeMap"][2][2]] * 2
+        )
+
+        # The summary only counts the refined tree as exact, and its error
+        # comes from the tree that is still approximate
+        lower, upper = approximation["intervals"][0]
+        self.assertEqual(approximation["exact"], [False, True])
+        self.assertEqual(approximation["exactNum"], 1)
+        self.assertEqual(approximation["maxError"], round((upper - lower) / 2, 5))
+
+    def test_update_decision_paths_approximate(self):
+        """Updating an approximate result moves its intervals with the new
+        accuracies, and exact trees keep empty intervals."""
+        head_df, tail_df = self.data_df.iloc[:400], self.data_df.iloc[400:]
+        decision_paths = timbertrek.transform_trie_to_rules(
+            self.trie, head_df, approximate=True, sample_size=200
+        )
+        timbertrek.refine_decision_paths(decision_paths, head_df, [2])
+        approximation = decision_paths["approximation"]
+        old_interval = approximation["intervals"][0]
+        old_accuracy = decision_paths["treeMap"][1][2]
+
+        timbertrek.update_decision_paths(decision_paths, tail_df, sample_num=400)
+        self.assertEqual(approximation["dataNum"], 500)
+
+        tree_map = decision_paths["treeMap"]
+        lower, upper = approximation["intervals"][0]
+        self.assertLessEqual(lower, tree_map[1][2])
+        self.assertLessEqual(tree_map[1][2], upper)
+        self.assertAlmostEqual(
+            tree_map[1][2] - lower, (old_accuracy - old_interval[0]) * 0.8, places=4
+        )
+        self.assertEqual(approximation["intervals"][1], [tree_map[2][2]] * 2)
+        self.assertEqual(approximation["exact"], [False, True])
+        self.assertEqual(approximation["maxError"], round((upper - lower) / 2, 5))
+
+    def test_sample_rows_stratified(self):
+        """Each label keeps its share of the sample."""
+        y_all = np.array([0] * 90 + [1] * 10)
+        sample_rows, strata = timbertrek.sample_rows_stratified(y_all, 20)
+
+        self.assertEqual(strata, {0: (90, 18), 1: (10, 2)})
+        self.assertEqual(len(set(sample_rows)), 20)
+        self.assertEqual(int(y_all[sample_rows].sum()), 2)
+
+        self.assertEqual(timbertrek.get_approximate_sample_size(0.01), 9604)
+
+        with self.assertRaises(ValueError):
+            timbertrek.sample_rows_stratified(np.array([0, 1, 2]), 2)
+
+    def test_transform_trie_to_rules_chunked(self):
+        """Counts accumulated over row blocks match the in-memory counts."""
+        decision_paths = timbertrek.transform_trie_to_rules(self.trie, self.data_df)
+        columns = self.data_df.columns.tolist()
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            npy_path = os.path.join(data_dir, "data.npy")
+            np.save(npy_path, self.data_df.to_numpy())
+            csv_path = os.path.join(data_dir, "data.csv")
+            self.data_df.to_csv(csv_path, index=False)
+
+            all_data = [
+                (self.data_df, {"chunk_size": 64}),
+                (npy_path, {"feature_names": columns}),
+                (csv_path, {"chunk_size": 100}),
+                (pd.read_csv(csv_path, chunksize=128), {}),
+                (
+                    np.array_split(self.data_df.to_numpy(), 3),
+                    {"feature_names": columns},
+                ),
+                (self.data_df, {"chunk_size": 64, "rule_cache": {}}),
+            ]
+
+            for data, kwargs in all_data:
+                if "rule_cache" in kwargs:
+                    kwargs["rule_cache"] = timbertrek.make_rule_cache()
+                chunked_paths = timbertrek.transform_trie_to_rules(
+                    self.trie, data, **kwargs
+                )
+                self.assertEqual(chunked_paths, decision_paths)
+
+        with self.assertRaises(ValueError):
+            timbertrek.transform_trie_to_rules(self.trie, [self.x_all])
+
+    def test_synthetic_trie(self):
+        """Synthetic tries are in the GOSDT trie format with equivalent trees."""
+        from benchmarks.synthetic import make_synthetic_data, make_synthetic_trie
+
+        trie = make_synthetic_trie(tree_num=200, max_depth=3, duplicate_rate=0.5)
+        data_df = make_synthetic_data(sample_num=100)
+
+        tree_map = timbertrek.compile_tree_map(trie)
+        self.assertEqual(tree_map["count"], 200)
+        for tree_strings, _ in tree_map["map"].values():
+            timbertrek.decode_tree(tree_strings)
+
+        # Equivalent trees have different splits, so they are not merged
+        decision_paths = timbertrek.transform_trie_to_rules(
+            trie, data_df, dedup_trees=True
+        )
+        self.assertEqual(
+            decision_paths, timbertrek.transform_trie_to_rules(trie, data_df)
+        )
+
+    def test_transform_trie_to_rules_stats(self):
+        """Progress and stage events reach the callback, and stats are returned."""
+        events = []
+        stderr = io.StringIO()
+
+        tracemalloc.start()
+        try:
+            # An earlier peak of the caller
+            buffer = bytearray(1 << 24)
+            del buffer
+
+            with redirect_stderr(stderr):
+                decision_paths, stats = timbertrek.transform_trie_to_rules(
+                    self.trie,
+                    self.data_df,
+                    dedup_trees=True,
+                    quiet=True,
+                    callback=events.append,
+                    return_stats=True,
+                )
+
+            # The caller's peak is kept
+            self.assertGreaterEqual(tracemalloc.get_traced_memory()[1], 1 << 24)
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(stderr.getvalue(), "")
+        self.assertEqual(
+            decision_paths,
+            timbertrek.transform_trie_to_rules(
+                self.trie, self.data_df, dedup_trees=True
+            ),
+        )
+
+        progress = [e for e in events if e["type"] == "progress"]
+        self.assertEqual([e["done"] for e in progress], [1, 2])
+        self.assertEqual(progress[-1]["total"], 2)
+
+        stages = [e["stage"] for e in events if e["type"] == "stage"]
+        self.assertEqual(stages, list(stats["stages"]))
+        self.assertIn("evaluate_trees", stages)
+        self.assertEqual(events[-1], {"type": "end", "stats": stats})
+
+        self.assertEqual(stats["treeNum"], 2)
+        self.assertEqual(stats["uniqueTreeNum"], 2)
+        self.assertEqual(stats["ruleNum"], 6)
+        self.assertEqual(stats["sampleNum"], 500)
+        self.assertFalse(stats["cacheHit"])
+        for metrics in stats["stages"].values():
+            self.assertGreaterEqual(metrics["time"], 0)
+            self.assertGreaterEqual(metrics["peakMemory"], 0)
+
+        # Without tracemalloc, peak memory is not recorded
+        _, stats = timbertrek.transform_trie_to_rules(
+            self.trie, self.data_df, quiet=True, return_stats=True
+        )
+        self.assertIsNone(stats["stages"]["evaluate_trees"]["peakMemory"])
+
+    def test_transform_trie_to_rules_async(self):
+        """Background conversion can be awaited, reports progress, and stops
+        once it is cancelled."""
+        decision_paths = timbertrek.transform_trie_to_rules(self.trie, self.data_df)
+
+        future = timbertrek.transform_trie_to_rules_async(self.trie, self.data_df)
+        self.assertEqual(future.result(timeout=10), decision_paths)
+        self.assertEqual(future.progress["done"], 2)
+
+        async def convert():
+            return await asyncio.wrap_future(
+                timbertrek.transform_trie_to_rules_async(self.trie, self.data_df)
+            )
+
+        self.assertEqual(asyncio.run(convert()), decision_paths)
+
+        # Hold the conversion at the first tree, and cancel it
+        events = []
+        first_tree = threading.Event()
+        resume = threading.Event()
+
+        def callback(event):
+            events.append(event)
+            if event["type"] == "progress":
+                first_tree.set()
+                resume.wait(10)
+
+        # Keep the bars referenced, so only an explicit close() closes them
+        bars = []
+
+        class ProgressBar(tqdm):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.is_closed = False
+                bars.append(self)
+
+            def close(self):
+                self.is_closed = True
+                super().close()
+
+        with mock.patch.object(timbertrek, "tqdm", ProgressBar):
+            future = timbertrek.transform_trie_to_rules_async(
+                self.trie, self.data_df, callback=callback
+            )
+            self.assertTrue(first_tree.wait(10))
+            self.assertTrue(future.cancel())
+            resume.set()
+
+            for thread in threading.enumerate():
+                if thread.name == "timbertrek-transform":
+                    thread.join(10)
+
+        self.assertTrue(future.cancelled())
+        self.assertEqual(events[-1]["type"], "progress")
+        self.assertEqual(events[-1]["done"], 1)
+
+        # The progress bar of the stopped conversion is closed
+        self.assertEqual(len(bars), 1)
+        self.assertTrue(bars[0].is_closed)
+
+    def test_visualize_pending(self):
+        """A pending result shows a placeholder that becomes the widget."""
+        future = timbertrek.transform_trie_to_rules_async(self.trie, self.data_df)
+
+        with mock.patch.object(
+            timbertrek, "_make_html", return_value="timbertrek-html"
+        ), mock.patch.object(timbertrek, "display") as display, mock.patch.object(
+            timbertrek, "update_display"
+        ) as update_display:
+            timbertrek.visualize(future)
+            future.result(timeout=10)
+
+            content = ""
+            for _ in range(100):
+                if update_display.call_count > 0:
+                    content = update_display.call_args[0][0]["text/html"]
+                    if "<iframe" in content:
+                        break
+                time.sleep(0.05)
+
+        self.assertIn("Generating decision paths", display.call_args[0][0]["text/html"])
+        self.assertIn('srcdoc="timbertrek-html"', content)
+        self.assertEqual(
+            display.call_args[1]["display_id"],
+            update_display.call_args[1]["display_id"],
+        )
+
+    def test_transform_trie_to_rules_splits(self):
+        """One pass over all splits gives the counts of separate runs."""
+        train_df, test_df = self.data_df.iloc[:300], self.data_df.iloc[300:]
+        split_dfs = {"test": test_df, "train": train_df}
+
+        def get_leaf_counts(decision_paths, key):
+            leaf_counts = {}
+            for tid, tree_entry in decision_paths["treeMap"].items():
+                if isinstance(tree_entry[0], int):
+                    continue
+                nodes = timbertrek.compile_tree(tree_entry[0])[0]
+                leaf_counts[tid] = [n[key] for n in nodes if "c" not in n]
+            return leaf_counts
+
+        for n_jobs in [1, 2]:
+            decision_paths = timbertrek.transform_trie_to_rules(
+                self.trie, train_df, splits=split_dfs, n_jobs=n_jobs, dedup_trees=True
+            )
+            self.assertEqual(decision_paths["splits"], ["test", "train"])
+
+            for i, split_df in enumerate(split_dfs.values()):
+                split_paths = timbertrek.transform_trie_to_rules(self.trie, split_df)
+                split_counts = get_leaf_counts(split_paths, "f")
+                for tid, counts in get_leaf_counts(decision_paths, "s").items():
+                    self.assertEqual(
+                        [c[i] for c in counts], [f[1:] for f in split_counts[tid]]
+                    )
+                    self.assertEqual(
+                        decision_paths["treeMap"][tid][3][i],
+                        split_paths["treeMap"][tid][2],
+                    )
+
+            # The main counts come from the main data
+            train_paths = timbertrek.transform_trie_to_rules(self.trie, train_df)
+            self.assertEqual(
+                get_leaf_counts(decision_paths, "f"), get_leaf_counts(train_paths, "f")
+            )
+
+            compact_data = timbertrek.encode_compact_decision_paths(decision_paths)
+            self.assertEqual(
+                timbertrek.decode_compact_decision_paths(compact_data), decision_paths
+            )
+
+        # A split column is not a feature, and the main counts use all rows
+        split_df = self.data_df.copy()
+        split_df.insert(0, "split", ["a"] * 100 + ["b"] * 400)
+        decision_paths = timbertrek.transform_trie_to_rules(
+            self.trie, split_df, splits="split"
+        )
+        all_paths = timbertrek.transform_trie_to_rules(self.trie, self.data_df)
+        self.assertEqual(decision_paths["splits"], ["a", "b"])
+        self.assertEqual(decision_paths["featureMap"], all_paths["featureMap"])
+        self.assertEqual(
+            get_leaf_counts(decision_paths, "f"), get_leaf_counts(all_paths, "f")
+        )
+        for counts in get_leaf_counts(decision_paths, "s").values():
+            self.assertEqual(sum(c[0][0] for c in counts), 100)
+            self.assertEqual(sum(c[1][0] for c in counts), 400)
+
+        with self.assertRaises(ValueError):
+            timbertrek.transform_trie_to_rules(
+                self.trie, train_df, splits=split_dfs, pack_bits=True
+            )
+
+        # Split counts cannot be kept in sync with updated or refined counts
+        decision_paths = timbertrek.transform_trie_to_rules(
+            self.trie, train_df, splits=split_dfs
+        )
+        expected_paths = json.loads(json.dumps(decision_paths))
+        with self.assertRaises(ValueError):
+            timbertrek.update_decision_paths(decision_paths, test_df)
+        with self.assertRaises(ValueError):
+            timbertrek.refine_decision_paths(decision_paths, train_df, [1])
+        self.assertEqual(json.loads(json.dumps(decision_paths)), expected_paths)
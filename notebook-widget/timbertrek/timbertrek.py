@@ -1,14 +1,36 @@
 import numpy as np
 import re
 import random
+import secrets
 import html
 import base64
 import pkgutil
-
+import hashlib
+import heapq
+import os
+import codecs
+import gzip
+import struct
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+
+from array import array
 from tqdm import tqdm
-from collections import deque
-from IPython.display import display_html
-from json import dump, load, dumps
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait
+from concurrent.futures import FIRST_COMPLETED, CancelledError, Future
+from concurrent.futures import InvalidStateError
+from itertools import chain, islice
+from statistics import NormalDist
+from multiprocessing import shared_memory
+from IPython.display import display, display_html, update_display
+from json import dump, load, dumps, loads
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
 
 
 def transform_trie(trie):
@@ -190,7 +212,7 @@ def get_feature_map(feature_header, feature_description_map):
     return feature_map
 
 
-def build_tree_map(trie, tree_map, tree_strings=[], objective="acc"):
+def build_tree_map(trie, tree_map, tree_strings=None, objective="acc"):
     """
     Map each tree to a unique number
 
@@ -201,6 +223,9 @@ def build_tree_map(trie, tree_map, tree_strings=[], objective="acc"):
         objective (string): name of the leaf node objective key
     """
 
+    if tree_strings is None:
+        tree_strings = []
+
     # Hit the terminal node
     if objective in trie:
         # Record this tree
@@ -212,122 +237,491 @@ def build_tree_map(trie, tree_map, tree_strings=[], objective="acc"):
     for k in trie:
         new_tree_strings = [s for s in tree_strings]
         new_tree_strings.append(k)
-        build_tree_map(trie[k], tree_map, new_tree_strings)
+        build_tree_map(trie[k], tree_map, new_tree_strings, objective)
 
     return
 
 
-def get_decision_rules(tree_strings):
-    """Generate a set of decision rules used by a tree
+def iter_trie_trees(trie, metric_name="objective"):
+    """Walk a loaded trie once without recursion and yield its trees in the
+    same order as build_tree_map(). Trees share one path stack, so each tree
+    only copies its strings once.
 
     Args:
-        tree_strings ([string]): Tree strings parsed form the trie
+        trie (dict): The original trie
+        metric_name (str, optional): Termination key. Defaults to 'objective'.
+
+    Yields:
+        tuple: (tree strings, objective)
+    """
+
+    if metric_name in trie:
+        yield [], trie[metric_name]
+        return
+
+    path = []
+    working_stack = [iter(trie.items())]
+
+    while len(working_stack) > 0:
+        item = next(working_stack[-1], None)
+
+        if item is None:
+            # Finish this subtrie and go back to its parent
+            working_stack.pop()
+            if len(path) > 0:
+                path.pop()
+            continue
+
+        k, subtrie = item
+        if metric_name in subtrie:
+            yield path + [k], subtrie[metric_name]
+        else:
+            path.append(k)
+            working_stack.append(iter(subtrie.items()))
+
+
+def compile_tree_map(trie, metric_name="objective"):
+    """Map each tree to a unique number in one pass over the original trie.
+    It gives the same tree map as transform_trie() + build_tree_map() without
+    copying the trie.
+
+    Args:
+        trie (dict): The original trie
+        metric_name (str, optional): Termination key. Defaults to 'objective'.
 
     Returns:
-        set: A set of decision rules
+        dict: {'count': # trees, 'map': {tree id: [tree strings, objective]}}
     """
 
-    working_queue = deque()
+    tree_stream = iter_trie_trees(trie, metric_name)
+    tree_arrays = compile_tree_arrays(
+        (tid, tree_strings, objective)
+        for tid, (tree_strings, objective) in enumerate(tree_stream, start=1)
+    )
+    return export_tree_map(tree_arrays)
 
-    # Each queue item is a list [feature_id, previous_feature_ids]
-    working_queue.append([tree_strings[0], []])
-    i = 1
-    decision_rules = set()
 
-    while len(working_queue) > 0:
-        cur_feature, pre_features = working_queue.popleft()
+def compile_tree_arrays(tree_stream, string_ids=None):
+    """Pack trees into contiguous arrays instead of a dict of string lists.
+    Each distinct tree string (trie key) is stored once in a string table,
+    and trees only keep the ids of their strings, so the memory of a large
+    Rashomon set does not go to per-object overhead.
+
+    Args:
+        tree_stream (iter): An iterable of (tree id, tree strings, objective),
+            such as the output of select_trie_trees()
+        string_ids (dict, optional): {tree string: token id} table to add the
+            strings to, so that several packed maps share token ids. Defaults
+            to a new table.
+
+    Returns:
+        dict: {
+            'count': # trees,
+            'strings': [distinct tree strings],
+            'ids': tree id of each tree,
+            'offsets': tree i has the tokens [offsets[i], offsets[i + 1]),
+            'tokens': string table index of each tree string,
+            'objectives': objective of each tree
+        }
+    """
+
+    if string_ids is None:
+        string_ids = {}
+
+    ids = array("q")
+    offsets = array("q", [0])
+    tokens = array("i")
+    objectives = array("d")
+
+    for tid, tree_strings, objective in tree_stream:
+        for tree_string in tree_strings:
+            token = string_ids.get(tree_string)
+            if token is None:
+                token = len(string_ids)
+                string_ids[tree_string] = token
+            tokens.append(token)
+
+        ids.append(tid)
+        offsets.append(len(tokens))
+        objectives.append(objective)
+
+    return {
+        "count": len(ids),
+        "strings": list(string_ids),
+        "ids": np.array(ids, dtype=np.int64),
+        "offsets": np.array(offsets, dtype=np.int64),
+        "tokens": np.array(tokens, dtype=np.int32),
+        "objectives": np.array(objectives, dtype=np.float64),
+    }
+
+
+def iter_tree_arrays(tree_arrays):
+    """Yield the trees of a packed tree map in the same format as
+    select_trie_trees(). Tree strings are shared with the string table.
+
+    Args:
+        tree_arrays (dict): Packed trees generated by compile_tree_arrays()
+
+    Yields:
+        tuple: (tree id, tree strings, objective)
+    """
+
+    strings = tree_arrays["strings"]
+    offsets = tree_arrays["offsets"].tolist()
+    tokens = tree_arrays["tokens"]
+
+    for i, (tid, objective) in enumerate(
+        zip(tree_arrays["ids"].tolist(), tree_arrays["objectives"].tolist())
+    ):
+        tree_tokens = tokens[offsets[i] : offsets[i + 1]].tolist()
+        yield tid, [strings[t] for t in tree_tokens], objective
+
+
+def export_tree_map(tree_arrays):
+    """Convert packed trees to the tree map dict of build_tree_map().
+
+    Args:
+        tree_arrays (dict): Packed trees generated by compile_tree_arrays()
+
+    Returns:
+        dict: {'count': # trees, 'map': {tree id: [tree strings, objective]}}
+    """
+
+    tree_map = {"count": tree_arrays["count"], "map": {}}
+
+    for tid, tree_strings, objective in iter_tree_arrays(tree_arrays):
+        tree_map["map"][tid] = [tree_strings, round(objective, 5)]
+
+    return tree_map
+
+
+# Tokens of the trie json: punctuation, strings, numbers, and literals
+_JSON_TOKEN_RE = re.compile(
+    r"""\s*(?:([{}\[\]:,])|"((?:[^"\\]|\\.)*)"|"""
+    r"""(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)|(true|false|null))"""
+)
+_JSON_LITERALS = {"true": True, "false": False, "null": None}
+
+
+def stream_trie_trees(trie_file, metric_name="objective", chunk_size=1 << 16):
+    """Parse a Rashomon trie json file incrementally and yield its trees one at
+    a time, in the same order as build_tree_map(). Only the current path of the
+    trie is kept in memory, so memory use depends on the tree depth instead of
+    the size of the Rashomon set. Keys are interned, so trees that are kept
+    share one string object for each distinct key, like json.load() does.
+
+    Args:
+        trie_file (str | file): Path of the trie json file, or a file object
+            opened in text or binary mode
+        metric_name (str, optional): Termination key. Defaults to 'objective'.
+        chunk_size (int, optional): # characters to read at a time.
+            Defaults to 65536.
+
+    Yields:
+        tuple: (tree strings, objective)
+    """
+
+    if isinstance(trie_file, (str, os.PathLike)):
+        with open(trie_file, "r", encoding="utf-8") as fp:
+            yield from stream_trie_trees(fp, metric_name, chunk_size)
+        return
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+
+    # Keys from the root to the current object, and scalar values of each open
+    # object (the terminal object holds the metrics)
+    path = []
+    scalar_stack = []
+    cur_key = None
+    keys = {}
+
+    buffer = ""
+    pos = 0
+    is_eof = False
+
+    while True:
+        match = _JSON_TOKEN_RE.match(buffer, pos)
+
+        # Read more if a token might be cut off at the end of the buffer (a
+        # number cut as '1.' or '1e-' still matches its first 1-2 characters)
+        if not is_eof and (match is None or match.end() > len(buffer) - 3):
+            chunk = trie_file.read(chunk_size)
+            if isinstance(chunk, bytes):
+                chunk = decoder.decode(chunk, final=len(chunk) == 0)
+            is_eof = len(chunk) == 0
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+
+        if match is None:
+            if buffer[pos:].strip() != "":
+                raise ValueError(
+                    f"Error: invalid trie json near '{buffer[pos : pos + 20]}'."
+                )
+            break
+
+        pos = match.end()
+        punctuation, string, number, literal = match.groups()
+
+        if punctuation == "{":
+            if cur_key is not None:
+                path.append(cur_key)
+            scalar_stack.append((cur_key is not None, {}))
+            cur_key = None
+
+        elif punctuation == "}":
+            has_key, scalars = scalar_stack.pop()
+            if metric_name in scalars:
+                yield list(path), scalars[metric_name]
+            if has_key:
+                path.pop()
+
+        elif punctuation == "[" or punctuation == "]":
+            raise ValueError("Error: the trie json should not contain arrays.")
+
+        elif string is not None:
+            if "\\" in string:
+                string = loads(f'"{string}"')
+
+            # A string is a key unless it is the value of the current key
+            if cur_key is None:
+                cur_key = keys.setdefault(string, string)
+            else:
+                scalar_stack[-1][1][cur_key] = string
+                cur_key = None
+
+        elif number is not None or literal is not None:
+            if number is not None:
+                value = float(number) if re.search(r"[.eE]", number) else int(number)
+            else:
+                value = _JSON_LITERALS[literal]
+            scalar_stack[-1][1][cur_key] = value
+            cur_key = None
+
+
+def select_trie_trees(tree_stream, max_objective=None, top_k=None):
+    """Number the trees of a tree stream the same way as build_tree_map(), and
+    only keep trees within an objective bound. Tree strings are never decoded
+    here, so trees outside the bound cost nothing beyond being read.
+
+    Args:
+        tree_stream (iter): An iterable of (tree strings, objective)
+        max_objective (float, optional): Only keep trees with an objective
+            no larger than it. Defaults to None (no bound).
+        top_k (int, optional): Only keep the k trees with the smallest
+            objectives, breaking ties by tree order. A bounded heap holds the
+            current best trees, so the stream is consumed before the first
+            tree is yielded. Defaults to None (keep all).
+
+    Yields:
+        tuple: (tree id, tree strings, objective), in the trie order
+    """
+
+    def _iter_numbered_trees():
+        tid = 0
+        for tree_strings, objective in tree_stream:
+            tid += 1
+
+            if len(tree_strings) <= 1:
+                # Skip this subtrie if the root is a decision
+                continue
+
+            if max_objective is not None and objective > max_objective:
+                continue
+
+            yield tid, tree_strings, objective
+
+    if top_k is None:
+        yield from _iter_numbered_trees()
+        return
+
+    if top_k <= 0:
+        return
+
+    # Max-heap on (objective, tree id), so its top is the worst kept tree
+    best_trees = []
+    for tid, tree_strings, objective in _iter_numbered_trees():
+        item = (-objective, -tid, tree_strings)
+        if len(best_trees) < top_k:
+            heapq.heappush(best_trees, item)
+        elif item > best_trees[0]:
+            heapq.heapreplace(best_trees, item)
+
+    for neg_objective, neg_tid, tree_strings in sorted(
+        best_trees, key=lambda item: -item[1]
+    ):
+        yield -neg_tid, tree_strings, -neg_objective
+
+
+def decode_tree(tree_strings):
+    """Decode a tree's BFS string encoding into a compact node table.
+
+    tree_strings[0] is the root feature id. Each following string has an even
+    number of values: every pair holds the (true, false) children of the next
+    unfinished node in BFS order, and one string can hold any number of
+    pairs. A child is a feature id, or a leaf: '-2' means positive and '-1'
+    means negative.
+
+    Nodes are numbered in BFS order, same as compile_tree(), so the root is
+    always node 0 and a child always has a larger id than its parent.
+
+    Args:
+        tree_strings ([string]): Tree strings parsed from the trie
 
-        cur_string = tree_strings[i]
+    Returns:
+        np.array: Feature index of each node (-1 for leaf nodes)
+        np.array: Left (true) child id of each node (-1 for leaf nodes)
+        np.array: Right (false) child id of each node (-1 for leaf nodes)
+        np.array: Predicted label of each node (1 for '+', 0 for '-', -1 for
+            non-leaf nodes)
+    """
+
+    features, lefts, rights, labels = [int(tree_strings[0])], [-1], [-1], [-1]
+
+    # Queue of node ids waiting for their children
+    working_queue = deque([0])
+
+    for cur_string in tree_strings[1:]:
         cur_string_split = cur_string.split()
 
-        if len(cur_string_split) == 2:
-            # Case 1: there are two values
-            for j, s in enumerate(cur_string_split):
-                formated_cur_feature = cur_feature
-                formated_cur_feature += "t" if j == 0 else "f"
-                cur_features = pre_features + [formated_cur_feature]
-                if s == "-1" or s == "-2":
-                    # We hit a decision node, add this decision rule chain
-                    decision_rules.add((tuple(cur_features), "+" if s == "-2" else "-"))
-                else:
-                    working_queue.append([s, cur_features])
+        if len(cur_string_split) % 2 != 0:
+            raise ValueError("Error: current string size is not even.")
+
+        for pair_i in range(0, len(cur_string_split), 2):
+            if len(working_queue) == 0:
+                raise ValueError("Error: tree strings have more pairs than nodes.")
 
-        elif len(cur_string_split) == 4:
-            # Case 2: there are four values: the first two correspond to the cur item
-            # and the last two correspond to the next item in the queue
-            for j, s in enumerate(cur_string_split[:2]):
+            cur_node = working_queue.popleft()
+            child_ids = []
 
-                formated_cur_feature = cur_feature
-                formated_cur_feature += "t" if j == 0 else "f"
-                cur_features = pre_features + [formated_cur_feature]
+            for s in cur_string_split[pair_i : pair_i + 2]:
+                child_ids.append(len(features))
+                lefts.append(-1)
+                rights.append(-1)
 
                 if s == "-1" or s == "-2":
-                    decision_rules.add((tuple(cur_features), "+" if s == "-2" else "-"))
+                    # We hit a decision node, add a leaf to this branch
+                    features.append(-1)
+                    labels.append(1 if s == "-2" else 0)
                 else:
-                    working_queue.append([s, cur_features])
+                    features.append(int(s))
+                    labels.append(-1)
+                    working_queue.append(child_ids[-1])
 
-            # Load the next item in the queue
-            cur_feature, pre_features = working_queue.popleft()
+            lefts[cur_node], rights[cur_node] = child_ids
 
-            for j, s in enumerate(cur_string_split[2:]):
+    if len(working_queue) > 0:
+        raise ValueError("Error: tree strings end before all nodes are split.")
 
-                formated_cur_feature = cur_feature
-                formated_cur_feature += "t" if j == 0 else "f"
-                cur_features = pre_features + [formated_cur_feature]
+    return (
+        np.array(features, dtype=np.intp),
+        np.array(lefts, dtype=np.intp),
+        np.array(rights, dtype=np.intp),
+        np.array(labels, dtype=np.int8),
+    )
 
-                if s == "-1" or s == "-2":
-                    decision_rules.add((tuple(cur_features), "+" if s == "-2" else "-"))
-                else:
-                    working_queue.append([s, cur_features])
 
-        elif len(cur_string_split) == 6:
-            # Case 3: there are six values: the first two correspond to the cur item
-            # and the last four correspond to the next two items in the queue
-            for j, s in enumerate(cur_string_split[:2]):
+def _get_table_decision_rules(tree_table):
+    """Generate the set of decision rules from a decoded node table.
+
+    Args:
+        tree_table (tuple): (features, lefts, rights, labels) generated by
+            decode_tree()
 
-                formated_cur_feature = cur_feature
-                formated_cur_feature += "t" if j == 0 else "f"
-                cur_features = pre_features + [formated_cur_feature]
+    Returns:
+        set: A set of decision rules
+    """
 
-                if s == "-1" or s == "-2":
-                    decision_rules.add((tuple(cur_features), "+" if s == "-2" else "-"))
-                else:
-                    working_queue.append([s, cur_features])
+    features, lefts, rights, labels = (a.tolist() for a in tree_table)
+    decision_rules = set()
 
-            # Load the next item in the queue
-            cur_feature, pre_features = working_queue.popleft()
+    # Each queue item is a list [node id, previous features]
+    working_queue = deque([[0, ()]])
 
-            for j, s in enumerate(cur_string_split[2:4]):
+    while len(working_queue) > 0:
+        cur_node, pre_features = working_queue.popleft()
+        cur_feature = str(features[cur_node])
 
-                formated_cur_feature = cur_feature
-                formated_cur_feature += "t" if j == 0 else "f"
-                cur_features = pre_features + [formated_cur_feature]
+        for child, direction in [(lefts[cur_node], "t"), (rights[cur_node], "f")]:
+            cur_features = pre_features + (cur_feature + direction,)
 
-                if s == "-1" or s == "-2":
-                    decision_rules.add((tuple(cur_features), "+" if s == "-2" else "-"))
-                else:
-                    working_queue.append([s, cur_features])
+            if features[child] < 0:
+                # We hit a decision node, add this decision rule chain
+                decision_rules.add((cur_features, "+" if labels[child] == 1 else "-"))
+            else:
+                working_queue.append([child, cur_features])
 
-            # Load the next item in the queue
-            cur_feature, pre_features = working_queue.popleft()
+    return decision_rules
 
-            for j, s in enumerate(cur_string_split[4:]):
 
-                formated_cur_feature = cur_feature
-                formated_cur_feature += "t" if j == 0 else "f"
-                cur_features = pre_features + [formated_cur_feature]
+def get_decision_rules(tree_strings):
+    """Generate a set of decision rules used by a tree
+
+    Args:
+        tree_strings ([string]): Tree strings parsed form the trie
+
+    Returns:
+        set: A set of decision rules
+    """
+
+    return _get_table_decision_rules(decode_tree(tree_strings))
 
-                if s == "-1" or s == "-2":
-                    decision_rules.add((tuple(cur_features), "+" if s == "-2" else "-"))
-                else:
-                    working_queue.append([s, cur_features])
 
+def _get_table_hierarchy_tree(tree_table):
+    """Convert a decoded node table to a hierarchy dict.
+
+    Args:
+        tree_table (tuple): (features, lefts, rights, labels) generated by
+            decode_tree()
+
+    Returns:
+        list: Hierarchy dict nodes indexed by their node id (the first node is
+            the root)
+    """
+
+    features, lefts, rights, labels = (a.tolist() for a in tree_table)
+    nodes = []
+
+    for i, feature in enumerate(features):
+        if feature >= 0:
+            nodes.append({"f": [str(feature)], "c": []})
         else:
-            raise ValueError("Error: encounter string size either 2 nor 4 nor 6")
+            nodes.append({"f": ["+"] if labels[i] == 1 else ["-"]})
 
-        i += 1
+    # Children always have larger ids, so all nodes exist already
+    for i, feature in enumerate(features):
+        if feature >= 0:
+            nodes[i]["c"] = [nodes[lefts[i]], nodes[rights[i]]]
 
-    return decision_rules
+    return nodes
+
+
+def _copy_hierarchy_tree(root):
+    """Copy an annotated hierarchy tree, so that changing the copy in place
+    (e.g., with update_decision_paths()) leaves the original as it is.
+
+    Args:
+        root (dict): The root node of the tree
+
+    Returns:
+        dict: The root node of the copy
+    """
+
+    new_root = {}
+    stack = [(root, new_root)]
+
+    while stack:
+        node, new_node = stack.pop()
+        for key, value in node.items():
+            if key == "c":
+                new_node["c"] = [{} for _ in value]
+                stack.extend(zip(value, new_node["c"]))
+            else:
+                # Node counts are flat lists, and split counts are lists of
+                # [# samples, # correct samples]
+                new_node[key] = [list(v) if isinstance(v, list) else v for v in value]
+
+    return new_root
 
 
 def get_hierarchy_tree(tree_strings):
@@ -347,59 +741,79 @@ def get_hierarchy_tree(tree_strings):
         tree_strings ([string]): tree strings parsed from the trie
     """
 
-    working_queue = deque()
+    return _get_table_hierarchy_tree(decode_tree(tree_strings))[0]
 
-    # Each queue item is a list [feature_id, previous_feature_ids]
-    i = 1
-    tree_dict = {}
-    working_queue.append([tree_strings[0], tree_dict])
 
-    while len(working_queue) > 0:
-        cur_feature, sub_tree = working_queue.popleft()
+def get_canonical_tree_key(tree_table):
+    """Get a hashable key that is equal for structurally identical trees, i.e.,
+    trees with the same splits and leaves at the same BFS positions, even if
+    their strings group the pairs of a level differently. Such trees have the
+    same hierarchy tree and leaf counts, so one of them can stand for all.
 
-        cur_string = tree_strings[i]
-        cur_string_split = cur_string.split()
+    Trees that only make the same predictions (e.g., same splits in a
+    different order) get different keys, because they route samples to
+    different leaves.
 
-        if len(cur_string_split) % 2 != 0:
-            raise ValueError("Error: current string size is not even.")
+    Args:
+        tree_table (tuple): (features, lefts, rights, labels) generated by
+            decode_tree()
 
-        # The string can have even number of values: the first two correspond to
-        # the current item, and the second two correspond to the next item in
-        # the queue, and the next two corresponds to the next item in the queue...
-        sub_tree["f"] = [cur_feature]
-        sub_tree["c"] = []
+    Returns:
+        tuple: Canonical key of this tree
+    """
 
-        for s in cur_string_split[:2]:
-            if s == "-1" or s == "-2":
-                # We hit a decision node, add a leaf to this branch
-                sub_tree["c"].append({"f": ["+"] if s == "-2" else ["-"]})
-            else:
-                new_sub_tree = {}
-                sub_tree["c"].append(new_sub_tree)
-                working_queue.append([s, new_sub_tree])
-
-        # Index for the next pair
-        pair_i = 2
-        while pair_i < len(cur_string_split):
-            # Load the next item in the queue
-            cur_feature, sub_tree = working_queue.popleft()
-            sub_tree["f"] = [cur_feature]
-            sub_tree["c"] = []
+    # Node ids follow the BFS order, so equal tables mean equal trees
+    return tuple(np.ascontiguousarray(a).tobytes() for a in tree_table)
 
-            for s in cur_string_split[pair_i : pair_i + 2]:
-                if s == "-1" or s == "-2":
-                    # We hit a decision node, add a leaf to this branch
-                    sub_tree["c"].append({"f": ["+"] if s == "-2" else ["-"]})
-                else:
-                    new_sub_tree = {}
-                    sub_tree["c"].append(new_sub_tree)
-                    working_queue.append([s, new_sub_tree])
 
-            pair_i += 2
+def _make_rule_node(feature):
+    """Create a node of the decision rule hierarchy builder.
 
-        i += 1
+    Args:
+        feature (str): Feature name of this node
+
+    Returns:
+        list: [hierarchy dict node, dict mapping child feature to its builder
+            node, set of tree ids ending at this node]
+    """
+
+    return [{"f": feature, "c": []}, {}, set()]
+
+
+def _add_decision_rules(rule_builder, all_rules, tree_id, keep_position):
+    """Add all decision rules of one tree to the decision rule hierarchy in
+    place. The builder indexes children by feature and keeps a tree id set at
+    each rule endpoint, so each rule is added in O(rule length).
 
-    return tree_dict
+    Args:
+        rule_builder (list): Root builder node generated by _make_rule_node()
+        all_rules (set): Decision rules of this tree
+        tree_id (int): ID of this tree
+        keep_position (bool): Whether to keep the position of each feature
+            (left or right)
+    """
+
+    # Iterate the set and build the hierarchy dict
+    for rule in all_rules:
+        cur_node = rule_builder
+
+        for f in rule[0]:
+            # Features are formatted as '<feature id><t|f>'
+            cur_feature = f if keep_position else f[:-1]
+
+            child_node = cur_node[1].get(cur_feature)
+            if child_node is None:
+                child_node = _make_rule_node(cur_feature)
+                cur_node[0]["c"].append(child_node[0])
+                cur_node[1][cur_feature] = child_node
+
+            cur_node = child_node
+
+        # Hit the end of the rule, add this tree to the children list
+        # If keep_position = False, need to avoid adding duplicate trees
+        if tree_id not in cur_node[2]:
+            cur_node[2].add(tree_id)
+            cur_node[0]["c"].append({"f": "_", "t": tree_id})
 
 
 def get_decision_rule_hierarchy_dict(trie, keep_position=True):
@@ -414,58 +828,26 @@ def get_decision_rule_hierarchy_dict(trie, keep_position=True):
     Returns:
         dict: Hierarchy dict
     """
-    trie_copy = transform_trie(trie)
-
-    # Step 1: build a dictionary to map tree ID to its string description
-    tree_map = {"count": 0, "map": {}}
-    build_tree_map(trie_copy, tree_map)
-
-    # Step 2: build a temporary dictionary to map string to tree ID
-    string_to_id_map = {}
-    for k in tree_map["map"]:
-        string_to_id_map[tuple(tree_map["map"][k][0])] = k
+    # Step 1: pack the trees and number them with tree IDs
+    tree_stream = iter_trie_trees(trie)
+    tree_arrays = compile_tree_arrays(
+        (tid, tree_strings, objective)
+        for tid, (tree_strings, objective) in enumerate(tree_stream, start=1)
+    )
 
-    decision_rule_hierarchy = {"f": "root", "c": []}
+    # Step 2: add the decision rules of each tree to the hierarchy dict
+    rule_builder = _make_rule_node("root")
 
-    for i in tree_map["map"]:
-        cur_string = tree_map["map"][i][0]
+    for i, cur_string, _ in iter_tree_arrays(tree_arrays):
         if len(cur_string) <= 1:
             # Skip this subtrie if the root is a decision
             continue
 
         all_rules = get_decision_rules(cur_string)
+        _add_decision_rules(rule_builder, all_rules, i, keep_position)
 
-        # Iterate the set and build the hierarchy dict
-        for rule in all_rules:
-            cur_dict = decision_rule_hierarchy
-
-            for f in rule[0]:
-                cur_feature = f if keep_position else re.sub(r"(\d*)[tf]", r"\1", f)
-
-                is_exist = False
-                for item in cur_dict["c"]:
-                    if item["f"] == cur_feature:
-                        cur_dict = item
-                        is_exist = True
-                        break
-
-                if not is_exist:
-                    new_item = {"f": cur_feature, "c": []}
-                    cur_dict["c"].append(new_item)
-                    cur_dict = new_item
-                    is_exist = True
-
-            # Hit the end of the rule, add this tree to the children list
-            # If keep_position = False, need to avoid adding duplicate trees
-            existing_trees = set()
-            for c in cur_dict["c"]:
-                if c["f"] == "_":
-                    existing_trees.add(c["t"])
-
-            if i not in existing_trees:
-                cur_dict["c"].append({"f": "_", "t": i})
-
-    return decision_rule_hierarchy, tree_map
+    # The builder index is only needed during construction
+    return rule_builder[0], export_tree_map(tree_arrays)
 
 
 def get_all_tree_ids(node):
@@ -511,229 +893,3578 @@ def get_tree_map_hierarchy(tree_map):
     return new_tree_map
 
 
-def count_leaf_samples(root, x_all, y_all):
-    """Count the number of samples and accuracy in each leaf node of the given
-        decision tree
+def compile_tree(root):
+    """Compile a hierarchy tree into flat integer arrays. Nodes are numbered in
+    BFS order, so the root is always node 0 and a child always has a larger id
+    than its parent.
 
     Args:
-        root(dict): The root node of the tree
-        x_all(np.array): Data sample values
-        y_all(np.array): Data labels
+        root (dict): The root node of a tree generated by get_hierarchy_tree()
+
+    Returns:
+        list: Node dicts indexed by their node id
+        np.array: Feature index of each node (-1 for leaf nodes)
+        np.array: Left (true) child id of each node (-1 for leaf nodes)
+        np.array: Right (false) child id of each node (-1 for leaf nodes)
+        np.array: Predicted label of each node (1 for '+', 0 for '-', -1 for
+            non-leaf nodes)
     """
 
-    y_pred = np.array([root["f"][0] + "l" + "0" for _ in range(x_all.shape[0])]).astype(
-        object
-    )
-    total_correct_num = 0
+    nodes = [root]
+    features, lefts, rights, labels = [], [], [], []
 
-    # Use a queue for BFS
-    working_queue = deque()
-    working_queue.append([root, "l", 0])
+    i = 0
+    while i < len(nodes):
+        cur_feature = nodes[i]["f"][0]
 
-    while len(working_queue) > 0:
-        cur_node, cur_dir, cur_dep = working_queue.popleft()
+        if cur_feature == "+" or cur_feature == "-":
+            features.append(-1)
+            lefts.append(-1)
+            rights.append(-1)
+            labels.append(1 if cur_feature == "+" else 0)
+        else:
+            features.append(int(cur_feature))
+            labels.append(-1)
 
-        # cur_labels is [label_for_true, label_for_false]
-        cur_labels = []
-        dirs = ["l", "r"]
+            # True left (first), false right (second)
+            lefts.append(len(nodes))
+            nodes.append(nodes[i]["c"][0])
+            rights.append(len(nodes))
+            nodes.append(nodes[i]["c"][1])
 
-        for (i, child) in enumerate(cur_node["c"]):
-            cur_label = child["f"][0]
-            cur_labels.append(cur_label)
+        i += 1
 
-            # Add the children to the queue if it not a leaf node
-            if child["f"][0] != "+" and child["f"][0] != "-":
-                working_queue.append([child, dirs[i], cur_dep + 1])
+    return (
+        nodes,
+        np.array(features, dtype=np.intp),
+        np.array(lefts, dtype=np.intp),
+        np.array(rights, dtype=np.intp),
+        np.array(labels, dtype=np.int8),
+    )
 
-        # Iterate through all samples and to assign labels
-        cur_feature_index = cur_node["f"][0]
 
-        # True left (first), false right (second)
-        true_indexes = np.where(
-            np.logical_and(
-                x_all[:, int(cur_feature_index)] == 1,
-                y_pred == cur_feature_index + cur_dir + str(cur_dep),
-            )
-        )[0]
-        y_pred[list(true_indexes)] = cur_labels[0] + "l" + str(cur_dep + 1)
+def route_samples(features, lefts, rights, x_all):
+    """Route all samples down a compiled tree. Samples move one level per
+    iteration, so the cost is O(# samples x tree depth).
 
-        false_indexes = np.where(
-            np.logical_and(
-                x_all[:, int(cur_feature_index)] == 0,
-                y_pred == cur_feature_index + cur_dir + str(cur_dep),
-            )
-        )[0]
-        y_pred[list(false_indexes)] = cur_labels[1] + "r" + str(cur_dep + 1)
-
-        cur_node["f"] = [cur_node["f"][0], len(true_indexes) + len(false_indexes), -1]
-
-        # Update the sample # in the original tree on every node
-        # Also compute the # of correctly classified samples on leaf node (
-        # keep it as 0 for non-leaf nodes)
-        if cur_labels[0] == "+" or cur_labels[0] == "-":
-            # Compute the # of correctly classified samples
-            cur_pred = 1 if cur_labels[0] == "+" else 0
-            correct_num = int(np.sum(y_all[true_indexes] == cur_pred))
-
-            cur_node["c"][0]["f"] = [
-                cur_node["c"][0]["f"][0],
-                len(true_indexes),
-                correct_num,
-            ]
+    Args:
+        features (np.array): Feature index of each node (-1 for leaf nodes)
+        lefts (np.array): Left (true) child id of each node
+        rights (np.array): Right (false) child id of each node
+        x_all (np.array): Data sample values
 
-            # Accumulate the number for total accuracy
-            total_correct_num += correct_num
+    Returns:
+        np.array: The id of the node where each sample stops. Samples with a
+            feature value other than 0 or 1 stop at len(features).
+    """
 
-        if cur_labels[1] == "+" or cur_labels[1] == "-":
-            cur_pred = 1 if cur_labels[1] == "+" else 0
-            correct_num = int(np.sum(y_all[false_indexes] == cur_pred))
+    node_count = len(features)
 
-            cur_node["c"][1]["f"] = [
-                cur_node["c"][1]["f"][0],
-                len(false_indexes),
-                correct_num,
-            ]
+    # Append one sentinel node to collect samples that cannot be routed
+    features = np.append(features, -1)
+    lefts = np.append(lefts, node_count)
+    rights = np.append(rights, node_count)
 
-            # Accumulate the number for total accuracy
-            total_correct_num += correct_num
+    node_ids = np.zeros(x_all.shape[0], dtype=np.intp)
+    active_rows = np.arange(x_all.shape[0])
 
-    # Return the accuracy of this tree
-    return round(total_correct_num / len(y_all), 5)
+    while active_rows.size > 0:
+        cur_ids = node_ids[active_rows]
+        cur_features = features[cur_ids]
 
+        # Stop samples that have reached a leaf node
+        is_internal = cur_features >= 0
+        active_rows = active_rows[is_internal]
+        cur_ids = cur_ids[is_internal]
 
-def transform_trie_to_rules(
-    trie, data_df, feature_names=None, feature_description=None
-):
-    """Transform Rashomon trie json string to hierarchical rules for TimberTrek
+        values = x_all[active_rows, cur_features[is_internal]]
+        node_ids[active_rows] = np.where(
+            values == 1,
+            lefts[cur_ids],
+            np.where(values == 0, rights[cur_ids], node_count),
+        )
+
+    return node_ids
+
+
+def count_leaf_samples(root, x_all, y_all):
+    """Count the number of samples and accuracy in each leaf node of the given
+        decision tree
+
+    The counts are written into the tree in place: a non-leaf node's 'f'
+    becomes [feature, # samples, -1], and a leaf node's 'f' becomes [label,
+    # samples, # correctly classified samples].
 
     Args:
-        trie (str): Rashomon trie json
-        data_df (pd.DataFrame): Dataframe of the dataset to compute tree accuracies
-        feature_names ([str]): A list of feature names. Each name has format like
-            'age:<26'. If it is not given, uses the data frame hearders as feature
-            names.
-        feature_description (dict): A dictionary that maps feature name to their
-            descriptions. If it is not given, original feature names will be
-            used (might be hard for readers to understand).
+        root(dict): The root node of the tree
+        x_all(np.array | scipy.sparse matrix | pd.DataFrame | dict): Data
+            sample values. Sparse values (or sparse data generated by
+            pack_sparse_data()) are only expanded for the columns the tree
+            splits on.
+        y_all(np.array): Data labels
 
     Returns:
-        A string of json object of the hierarchical decision rules
+        float: Accuracy of this tree
     """
 
-    if feature_names is None:
-        feature_names = data_df.columns.tolist()
+    if _is_sparse_data(x_all):
+        x_all = pack_sparse_data(x_all)
 
-    if feature_description is None:
-        feature_description = {}
-        for f in feature_names:
-            name = re.sub(r"(.*):.*", r"\1", f)
-            if name not in feature_description:
-                feature_description[name] = {
-                    "info": name,
-                    "type": "count",
-                    "short": name,
-                }
+    nodes, *tree_table = compile_tree(root)
+    sample_counts, correct_counts = _count_table_samples(tree_table, x_all, y_all)
 
-    # Construct trees
-    decision_rule_hierarchy, tree_map = get_decision_rule_hierarchy_dict(
-        trie, keep_position=False
+    return _annotate_tree(
+        nodes, tree_table[0], sample_counts, correct_counts, len(y_all)
     )
-    new_tree_map = get_tree_map_hierarchy(tree_map)
 
-    # Count samples and accuracies of trees in place
-    # Extract the x data from the dataframe (here we use all data to evaluate)
-    x_all = data_df.to_numpy()[:, 0 : data_df.shape[1] - 1]
-    y_all = data_df.to_numpy()[:, data_df.shape[1] - 1]
 
-    for tid in tqdm(
-        new_tree_map, desc=f"Generating decision paths from {len(new_tree_map)} trees"
-    ):
-        cur_tree = new_tree_map[tid]
-        cur_acc = count_leaf_samples(cur_tree[0], x_all, y_all)
-        cur_tree.append(cur_acc)
+def _count_table_samples(tree_table, x_all, y_all, group_ids=None, group_num=1):
+    """Count the samples reaching each node of a node table, and the correctly
+    classified samples at each leaf node.
 
-    # Get the feature encodings
-    feature_map = get_feature_map(feature_names, feature_description)
+    Args:
+        tree_table (tuple): (features, lefts, rights, labels) generated by
+            decode_tree() or compile_tree()
+        x_all (np.array | dict): Data sample values, or sparse data generated
+            by pack_sparse_data()
+        y_all (np.array): Data labels
+        group_ids (np.array, optional): Group id of each sample, e.g., its
+            data split. If it is given, samples are routed once and counted
+            by group.
+        group_num (int): # groups if `group_ids` is given
 
-    decision_rule_hierarchy_dict = {}
-    decision_rule_hierarchy_dict["trie"] = decision_rule_hierarchy
-    decision_rule_hierarchy_dict["featureMap"] = feature_map
-    decision_rule_hierarchy_dict["treeMap"] = new_tree_map
+    Returns:
+        np.array: # samples reaching each node (shape [# groups, # nodes] if
+            `group_ids` is given)
+        np.array: # correctly classified samples at each node (0 for non-leaf
+            nodes)
+    """
 
-    return decision_rule_hierarchy_dict
+    features, lefts, rights, labels = tree_table
+    node_num = len(features)
+
+    if isinstance(x_all, dict):
+        # Only expand the sparse columns this tree splits on
+        block_features, x_all = _get_sparse_block(x_all, features)
+        node_ids = route_samples(block_features, lefts, rights, x_all)
+    else:
+        node_ids = route_samples(features, lefts, rights, x_all)
+
+    # The last bin of each group collects samples that cannot be routed
+    bins, bin_num = node_ids, node_num + 1
+    if group_ids is not None:
+        bins, bin_num = group_ids * (node_num + 1) + node_ids, group_num * bin_num
+
+    sample_counts = np.bincount(bins, minlength=bin_num).reshape(-1, node_num + 1)
+    sample_counts = sample_counts[:, :-1]
+    is_correct = np.append(labels, -1)[node_ids] == y_all
+    correct_counts = np.bincount(bins, weights=is_correct, minlength=bin_num)
+    correct_counts = correct_counts.reshape(-1, node_num + 1)[:, :-1].astype(int)
+
+    # Children have larger ids, so we can aggregate the counts bottom-up
+    for i in range(node_num - 1, -1, -1):
+        if features[i] >= 0:
+            sample_counts[:, i] = (
+                sample_counts[:, lefts[i]] + sample_counts[:, rights[i]]
+            )
 
+    if group_ids is None:
+        return sample_counts[0], correct_counts[0]
 
-def _make_html(decision_paths, width):
-    """
-    Function to create an HTML string to bundle TimberTrek's html, css, and js.
-    We use base64 to encode the js so that we can use inline defer for <script>
+    return sample_counts, correct_counts
 
-    We add another script to pass Python data as inline json, and dispatch an
-    event to transfer the data
+
+def _annotate_tree(nodes, features, sample_counts, correct_counts, sample_num):
+    """Write the sample counts into the tree nodes and compute the accuracy.
 
     Args:
-        decision_paths(dict): Decision paths in a hierarchical dict
-        width(int): Width of the main visualization window
+        nodes ([dict]): Node dicts indexed by their node id
+        features (np.array): Feature index of each node (-1 for leaf nodes)
+        sample_counts ([int]): # samples reaching each node
+        correct_counts ([int]): # correctly classified samples at each node
+            (ignored for non-leaf nodes)
+        sample_num (int): Total # samples
 
-    Return:
+    Returns:
+        float: Accuracy of this tree
+    """
+
+    total_correct_num = 0
+
+    for i, node in enumerate(nodes):
+        if features[i] >= 0:
+            node["f"] = [node["f"][0], int(sample_counts[i]), -1]
+        else:
+            node["f"] = [node["f"][0], int(sample_counts[i]), int(correct_counts[i])]
+            total_correct_num += int(correct_counts[i])
+
+    return round(total_correct_num / sample_num, 5)
+
+
+def _annotate_split_tree(nodes, features, sample_counts, correct_counts, split_spec):
+    """Write the sample counts of all data splits into the tree nodes, and
+    compute the accuracy on each split. Leaf nodes get an 's' entry with the
+    [# samples, # correctly classified samples] of each split.
+
+    Args:
+        nodes ([dict]): Node dicts indexed by their node id
+        features (np.array): Feature index of each node (-1 for leaf nodes)
+        sample_counts (np.array): # samples of each group reaching each node
+        correct_counts (np.array): # correctly classified samples of each
+            group at each node
+        split_spec (dict): Split groups generated by _get_split_data()
+
+    Returns:
+        float: Accuracy of this tree on the main data
+        [float]: Accuracy of this tree on each split (None for empty splits)
+    """
+
+    sample_counts = np.asarray(sample_counts)
+    correct_counts = np.asarray(correct_counts)
+    main_groups = split_spec["mainGroups"]
+    split_num = len(split_spec["names"])
+
+    cur_acc = _annotate_tree(
+        nodes,
+        features,
+        sample_counts[main_groups].sum(axis=0),
+        correct_counts[main_groups].sum(axis=0),
+        split_spec["sampleNum"],
+    )
+
+    is_leaf = np.asarray(features) < 0
+    for i in np.flatnonzero(is_leaf):
+        nodes[i]["s"] = [
+            [int(sample_counts[g, i]), int(correct_counts[g, i])]
+            for g in range(split_num)
+        ]
+
+    split_accs = []
+    for g, split_sample_num in enumerate(split_spec["splitSampleNums"]):
+        split_correct_num = int(correct_counts[g, is_leaf].sum())
+        split_accs.append(
+            round(split_correct_num / split_sample_num, 5)
+            if split_sample_num > 0
+            else None
+        )
+
+    return cur_acc, split_accs
+
+
+def _add_tree_counts(
+    tree_entry, nodes, features, sample_counts, correct_counts, sample_num, split_spec
+):
+    """Annotate a tree with its sample counts, and append its accuracy (and
+    its accuracy on each data split) to its tree entry.
+
+    Args:
+        tree_entry (list): [hierarchy tree, objective]
+        nodes ([dict]): Node dicts indexed by their node id
+        features (np.array): Feature index of each node (-1 for leaf nodes)
+        sample_counts (np.array): # samples reaching each node
+        correct_counts (np.array): # correctly classified samples at each node
+        sample_num (int): Total # samples
+        split_spec (dict): Split groups generated by _get_split_data(), or
+            None if counts are not grouped by split
+    """
+
+    if split_spec is None:
+        tree_entry.append(
+            _annotate_tree(nodes, features, sample_counts, correct_counts, sample_num)
+        )
+    else:
+        tree_entry.extend(
+            _annotate_split_tree(
+                nodes, features, sample_counts, correct_counts, split_spec
+            )
+        )
+
+
+def _popcount(words):
+    """Count the set bits in an array of uint64 words.
+
+    Args:
+        words (np.array): uint64 words
+
+    Returns:
+        int: Total # of set bits
+    """
+
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(words).sum(dtype=np.int64))
+
+    # Fall back to a byte lookup table for numpy < 2.0
+    return int(_POPCOUNT_TABLE[words.view(np.uint8)].sum(dtype=np.int64))
+
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def pack_binary_data(x_all, y_all):
+    """Pack binarized feature columns and labels into bitsets. Each column
+    becomes an array of uint64 words where bit i is the value of sample i.
+
+    Args:
+        x_all (np.array): Data sample values (all values have to be 0 or 1)
+        y_all (np.array): Data labels (all values have to be 0 or 1)
+
+    Returns:
+        dict: {
+            'x': uint64 array of shape (# features, # words),
+            'y': uint64 array of shape (# words,),
+            'n': # samples
+        }
+    """
+
+    x_all = np.asarray(x_all)
+    y_all = np.asarray(y_all)
+
+    if not (np.isin(x_all, (0, 1)).all() and np.isin(y_all, (0, 1)).all()):
+        raise ValueError("Error: bit packing requires all values to be 0 or 1.")
+
+    sample_num = x_all.shape[0]
+
+    # Pad the bytes so that each column is a whole number of 64-bit words
+    word_num = (sample_num + 63) // 64
+    x_bytes = np.zeros((x_all.shape[1], word_num * 8), dtype=np.uint8)
+    x_bytes[:, : (sample_num + 7) // 8] = np.packbits(
+        x_all.T.astype(bool), axis=1, bitorder="little"
+    )
+
+    y_bytes = np.zeros(word_num * 8, dtype=np.uint8)
+    y_bytes[: (sample_num + 7) // 8] = np.packbits(
+        y_all.astype(bool), bitorder="little"
+    )
+
+    return {"x": x_bytes.view(np.uint64), "y": y_bytes.view(np.uint64), "n": sample_num}
+
+
+def _is_sparse_data(data):
+    """Check if the data is a scipy.sparse matrix or a data frame with sparse
+    columns. scipy is optional, so sparse matrices are recognized by their
+    interface instead of their type.
+
+    Args:
+        data (Any): Data samples
+
+    Returns:
+        bool: Whether the data is sparse
+    """
+
+    if hasattr(data, "tocsc"):
+        return True
+
+    return hasattr(data, "dtypes") and any(
+        hasattr(dtype, "fill_value") for dtype in data.dtypes
+    )
+
+
+def _get_value_codes(values):
+    """Encode values for routing: 1 and 0 stay, and any other value is 2."""
+
+    values = np.asarray(values)
+    codes = np.full(values.shape, 2, dtype=np.int8)
+    codes[values == 1] = 1
+    codes[values == 0] = 0
+    return codes
+
+
+def pack_sparse_data(x_all, cache_size=64):
+    """Store sparse binarized features column by column, so that a tree only
+    expands the columns it splits on. This keeps data with thousands of
+    mostly-zero features out of dense memory.
+
+    Args:
+        x_all (scipy.sparse matrix | pd.DataFrame): Data sample values, as a
+            scipy.sparse matrix or array (converted to CSC), or a data frame
+            with sparse columns (its dense columns are also supported)
+        cache_size (int): # expanded columns to keep for later trees.
+            Defaults to 64.
+
+    Returns:
+        dict: {
+            'n': # samples,
+            'indptr': stored values of column j are at [indptr[j],
+                indptr[j + 1]),
+            'indices': row index of each stored value,
+            'codes': 1, 0, or 2 (any other value) of each stored value,
+            'fills': code of the values that are not stored in each column,
+            'cache': expanded columns, least recently used first,
+            'cache_size': max # cached columns
+        }
+    """
+
+    if hasattr(x_all, "tocsc"):
+        x_csc = x_all.tocsc()
+        x_csc.sum_duplicates()
+        indptr = np.asarray(x_csc.indptr, dtype=np.int64)
+        indices = np.asarray(x_csc.indices, dtype=np.int64)
+        codes = _get_value_codes(x_csc.data)
+        fills = np.zeros(x_csc.shape[1], dtype=np.int8)
+        sample_num = x_csc.shape[0]
+    else:
+        all_indices, all_codes, fill_values = [], [], []
+
+        for _, column in x_all.items():
+            values = column.array
+            if hasattr(values, "sp_index"):
+                all_indices.append(values.sp_index.to_int_index().indices)
+                all_codes.append(_get_value_codes(values.sp_values))
+                fill_values.append(values.fill_value)
+            else:
+                values = np.asarray(values)
+                rows = np.flatnonzero(values != 0)
+                all_indices.append(rows)
+                all_codes.append(_get_value_codes(values[rows]))
+                fill_values.append(0)
+
+        indptr = np.zeros(len(all_indices) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(rows) for rows in all_indices])
+        indices = np.concatenate(all_indices + [[]]).astype(np.int64)
+        codes = np.concatenate(all_codes + [np.zeros(0, dtype=np.int8)])
+        fills = _get_value_codes(np.array(fill_values, dtype=float))
+        sample_num = len(x_all)
+
+    return {
+        "n": sample_num,
+        "indptr": indptr,
+        "indices": indices,
+        "codes": codes,
+        "fills": fills,
+        "cache": OrderedDict(),
+        "cache_size": cache_size,
+    }
+
+
+def _get_sparse_column(sparse_x, feature):
+    """Expand one column of sparse data, reusing recently expanded columns.
+
+    Args:
+        sparse_x (dict): Sparse data generated by pack_sparse_data()
+        feature (int): Column index
+
+    Returns:
+        np.array: int8 code of the column value of each sample
+    """
+
+    cache = sparse_x["cache"]
+    column = cache.get(feature)
+    if column is not None:
+        cache.move_to_end(feature)
+        return column
+
+    start, end = sparse_x["indptr"][feature], sparse_x["indptr"][feature + 1]
+    column = np.full(sparse_x["n"], sparse_x["fills"][feature], dtype=np.int8)
+    column[sparse_x["indices"][start:end]] = sparse_x["codes"][start:end]
+
+    cache[feature] = column
+    if len(cache) > sparse_x["cache_size"]:
+        cache.popitem(last=False)
+
+    return column
+
+
+def _get_sparse_block(sparse_x, features):
+    """Expand the columns that a tree splits on into a dense block.
+
+    Args:
+        sparse_x (dict): Sparse data generated by pack_sparse_data()
+        features (np.array): Feature index of each node (-1 for leaf nodes)
+
+    Returns:
+        np.array: Feature index of each node in the block (-1 for leaf nodes)
+        np.array: int8 block of shape (# samples, # used features)
+    """
+
+    features = np.asarray(features)
+    used_features = np.unique(features[features >= 0])
+
+    block = np.empty((sparse_x["n"], len(used_features)), dtype=np.int8)
+    for i, feature in enumerate(used_features.tolist()):
+        block[:, i] = _get_sparse_column(sparse_x, feature)
+
+    block_features = np.where(
+        features >= 0, np.searchsorted(used_features, features), -1
+    )
+    return block_features, block
+
+
+def _get_sparse_data(data_df):
+    """Split sparse data into sparse features and dense labels.
+
+    Args:
+        data_df (scipy.sparse matrix | pd.DataFrame): Sparse data, where the
+            last column is the label
+
+    Returns:
+        dict: Sparse features generated by pack_sparse_data()
+        np.array: Data labels
+        [str]: Column names, or None
+    """
+
+    if hasattr(data_df, "tocsc"):
+        data = data_df.tocsc()
+        y_all = np.asarray(data[:, [data.shape[1] - 1]].toarray()).ravel()
+        return pack_sparse_data(data[:, :-1]), y_all, None
+
+    y_all = np.asarray(data_df.iloc[:, -1])
+    columns = data_df.columns.tolist()
+    return pack_sparse_data(data_df.iloc[:, :-1]), y_all, columns
+
+
+def _share_sparse_data(sparse_x):
+    """Copy the arrays of sparse data into shared memory blocks.
+
+    Args:
+        sparse_x (dict): Sparse data generated by pack_sparse_data()
+
+    Returns:
+        [SharedMemory]: The shared memory blocks (the caller needs to unlink
+            them)
+        dict: Spec to attach the sparse data in a worker
+    """
+
+    shms = []
+    spec = {"n": sparse_x["n"], "cache_size": sparse_x["cache_size"]}
+
+    for key in ["indptr", "indices", "codes", "fills"]:
+        shm, spec[key] = _share_array(sparse_x[key])
+        shms.append(shm)
+
+    return shms, spec
+
+
+def _attach_sparse_data(sparse_spec):
+    """Attach sparse data shared by _share_sparse_data(). Each worker expands
+    and caches columns on its own.
+
+    Args:
+        sparse_spec (dict): Spec generated by _share_sparse_data()
+
+    Returns:
+        [SharedMemory]: The shared memory blocks (keep them alive while using
+            the data)
+        dict: Sparse data in the format of pack_sparse_data()
+    """
+
+    shms = []
+    sparse_x = {
+        "n": sparse_spec["n"],
+        "cache": OrderedDict(),
+        "cache_size": sparse_spec["cache_size"],
+    }
+
+    for key in ["indptr", "indices", "codes", "fills"]:
+        shm, sparse_x[key] = _attach_array(sparse_spec[key])
+        shms.append(shm)
+
+    return shms, sparse_x
+
+
+def make_rule_cache(max_size=10000):
+    """Create a cache that memoizes the samples meeting a decision rule across
+    trees. A rule is a path from the root, keyed by the order-independent set
+    of its (feature, value) conditions, so trees sharing a path (in any split
+    order) only evaluate it once. The least recently used rule is evicted when
+    the cache is full.
+
+    A cache is bound to one dataset: it is cleared when it is used with
+    different bit-packed data.
+
+    Args:
+        max_size (int, optional): Maximum # of cached rules. Each rule keeps a
+            bitset of # samples / 8 bytes. Defaults to 10000.
+
+    Returns:
+        dict: An empty rule cache
+    """
+
+    return {
+        "max_size": max_size,
+        "data": None,
+        "digest": None,
+        "map": OrderedDict(),
+        "hits": 0,
+        "misses": 0,
+        "evictions": 0,
+    }
+
+
+def get_rule_cache_stats(rule_cache):
+    """Get the hit-rate statistics of a rule cache.
+
+    Args:
+        rule_cache (dict): Rule cache generated by make_rule_cache()
+
+    Returns:
+        dict: # of hits, misses, evictions, cached rules, and the hit rate
+    """
+
+    lookup_num = rule_cache["hits"] + rule_cache["misses"]
+
+    return {
+        "hits": rule_cache["hits"],
+        "misses": rule_cache["misses"],
+        "evictions": rule_cache["evictions"],
+        "size": len(rule_cache["map"]),
+        "hit_rate": rule_cache["hits"] / lookup_num if lookup_num > 0 else 0.0,
+    }
+
+
+def _bind_rule_cache(rule_cache, packed_data):
+    """Clear the rule cache if it was filled with a different dataset."""
+
+    if rule_cache["data"] is packed_data:
+        return
+
+    digest = hashlib.blake2b(packed_data["x"].tobytes(), digest_size=16)
+    digest.update(packed_data["y"].tobytes())
+    digest = digest.hexdigest()
+
+    if rule_cache["digest"] != digest:
+        rule_cache["map"].clear()
+
+    # Remember the exact data object to skip hashing on the next tree
+    rule_cache["data"] = packed_data
+    rule_cache["digest"] = digest
+
+
+def count_leaf_samples_packed(root, packed_data, rule_cache=None):
+    """Count the number of samples and accuracy in each leaf node of the given
+    decision tree, using bit-packed data from pack_binary_data(). Each node's
+    sample set is a bitset derived from its parent with AND / ANDNOT, and the
+    counts come from popcounts.
+
+    The counts are written into the tree in place, same as
+    count_leaf_samples().
+
+    Args:
+        root (dict): The root node of the tree
+        packed_data (dict): Bit-packed data generated by pack_binary_data()
+        rule_cache (dict, optional): Rule cache generated by make_rule_cache()
+            to reuse the sample sets of paths shared with other trees.
+
+    Returns:
+        float: Accuracy of this tree
+    """
+
+    nodes, *tree_table = compile_tree(root)
+    sample_counts, correct_counts = _count_table_samples_packed(
+        tree_table, packed_data, rule_cache
+    )
+
+    return _annotate_tree(
+        nodes, tree_table[0], sample_counts, correct_counts, packed_data["n"]
+    )
+
+
+def _count_table_samples_packed(tree_table, packed_data, rule_cache=None):
+    """Count the samples reaching each node of a node table, and the correctly
+    classified samples at each leaf node, using bit-packed data.
+
+    Args:
+        tree_table (tuple): (features, lefts, rights, labels) generated by
+            decode_tree() or compile_tree()
+        packed_data (dict): Bit-packed data generated by pack_binary_data()
+        rule_cache (dict, optional): Rule cache generated by make_rule_cache()
+
+    Returns:
+        np.array: # samples reaching each node
+        np.array: # correctly classified samples at each node (0 for non-leaf
+            nodes)
+    """
+
+    features, lefts, rights, labels = tree_table
+    node_num = len(features)
+    x_bits, y_bits, sample_num = packed_data["x"], packed_data["y"], packed_data["n"]
+
+    if rule_cache is not None:
+        _bind_rule_cache(rule_cache, packed_data)
+
+    sample_counts = np.zeros(node_num, dtype=np.int64)
+    correct_counts = np.zeros(node_num, dtype=np.int64)
+
+    # Each pending node is [rule, parent mask, split feature, split value]
+    pending = {0: [frozenset(), None, -1, -1]}
+
+    # Node ids are in BFS order, so a parent is always visited before its
+    # children
+    for i in range(node_num):
+        cur_rule, parent_mask, split_feature, split_value = pending.pop(i)
+
+        entry = None
+        if rule_cache is not None:
+            entry = rule_cache["map"].get(cur_rule)
+
+        if entry is not None:
+            rule_cache["hits"] += 1
+            rule_cache["map"].move_to_end(cur_rule)
+        else:
+            if parent_mask is None:
+                # Start with all samples at the root (padding bits stay 0)
+                root_mask = np.zeros(len(y_bits) * 64, dtype=bool)
+                root_mask[:sample_num] = True
+                cur_mask = np.packbits(root_mask, bitorder="little").view(np.uint64)
+            elif split_value == 1:
+                cur_mask = parent_mask & x_bits[split_feature]
+            else:
+                cur_mask = parent_mask & ~x_bits[split_feature]
+
+            # Entry is [sample mask, # samples, # positive samples]
+            entry = [cur_mask, _popcount(cur_mask), _popcount(cur_mask & y_bits)]
+
+            if rule_cache is not None:
+                rule_cache["misses"] += 1
+                rule_cache["map"][cur_rule] = entry
+                if len(rule_cache["map"]) > rule_cache["max_size"]:
+                    rule_cache["map"].popitem(last=False)
+                    rule_cache["evictions"] += 1
+
+        cur_mask, sample_counts[i], positive_num = entry
+
+        if features[i] >= 0:
+            cur_feature = int(features[i])
+            pending[lefts[i]] = [
+                cur_rule | {(cur_feature, 1)},
+                cur_mask,
+                cur_feature,
+                1,
+            ]
+            pending[rights[i]] = [
+                cur_rule | {(cur_feature, 0)},
+                cur_mask,
+                cur_feature,
+                0,
+            ]
+        elif labels[i] == 1:
+            correct_counts[i] = positive_num
+        else:
+            correct_counts[i] = sample_counts[i] - positive_num
+
+    return sample_counts, correct_counts
+
+
+def _make_progress(stage, total=None, desc=None, quiet=False, callback=None, **kwargs):
+    """Create a progress tracker that updates a tqdm bar and reports progress
+    events to a callback.
+
+    Args:
+        stage (str): Name of the pipeline stage
+        total (int, optional): Total # of steps if it is known in advance
+        desc (str, optional): Description of the progress bar
+        quiet (bool): Whether to hide the progress bar
+        callback (function, optional): Function to call with each progress
+            event {'type': 'progress', 'stage', 'done', 'total'}
+        **kwargs: Other tqdm arguments
+
+    Returns:
+        dict: Progress tracker for _update_progress()
+    """
+
+    return {
+        "bar": tqdm(total=total, desc=desc, disable=quiet, **kwargs),
+        "callback": callback,
+        "stage": stage,
+        "done": 0,
+        "total": total,
+    }
+
+
+def _update_progress(progress, n=1, **postfix):
+    """Advance a progress tracker created by _make_progress().
+
+    Args:
+        progress (dict): Progress tracker
+        n (int): # of finished steps. Defaults to 1.
+        **postfix: Extra stats to show after the progress bar
+    """
+
+    progress["done"] += n
+    progress["bar"].update(n)
+    if len(postfix) > 0:
+        progress["bar"].set_postfix(refresh=False, **postfix)
+
+    if progress["callback"] is not None:
+        progress["callback"](
+            {
+                "type": "progress",
+                "stage": progress["stage"],
+                "done": progress["done"],
+                "total": progress["total"],
+            }
+        )
+
+
+@contextmanager
+def _track_stage(stats, stage, callback=None):
+    """Record the wall time and the peak memory of a pipeline stage. Peak
+    memory is only recorded if tracemalloc is tracing. The traced peak is never
+    reset, so the caller's own peak stays intact; a stage that stays under an
+    earlier peak reports that peak as an upper bound.
+
+    Args:
+        stats (dict): Stats to add {stage: {'time', 'peakMemory'}} to
+            `stats['stages']`
+        stage (str): Name of the pipeline stage
+        callback (function, optional): Function to call with the stage event
+            {'type': 'stage', 'stage', 'time', 'peakMemory'} when it ends
+
+    Yields:
+        dict: The stage record. Extra metrics added to it are reported too.
+    """
+
+    record = {"time": 0, "peakMemory": None}
+    trace_memory = tracemalloc.is_tracing()
+    if trace_memory:
+        start_memory = tracemalloc.get_traced_memory()[0]
+    start_time = time.perf_counter()
+
+    yield record
+
+    record["time"] = time.perf_counter() - start_time
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        record["peakMemory"] = max(peak_memory - start_memory, 0)
+    stats["stages"][stage] = record
+
+    if callback is not None:
+        callback({"type": "stage", "stage": stage, **record})
+
+
+def _share_array(array):
+    """Copy an array into a new shared memory block.
+
+    Args:
+        array (np.array): Array to share
+
+    Returns:
+        SharedMemory: The shared memory block (the caller needs to unlink it)
+        tuple: (block name, shape, dtype) to attach the array in a worker
+    """
+
+    # Object arrays only hold pointers, so we need to share their values
+    if array.dtype == object:
+        array = array.astype(np.float64)
+
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared_array[:] = array
+
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def _attach_array(array_spec):
+    """Attach an array shared by _share_array().
+
+    Args:
+        array_spec (tuple): (block name, shape, dtype)
+
+    Returns:
+        SharedMemory: The shared memory block (keep it alive while using the
+            array)
+        np.array: The shared array
+    """
+
+    name, shape, dtype = array_spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+# Data attached by each worker process in the pool
+_worker_data = {}
+
+
+def _init_tree_worker(
+    x_spec, y_spec, sample_num, pack_bits, cache_size, group_spec=None, group_num=1
+):
+    """Attach the shared dataset in a worker process.
+
+    Args:
+        x_spec (tuple | dict): Shared array spec of x_all (or packed x bits),
+            or the spec of shared sparse data
+        y_spec (tuple): Shared array spec of y_all (or packed y bits)
+        sample_num (int): Total # samples
+        pack_bits (bool): Whether the shared arrays are bit-packed
+        cache_size (int): Max size of the worker's rule cache (None for no
+            cache)
+        group_spec (tuple, optional): Shared array spec of the sample group
+            ids, if samples are counted by group
+        group_num (int): # groups if `group_spec` is given
+    """
+
+    if isinstance(x_spec, dict):
+        x_shms, x_shared = _attach_sparse_data(x_spec)
+    else:
+        x_shm, x_shared = _attach_array(x_spec)
+        x_shms = [x_shm]
+
+    y_shm, y_shared = _attach_array(y_spec)
+
+    _worker_data["shm"] = x_shms + [y_shm]
+    _worker_data["pack_bits"] = pack_bits
+    _worker_data["group_ids"] = None
+    _worker_data["group_num"] = group_num
+
+    if group_spec is not None:
+        group_shm, _worker_data["group_ids"] = _attach_array(group_spec)
+        _worker_data["shm"].append(group_shm)
+
+    if pack_bits:
+        _worker_data["packed_data"] = {"x": x_shared, "y": y_shared, "n": sample_num}
+    else:
+        _worker_data["x_all"] = x_shared
+        _worker_data["y_all"] = y_shared
+
+    _worker_data["rule_cache"] = None
+    if cache_size is not None:
+        _worker_data["rule_cache"] = make_rule_cache(cache_size)
+
+
+def _pack_tree_chunk(tree_chunk):
+    """Pack the node tables of a chunk of trees into flat arrays, so that the
+    parent's decoded tables are sent to a worker in a few arrays instead of
+    being decoded again from their strings.
+
+    Args:
+        tree_chunk (list): Tree items generated by _iter_tree_items()
+
+    Returns:
+        tuple: (tree ids, node offsets, features, lefts, rights, labels),
+            where the nodes of the i-th tree are at [offsets[i],
+            offsets[i + 1])
+    """
+
+    tree_tables = [item[3][1] for item in tree_chunk]
+    offsets = np.zeros(len(tree_tables) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(tree_table[0]) for tree_table in tree_tables])
+
+    return (
+        [item[0] for item in tree_chunk],
+        offsets,
+        *(np.concatenate([t[i] for t in tree_tables]) for i in range(4)),
+    )
+
+
+def _count_tree_chunk(tree_chunk):
+    """Count leaf samples for a chunk of trees in a worker process.
+
+    Args:
+        tree_chunk (tuple): Node tables of a chunk of trees generated by
+            _pack_tree_chunk()
+
+    Returns:
+        list: A list of (tree id, # samples of each node, # correct samples
+            of each node)
+        list: [# cache hits, # cache misses] in this chunk
+    """
+
+    rule_cache = _worker_data["rule_cache"]
+    hits_before = 0 if rule_cache is None else rule_cache["hits"]
+    misses_before = 0 if rule_cache is None else rule_cache["misses"]
+
+    results = []
+    tids, offsets, *tables = tree_chunk
+
+    for i, tid in enumerate(tids):
+        start, end = offsets[i], offsets[i + 1]
+        tree_table = tuple(table[start:end] for table in tables)
+
+        if _worker_data["pack_bits"]:
+            sample_counts, correct_counts = _count_table_samples_packed(
+                tree_table, _worker_data["packed_data"], rule_cache
+            )
+        else:
+            sample_counts, correct_counts = _count_table_samples(
+                tree_table,
+                _worker_data["x_all"],
+                _worker_data["y_all"],
+                _worker_data["group_ids"],
+                _worker_data["group_num"],
+            )
+
+        # Only send back the compact node counts
+        results.append((tid, sample_counts.tolist(), correct_counts.tolist()))
+
+    if rule_cache is None:
+        return results, [0, 0]
+
+    return results, [
+        rule_cache["hits"] - hits_before,
+        rule_cache["misses"] - misses_before,
+    ]
+
+
+def _evaluate_trees_parallel(
+    tree_items,
+    x_all,
+    y_all,
+    n_jobs,
+    pack_bits,
+    rule_cache,
+    chunk_size,
+    progress,
+    group_ids=None,
+    split_spec=None,
+):
+    """Count leaf samples of all trees with a process pool. The dataset is
+    shared with the workers through shared memory, and workers only send back
+    node annotations, which are written into the trees in place.
+
+    Trees are submitted in chunks as they are read from `tree_items`, and at
+    most a few chunks per worker are in flight at a time.
+
+    Args:
+        tree_items (iter): An iterable of tree items generated by
+            _iter_tree_items()
+        x_all (np.array | dict): Data sample values, or sparse data generated
+            by pack_sparse_data()
+        y_all (np.array): Data labels
+        n_jobs (int): # of worker processes
+        pack_bits (bool): Whether to evaluate trees on bit-packed data
+        rule_cache (dict): Rule cache to collect the workers' cache stats. Each
+            worker keeps its own cache with the same max size.
+        chunk_size (int): # trees in each task
+        progress (dict): Progress tracker generated by _make_progress() to
+            update as chunks finish
+        group_ids (np.array, optional): Group id of each sample, if samples
+            are counted by data split
+        split_spec (dict, optional): Split groups generated by
+            _get_split_data()
+    """
+
+    if pack_bits:
+        packed_data = pack_binary_data(x_all, y_all)
+        x_shared, y_shared = packed_data["x"], packed_data["y"]
+    else:
+        x_shared, y_shared = x_all, y_all
+
+    if isinstance(x_shared, dict):
+        x_shms, x_spec = _share_sparse_data(x_shared)
+    else:
+        x_shm, x_spec = _share_array(x_shared)
+        x_shms = [x_shm]
+
+    y_shm, y_spec = _share_array(y_shared)
+    cache_size = None if rule_cache is None else rule_cache["max_size"]
+
+    group_shm, group_spec, group_num = None, None, 1
+    if group_ids is not None:
+        group_shm, group_spec = _share_array(group_ids)
+        group_num = split_spec["groupNum"]
+
+    def collect_results(done_futures):
+        for future in done_futures:
+            tree_items = in_flight.pop(future)
+            results, cache_counts = future.result()
+
+            for tid, sample_counts, correct_counts in results:
+                tree_entry, (nodes, tree_table) = tree_items[tid]
+                _add_tree_counts(
+                    tree_entry,
+                    nodes,
+                    tree_table[0],
+                    sample_counts,
+                    correct_counts,
+                    len(y_all),
+                    split_spec,
+                )
+
+            if rule_cache is not None:
+                rule_cache["hits"] += cache_counts[0]
+                rule_cache["misses"] += cache_counts[1]
+
+            _update_progress(progress, len(results))
+
+    in_flight = {}
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=_init_tree_worker,
+            initargs=(
+                x_spec,
+                y_spec,
+                len(y_all),
+                pack_bits,
+                cache_size,
+                group_spec,
+                group_num,
+            ),
+        ) as executor:
+            tree_items = iter(tree_items)
+
+            while True:
+                tree_chunk = list(islice(tree_items, chunk_size))
+                if len(tree_chunk) == 0:
+                    break
+
+                # Send the decoded node tables, so each tree is decoded once
+                future = executor.submit(
+                    _count_tree_chunk, _pack_tree_chunk(tree_chunk)
+                )
+                in_flight[future] = {item[0]: item[2:] for item in tree_chunk}
+
+                # Bound the # of pending chunks (and the trees they hold)
+                if len(in_flight) >= n_jobs * 4:
+                    done_futures, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect_results(done_futures)
+
+            collect_results(as_completed(list(in_flight)))
+    finally:
+        for x_shm in x_shms:
+            x_shm.close()
+            x_shm.unlink()
+        y_shm.close()
+        y_shm.unlink()
+        if group_shm is not None:
+            group_shm.close()
+            group_shm.unlink()
+
+
+def _evaluate_trees(
+    tree_items,
+    x_all,
+    y_all,
+    pack_bits,
+    rule_cache,
+    n_jobs,
+    tree_num=None,
+    quiet=False,
+    callback=None,
+    group_ids=None,
+    split_spec=None,
+):
+    """Count leaf samples and accuracies of trees. The counts are written into
+    the hierarchy trees in place, and each tree entry gets its accuracy
+    appended.
+
+    Args:
+        tree_items (iter): An iterable of tree items generated by
+            _iter_tree_items()
+        x_all (np.array | dict): Data sample values, or sparse data generated
+            by pack_sparse_data()
+        y_all (np.array): Data labels
+        pack_bits (bool): Whether to evaluate trees on bit-packed data
+        rule_cache (dict): Rule cache generated by make_rule_cache() or None
+        n_jobs (int): # of processes to evaluate trees in parallel
+        tree_num (int, optional): Total # of trees if it is known in advance
+        quiet (bool): Whether to hide the progress bar
+        callback (function, optional): Function to call with progress events
+        group_ids (np.array, optional): Group id of each sample. If it is
+            given, samples are counted by data split in the same pass, and
+            each tree entry also gets its accuracy on each split.
+        split_spec (dict, optional): Split groups generated by
+            _get_split_data()
+    """
+
+    if tree_num is None:
+        desc = "Generating decision paths"
+    else:
+        desc = f"Generating decision paths from {tree_num} trees"
+
+    progress = _make_progress("evaluate_trees", tree_num, desc, quiet, callback)
+
+    if n_jobs > 1 and (tree_num is None or tree_num > 1):
+        # Use several chunks per worker to balance the load and update progress
+        chunk_size = 64
+        if tree_num is not None:
+            chunk_size = max(1, min(256, tree_num // (n_jobs * 8)))
+
+        with progress["bar"]:
+            _evaluate_trees_parallel(
+                tree_items,
+                x_all,
+                y_all,
+                n_jobs,
+                pack_bits,
+                rule_cache,
+                chunk_size,
+                progress,
+                group_ids,
+                split_spec,
+            )
+        return
+
+    if pack_bits:
+        packed_data = pack_binary_data(x_all, y_all)
+
+    # Close the bar even if a cancelled callback stops the loop
+    with progress["bar"]:
+        for _, _, tree_entry, (nodes, tree_table) in tree_items:
+            if pack_bits:
+                sample_counts, correct_counts = _count_table_samples_packed(
+                    tree_table, packed_data, rule_cache
+                )
+            elif group_ids is not None:
+                sample_counts, correct_counts = _count_table_samples(
+                    tree_table, x_all, y_all, group_ids, split_spec["groupNum"]
+                )
+            else:
+                sample_counts, correct_counts = _count_table_samples(
+                    tree_table, x_all, y_all
+                )
+
+            _add_tree_counts(
+                tree_entry,
+                nodes,
+                tree_table[0],
+                sample_counts,
+                correct_counts,
+                len(y_all),
+                split_spec,
+            )
+
+            if rule_cache is not None:
+                cache_stats = get_rule_cache_stats(rule_cache)
+                _update_progress(
+                    progress, cache_hit_rate=f"{cache_stats['hit_rate']:.1%}"
+                )
+            else:
+                _update_progress(progress)
+
+
+def _get_split_data(data_df, splits):
+    """Stack the rows of all data splits, so that each tree routes all rows in
+    one pass and counts them by split.
+
+    Args:
+        data_df (pd.DataFrame | np.array): Main dataset, where the last column
+            is the label
+        splits (str | dict): Name of a column in `data_df` that holds the
+            split name of each row, or {split name: dataset} of extra
+            datasets in the same format as `data_df`
+
+    Returns:
+        np.array: Data of all rows, where the last column is the label
+        np.array: Group id of each row
+        dict: Split groups {'names', 'groupNum', 'mainGroups', 'sampleNum',
+            'splitSampleNums'}. Group i holds the rows of the i-th split, and
+            the main counts come from the groups in 'mainGroups'.
+        [str]: Column names of the main dataset, or None
+    """
+
+    if isinstance(splits, str):
+        if not hasattr(data_df, "columns") or splits not in data_df.columns:
+            raise ValueError(f"Error: split column {splits} is not in the data.")
+
+        # Every row is in the main data and in its own split
+        names, group_ids = np.unique(
+            data_df[splits].astype(str).to_numpy(), return_inverse=True
+        )
+        names = names.tolist()
+        data_df = data_df.drop(columns=[splits])
+        data = data_df.to_numpy()
+        group_num = len(names)
+        main_groups = list(range(group_num))
+    else:
+        names = list(splits)
+        parts = [
+            df.to_numpy() if hasattr(df, "to_numpy") else np.asarray(df)
+            for df in list(splits.values()) + [data_df]
+        ]
+        if any(part.shape[1] != parts[-1].shape[1] for part in parts):
+            raise ValueError("Error: splits have different columns from the data.")
+
+        # The main data is the last group
+        data = np.concatenate(parts)
+        group_ids = np.repeat(np.arange(len(parts)), [len(part) for part in parts])
+        group_num = len(parts)
+        main_groups = [len(names)]
+
+    columns = data_df.columns.tolist() if hasattr(data_df, "columns") else None
+    group_counts = np.bincount(group_ids, minlength=group_num)
+
+    split_spec = {
+        "names": names,
+        "groupNum": group_num,
+        "mainGroups": main_groups,
+        "sampleNum": int(group_counts[main_groups].sum()),
+        "splitSampleNums": group_counts[: len(names)].tolist(),
+    }
+
+    return data, group_ids.astype(np.intp), split_spec, columns
+
+
+def _open_data_chunks(data, chunk_size=1 << 16):
+    """Open a dataset as an iterator of row blocks, so that it can be read
+    with bounded memory. The last column of each block is the label.
+
+    Args:
+        data (pd.DataFrame | np.array | str | iter): Dataset. It can be a data
+            frame, an array or memory-mapped array, a path of a `.npy` file
+            (memory-mapped) or a csv file (read in chunks), or any iterable of
+            row blocks (data frames or 2D arrays), e.g., a chunked csv reader
+            from `pd.read_csv(path, chunksize=n)`.
+        chunk_size (int): # rows in each block if `data` is a data frame, an
+            array, or a path. Defaults to 65536.
+
+    Returns:
+        iter: An iterator of row blocks as 2D np.array
+        [str]: Column names, or None if the blocks have no column names
+    """
+
+    if isinstance(data, (str, os.PathLike)):
+        if os.fspath(data).endswith(".npy"):
+            data = np.load(data, mmap_mode="r")
+        else:
+            import pandas as pd
+
+            data = pd.read_csv(data, chunksize=chunk_size)
+
+    if isinstance(data, np.ndarray) or hasattr(data, "iloc"):
+        columns = data.columns.tolist() if hasattr(data, "columns") else None
+        rows = data.iloc if hasattr(data, "iloc") else data
+        chunks = (rows[i : i + chunk_size] for i in range(0, len(data), chunk_size))
+    else:
+        chunks = iter(data)
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            raise ValueError("Error: the data has no rows.")
+
+        columns = None
+        if hasattr(first_chunk, "columns"):
+            columns = first_chunk.columns.tolist()
+        chunks = chain([first_chunk], chunks)
+
+    def to_array(chunk):
+        return chunk.to_numpy() if hasattr(chunk, "to_numpy") else np.asarray(chunk)
+
+    return map(to_array, chunks), columns
+
+
+def _evaluate_trees_chunked(
+    tree_items, data_chunks, pack_bits, rule_cache, quiet=False, callback=None
+):
+    """Count leaf samples and accuracies of trees on a dataset read in row
+    blocks. The data is read only once: every tree counts the samples of a
+    block, and the counts are accumulated over all blocks. The counts are
+    written into the hierarchy trees in place, and each tree entry gets its
+    accuracy appended.
+
+    Args:
+        tree_items (iter): An iterable of tree items generated by
+            _iter_tree_items()
+        data_chunks (iter): An iterator of row blocks generated by
+            _open_data_chunks()
+        pack_bits (bool): Whether to evaluate trees on bit-packed data
+        rule_cache (dict): Rule cache generated by make_rule_cache() or None
+        quiet (bool): Whether to hide the progress bar
+        callback (function, optional): Function to call with progress events
+
+    Returns:
+        int: Total # of data samples
+    """
+
+    # All trees need to stay decoded to accumulate counts across blocks
+    tree_items = list(tree_items)
+    all_counts = [
+        [
+            np.zeros(len(tree_table[0]), dtype=int),
+            np.zeros(len(tree_table[0]), dtype=int),
+        ]
+        for _, _, _, (_, tree_table) in tree_items
+    ]
+
+    sample_num = 0
+    desc = f"Generating decision paths from {len(tree_items)} trees"
+
+    progress = _make_progress(
+        "evaluate_trees", None, desc, quiet, callback, unit="chunk"
+    )
+
+    # Close the bar even if a cancelled callback stops the loop
+    with progress["bar"]:
+        for chunk in data_chunks:
+            x_chunk, y_chunk = chunk[:, :-1], chunk[:, -1]
+            sample_num += len(y_chunk)
+
+            if pack_bits:
+                packed_data = pack_binary_data(x_chunk, y_chunk)
+
+            for (_, _, _, (_, tree_table)), counts in zip(tree_items, all_counts):
+                if pack_bits:
+                    sample_counts, correct_counts = _count_table_samples_packed(
+                        tree_table, packed_data, rule_cache
+                    )
+                else:
+                    sample_counts, correct_counts = _count_table_samples(
+                        tree_table, x_chunk, y_chunk
+                    )
+
+                counts[0] += sample_counts
+                counts[1] += correct_counts
+
+            _update_progress(progress)
+
+    for (_, _, tree_entry, (nodes, tree_table)), counts in zip(tree_items, all_counts):
+        cur_acc = _annotate_tree(nodes, tree_table[0], counts[0], counts[1], sample_num)
+        tree_entry.append(cur_acc)
+
+    return sample_num
+
+
+def _iter_tree_items(tree_stream, rule_builder, new_tree_map, canonical_map=None):
+    """Decode each tree once as it is read from a tree stream, and build its
+    decision rules and hierarchy tree from the decoded node table.
+
+    Args:
+        tree_stream (iter): An iterable of (tree id, tree strings, objective)
+            generated by select_trie_trees()
+        rule_builder (list): Root builder node of the decision rule hierarchy
+        new_tree_map (dict): Tree map to add tree entries to
+        canonical_map (dict, optional): Map from canonical key to the first
+            tree id with that key. If it is given, a tree identical to an
+            earlier tree is not yielded, and its tree entry holds the earlier
+            tree's id instead of a hierarchy tree.
+
+    Yields:
+        tuple: (tree id, tree strings, tree entry, (hierarchy nodes, node
+            table)), where a tree entry is [hierarchy tree, objective]
+    """
+
+    for tid, tree_strings, objective in tree_stream:
+        tree_table = decode_tree(tree_strings)
+        all_rules = _get_table_decision_rules(tree_table)
+        _add_decision_rules(rule_builder, all_rules, tid, keep_position=False)
+
+        if canonical_map is not None:
+            canonical_key = get_canonical_tree_key(tree_table)
+
+            if canonical_key in canonical_map:
+                # Reuse the representative tree; its accuracy is filled later
+                new_tree_map[tid] = [canonical_map[canonical_key], round(objective, 5)]
+                continue
+
+            canonical_map[canonical_key] = tid
+
+        nodes = _get_table_hierarchy_tree(tree_table)
+        tree_entry = [nodes[0], round(objective, 5)]
+        new_tree_map[tid] = tree_entry
+
+        yield tid, tree_strings, tree_entry, (nodes, tree_table)
+
+
+def get_filter_index(decision_paths):
+    """Precompute the index structures of the search panel filters, so that
+    the widget can filter trees with binary searches and set operations
+    instead of scanning all trees.
+
+    Args:
+        decision_paths (dict): Decision paths generated by
+            transform_trie_to_rules()
+
+    Returns:
+        dict: {
+            'treeIDs': all tree ids,
+            'heights': height of each tree in the rule trie,
+            'minSamples': min # samples in a leaf of each tree,
+            'accuracyOrder': tree ids sorted by accuracy,
+            'sortedAccuracies': accuracies of trees in `accuracyOrder`,
+            'minSampleOrder': tree ids sorted by min leaf sample,
+            'sortedMinSamples': min leaf samples of trees in `minSampleOrder`,
+            'featureTrees': {feature id: ids of trees using it},
+            'depthFeatureTrees': {depth: {feature id: ids of trees using it at
+                this depth (the root has depth 1)}}
+        }
+    """
+
+    tree_map = decision_paths["treeMap"]
+    tree_ids = list(tree_map)
+
+    # Tree heights are the depths of their leaves in the rule trie. A rule
+    # lists the splits from the tree root, so the features on the path to a
+    # tree's leaf are the tree's own features at each depth.
+    heights = {}
+    all_tree_features = {}
+    working_stack = [(decision_paths["trie"], 0, ())]
+    while len(working_stack) > 0:
+        node, depth, path = working_stack.pop()
+        if node["f"] == "_":
+            heights[node["t"]] = max(heights.get(node["t"], 0), depth)
+            tree_features = all_tree_features.setdefault(node["t"], set())
+            tree_features.update(
+                (str(i + 1), feature) for i, feature in enumerate(path)
+            )
+        else:
+            if depth > 0:
+                path = path + (node["f"],)
+            working_stack.extend((c, depth + 1, path) for c in node["c"])
+
+    min_samples = []
+    feature_trees = {}
+    depth_feature_trees = {}
+
+    for tid in tree_ids:
+        tree = tree_map[tid][0]
+        if isinstance(tree, int):
+            # Identical trees have the same leaf counts as their representative
+            tree = tree_map[tree][0]
+
+        min_sample = None
+        working_stack = [tree]
+
+        while len(working_stack) > 0:
+            node = working_stack.pop()
+            if "c" in node:
+                working_stack.extend(node["c"])
+            elif min_sample is None or node["f"][1] < min_sample:
+                min_sample = node["f"][1]
+
+        min_samples.append(min_sample)
+        tree_features = all_tree_features.get(tid, set())
+
+        for depth, feature in tree_features:
+            cur_trees = depth_feature_trees.setdefault(depth, {})
+            cur_trees.setdefault(feature, []).append(tid)
+
+        for feature in {feature for _, feature in tree_features}:
+            feature_trees.setdefault(feature, []).append(tid)
+
+    accuracy_order = sorted(tree_ids, key=lambda tid: tree_map[tid][2])
+    min_sample_order = sorted(range(len(tree_ids)), key=lambda i: min_samples[i])
+
+    filter_index = {
+        "treeIDs": tree_ids,
+        "heights": [heights.get(tid, 0) for tid in tree_ids],
+        "minSamples": min_samples,
+        "accuracyOrder": accuracy_order,
+        "sortedAccuracies": [tree_map[tid][2] for tid in accuracy_order],
+        "minSampleOrder": [tree_ids[i] for i in min_sample_order],
+        "sortedMinSamples": [min_samples[i] for i in min_sample_order],
+        "featureTrees": feature_trees,
+        "depthFeatureTrees": depth_feature_trees,
+    }
+
+    return filter_index
+
+
+def update_decision_paths(
+    decision_paths, added_df=None, removed_df=None, sample_num=None
+):
+    """Update the sample counts and accuracies of decision paths in place when
+    data rows are added or removed. Only the added and removed rows are routed
+    through the trees. The accuracy intervals of an approximate result follow
+    the new accuracies.
+
+    Args:
+        decision_paths (dict): Decision paths generated by
+            transform_trie_to_rules() without `splits`
+        added_df (pd.DataFrame, optional): New rows, in the same format as the
+            `data_df` of transform_trie_to_rules()
+        removed_df (pd.DataFrame, optional): Rows to remove, in the same format
+        sample_num (int, optional): # rows that the decision paths were
+            evaluated on. If it is not given, it is the largest # samples at a
+            tree root, which is exact when all feature values are 0 or 1.
+
+    Returns:
+        int: # rows after the update, to pass as `sample_num` next time
+    """
+
+    # Rows do not say which split they belong to, so the per-split counts
+    # cannot be updated
+    if "splits" in decision_paths:
+        raise ValueError(
+            "Error: decision paths with splits cannot be updated. Transform the "
+            "trie again with the new data and splits."
+        )
+
+    tree_map = decision_paths["treeMap"]
+
+    deltas = []
+    for data_df, sign in [(added_df, 1), (removed_df, -1)]:
+        if data_df is not None:
+            data = data_df.to_numpy()
+            deltas.append((data[:, 0 : data.shape[1] - 1], data[:, -1], sign))
+
+    if sample_num is None:
+        sample_num = max(
+            (e[0]["f"][1] for e in tree_map.values() if not isinstance(e[0], int)),
+            default=0,
+        )
+
+    new_sample_num = sample_num + sum(sign * len(y) for _, y, sign in deltas)
+    if new_sample_num <= 0:
+        raise ValueError("Error: no rows are left after removing rows.")
+
+    # Compute all counts before changing any tree, so a failure changes nothing
+    tree_updates = []
+
+    for tid, tree_entry in tree_map.items():
+        if isinstance(tree_entry[0], int):
+            continue
+
+        nodes, *tree_table = compile_tree(tree_entry[0])
+        sample_counts = np.array([node["f"][1] for node in nodes])
+        correct_counts = np.array([max(node["f"][2], 0) for node in nodes])
+
+        for x_delta, y_delta, sign in deltas:
+            delta_samples, delta_correct = _count_table_samples(
+                tree_table, x_delta, y_delta
+            )
+            sample_counts += sign * delta_samples
+            correct_counts += sign * delta_correct
+
+        if np.any(sample_counts < 0) or np.any(correct_counts < 0):
+            raise ValueError(
+                f"Error: the removed rows are not in the samples of tree {tid}."
+            )
+
+        tree_updates.append(
+            (tree_entry, nodes, tree_table[0], sample_counts, correct_counts)
+        )
+
+    old_accuracies = {tid: tree_entry[2] for tid, tree_entry in tree_map.items()}
+
+    for tree_entry, nodes, features, sample_counts, correct_counts in tree_updates:
+        tree_entry[2] = _annotate_tree(
+            nodes, features, sample_counts, correct_counts, new_sample_num
+        )
+
+    # Identical trees share the accuracy of their representative
+    for tree_entry in tree_map.values():
+        if isinstance(tree_entry[0], int):
+            tree_entry[2] = tree_map[tree_entry[0]][2]
+
+    # Keep the accuracy intervals of approximate results around the new values
+    if "approximation" in decision_paths:
+        _shift_approximation(
+            decision_paths["approximation"], tree_map, old_accuracies, new_sample_num
+        )
+
+    if "filterIndex" in decision_paths:
+        decision_paths["filterIndex"] = get_filter_index(decision_paths)
+
+    return new_sample_num
+
+
+def get_approximate_sample_size(max_error=0.01, confidence=0.95):
+    """Get the # of rows to sample so that the confidence interval of any
+    tree accuracy is at most `max_error` wide on each side.
+
+    Args:
+        max_error (float, optional): Max half-width of the accuracy confidence
+            interval. Defaults to 0.01.
+        confidence (float, optional): Confidence level. Defaults to 0.95.
+
+    Returns:
+        int: Sample size
+    """
+
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+    # Accuracy variance is at most 0.25
+    return int(np.ceil(z * z * 0.25 / (max_error * max_error)))
+
+
+def sample_rows_stratified(y_all, sample_size, random_state=0):
+    """Sample rows without replacement, stratified by the label. Each label
+    gets a share of the sample proportional to its share of the data, and at
+    least one row.
+
+    Args:
+        y_all (np.array): Data labels (0 or 1)
+        sample_size (int): # rows to sample
+        random_state (int, optional): Seed of the random generator.
+            Defaults to 0.
+
+    Returns:
+        np.array: Sorted indexes of the sampled rows
+        dict: {label: (# rows with this label, # sampled rows with this label)}
+    """
+
+    labels = np.unique(y_all)
+    if not np.all(np.isin(labels, [0, 1])):
+        raise ValueError("Error: approximate evaluation requires 0/1 labels.")
+
+    rng = np.random.default_rng(random_state)
+    sample_size = min(sample_size, len(y_all))
+
+    sample_rows = []
+    strata = {}
+
+    for label in labels:
+        label_rows = np.flatnonzero(y_all == label)
+        label_size = round(sample_size * len(label_rows) / len(y_all))
+        label_size = min(max(label_size, 1), len(label_rows))
+
+        sample_rows.append(rng.choice(label_rows, label_size, replace=False))
+        strata[int(label)] = (len(label_rows), label_size)
+
+    return np.sort(np.concatenate(sample_rows)), strata
+
+
+def _scale_sampled_tree(root, strata, z):
+    """Scale the sample counts of a tree evaluated on a stratified sample to the
+    whole data in place, and estimate the confidence interval of its accuracy.
+    A leaf's correct count is the # samples with its label, so the counts of
+    each label stratum can be scaled separately.
+
+    Args:
+        root (dict): Hierarchy tree annotated on the sampled rows
+        strata (dict): Strata generated by sample_rows_stratified()
+        z (float): Normal quantile of the confidence level
+
+    Returns:
+        float: Estimated accuracy
+        list: [lower bound, upper bound] of the accuracy
+    """
+
+    nodes, features, lefts, rights, _ = compile_tree(root)
+    weights = {label: n / max(sample_n, 1) for label, (n, sample_n) in strata.items()}
+    data_num = sum(n for n, _ in strata.values())
+
+    scaled_counts = [0] * len(nodes)
+    stratum_correct = {label: 0 for label in strata}
+
+    # Children have larger ids, so we can aggregate the counts bottom-up
+    for i in range(len(nodes) - 1, -1, -1):
+        if features[i] >= 0:
+            scaled_counts[i] = scaled_counts[lefts[i]] + scaled_counts[rights[i]]
+            nodes[i]["f"][1] = scaled_counts[i]
+            continue
+
+        leaf_label, sample_count, correct_count = nodes[i]["f"]
+        label = 1 if leaf_label == "+" else 0
+        other_count = sample_count - correct_count
+
+        stratum_correct[label] = stratum_correct.get(label, 0) + correct_count
+        scaled_correct = correct_count * weights.get(label, 0)
+        scaled_other = other_count * weights.get(1 - label, 0)
+
+        scaled_counts[i] = round(scaled_correct + scaled_other)
+        nodes[i]["f"][1] = scaled_counts[i]
+        nodes[i]["f"][2] = round(scaled_correct)
+
+    # Stratified estimate with the finite population correction
+    accuracy = 0
+    variance = 0
+    for label, (n, sample_n) in strata.items():
+        p = stratum_correct[label] / sample_n
+        accuracy += n / data_num * p
+        if sample_n > 1:
+            variance += (
+                (n / data_num) ** 2 * (1 - sample_n / n) * p * (1 - p) / (sample_n - 1)
+            )
+
+    half_width = z * np.sqrt(variance)
+    interval = [
+        round(max(0, accuracy - half_width), 5),
+        round(min(1, accuracy + half_width), 5),
+    ]
+
+    return round(accuracy, 5), interval
+
+
+def _summarize_approximation(approximation):
+    """Recompute the summary of an approximation entry from its per-tree
+    state in place: 'exactNum' is the # trees with exact values, and
+    'maxError' is the largest half-width of the intervals of other trees.
+
+    Args:
+        approximation (dict): Approximation entry of decision paths
+    """
+
+    # Entries cached before the per-tree state only have exact empty intervals
+    if "exact" not in approximation:
+        approximation["exact"] = [
+            interval[0] == interval[1] for interval in approximation["intervals"]
+        ]
+
+    half_widths = [
+        (interval[1] - interval[0]) / 2
+        for interval, exact in zip(approximation["intervals"], approximation["exact"])
+        if not exact
+    ]
+    approximation["exactNum"] = sum(approximation["exact"])
+    approximation["maxError"] = round(max(half_widths, default=0), 5)
+
+
+def _shift_approximation(approximation, tree_map, old_accuracies, new_data_num):
+    """Move the accuracy intervals of approximate trees in place after rows
+    are added or removed. The rows are counted exactly, so the error of the
+    estimated correct count stays the same, and the intervals follow the new
+    accuracies with their widths scaled to the new # rows.
+
+    Args:
+        approximation (dict): Approximation entry of decision paths
+        tree_map (dict): Updated tree map
+        old_accuracies (dict): Accuracy of each tree before the update
+        new_data_num (int): # rows after the update
+    """
+
+    _summarize_approximation(approximation)
+    scale = approximation["dataNum"] / new_data_num
+
+    for i, tid in enumerate(approximation["treeIDs"]):
+        accuracy = tree_map[tid][2]
+        if approximation["exact"][i]:
+            approximation["intervals"][i] = [accuracy] * 2
+            continue
+
+        lower, upper = approximation["intervals"][i]
+        old_accuracy = old_accuracies[tid]
+        approximation["intervals"][i] = [
+            round(max(0, accuracy - (old_accuracy - lower) * scale), 5),
+            round(min(1, accuracy + (upper - old_accuracy) * scale), 5),
+        ]
+
+    approximation["dataNum"] = new_data_num
+    _summarize_approximation(approximation)
+
+
+def refine_decision_paths(decision_paths, data_df, tree_ids):
+    """Replace the approximate counts and accuracies of some trees with exact
+    ones computed on the whole data, e.g., for trees that the user pins.
+
+    Args:
+        decision_paths (dict): Decision paths generated by
+            transform_trie_to_rules(..., approximate=True) without `splits`
+        data_df (pd.DataFrame): The whole dataset given to
+            transform_trie_to_rules()
+        tree_ids ([int]): Ids of trees to refine
+    """
+
+    # The whole data does not have the splits, so split counts would be stale
+    if "splits" in decision_paths:
+        raise ValueError(
+            "Error: decision paths with splits cannot be refined. Transform the "
+            "trie again without approximate."
+        )
+
+    tree_map = decision_paths["treeMap"]
+    data = data_df.to_numpy()
+    x_all, y_all = data[:, :-1], data[:, -1]
+
+    # Identical trees are refined with their representative
+    rep_ids = set()
+    for tid in tree_ids:
+        tree = tree_map[tid][0]
+        rep_ids.add(tree if isinstance(tree, int) else tid)
+
+    for tid in rep_ids:
+        tree_map[tid][2] = count_leaf_samples(tree_map[tid][0], x_all, y_all)
+
+    refined_ids = set(rep_ids)
+    for tid, tree_entry in tree_map.items():
+        if isinstance(tree_entry[0], int) and tree_entry[0] in rep_ids:
+            tree_entry[2] = tree_map[tree_entry[0]][2]
+            refined_ids.add(tid)
+
+    # Exact accuracies have empty intervals, and other trees stay approximate
+    approximation = decision_paths.get("approximation")
+    if approximation is not None:
+        _summarize_approximation(approximation)
+        for i, tid in enumerate(approximation["treeIDs"]):
+            if tid in refined_ids:
+                approximation["intervals"][i] = [tree_map[tid][2]] * 2
+                approximation["exact"][i] = True
+        _summarize_approximation(approximation)
+
+    if "filterIndex" in decision_paths:
+        decision_paths["filterIndex"] = get_filter_index(decision_paths)
+
+
+def _hash_trie(trie, digest):
+    """Add the content of a Rashomon trie to a hash.
+
+    Args:
+        trie (dict | str | file): Rashomon trie json as a loaded dict, or a
+            path or a seekable file object of the json file
+        digest (hashlib hash): Hash to update
+
+    Returns:
+        bool: False if the trie cannot be hashed (a file object that cannot
+            be rewound)
+    """
+
+    if isinstance(trie, dict):
+        # Walk the trie and hash node by node, so that it is never dumped into
+        # a second full copy. Key order decides tree ids, so it is part of the
+        # content.
+        digest.update(b"{")
+        stack = [iter(trie.items())]
+        while stack:
+            item = next(stack[-1], None)
+            if item is None:
+                stack.pop()
+                digest.update(b"}")
+                continue
+
+            key, value = item
+            digest.update(dumps(key).encode("utf-8") + b":")
+            if isinstance(value, dict):
+                digest.update(b"{")
+                stack.append(iter(value.items()))
+            else:
+                digest.update(dumps(value).encode("utf-8") + b",")
+        return True
+
+    if isinstance(trie, (str, os.PathLike)):
+        with open(trie, "rb") as fp:
+            return _hash_trie(fp, digest)
+
+    if not trie.seekable():
+        return False
+
+    start = trie.tell()
+    while True:
+        chunk = trie.read(1 << 20)
+        if not chunk:
+            break
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        digest.update(chunk)
+    trie.seek(start)
+
+    return True
+
+
+def _get_cache_key(trie, data, feature_names, feature_description, options):
+    """Compute the cache key of a transform_trie_to_rules() result.
+
+    Args:
+        trie (dict | str | file): Rashomon trie json
+        data (np.array | pd.DataFrame | str | iter | dict): Data samples and
+            labels, in any format accepted by _open_data_chunks(), or sparse
+            data generated by pack_sparse_data() with the labels as 'y'
+        feature_names ([str]): Feature names
+        feature_description (dict): Feature descriptions
+        options (dict): Other arguments that change the result
+
+    Returns:
+        str: Hex digest of the key, or None if the trie or the data cannot be
+            hashed (an iterator of row blocks can only be read once)
+    """
+
+    from timbertrek import __version__
+
+    digest = hashlib.blake2b(digest_size=20)
+    if not _hash_trie(trie, digest):
+        return None
+
+    if isinstance(data, (str, os.PathLike)):
+        _hash_trie(data, digest)
+    elif isinstance(data, dict):
+        digest.update(f"sparse {data['n']}".encode("utf-8"))
+        for key in ["indptr", "indices", "codes", "fills", "y"]:
+            array = np.ascontiguousarray(data[key])
+            if array.dtype == object:
+                array = array.astype(str)
+            digest.update(array.dtype.str.encode("utf-8"))
+            digest.update(array.tobytes())
+    elif isinstance(data, np.ndarray) or hasattr(data, "iloc"):
+        # Hash row blocks so that memory-mapped data is never fully loaded
+        digest.update(f"{data.shape}".encode("utf-8"))
+        for chunk in _open_data_chunks(data)[0]:
+            if chunk.dtype == object:
+                chunk = chunk.astype(str)
+            chunk = np.ascontiguousarray(chunk)
+            digest.update(chunk.dtype.str.encode("utf-8"))
+            digest.update(chunk.tobytes())
+    else:
+        return None
+
+    meta = [feature_names, feature_description, options, __version__]
+    digest.update(dumps(meta, sort_keys=True).encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+# Temporary cache files older than this (in seconds) are left by crashed writes
+_CACHE_TEMP_MAX_AGE = 3600
+
+
+def _sweep_cache_dir(cache_dir, max_temp_age=_CACHE_TEMP_MAX_AGE):
+    """Remove temporary files that crashed writes left in the cache directory.
+    Newer temporary files can belong to writes still in progress in other
+    processes, so they are kept.
+
+    Args:
+        cache_dir (str): Cache directory
+        max_temp_age (float): Age in seconds after which a temporary file is
+            stale. Defaults to 1 hour.
+    """
+
+    if not os.path.isdir(cache_dir):
+        return
+
+    now = time.time()
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith(".tmp"):
+            continue
+        try:
+            if now - entry.stat().st_mtime > max_temp_age:
+                os.unlink(entry.path)
+        except OSError:
+            # Another process has renamed or removed it
+            pass
+
+
+def _load_cached_decision_paths(cache_dir, cache_key):
+    """Load decision paths from the cache directory.
+
+    Args:
+        cache_dir (str): Cache directory
+        cache_key (str): Cache key generated by _get_cache_key()
+
+    Returns:
+        dict: Decision paths, or None if they are not cached
+    """
+
+    cache_file = os.path.join(cache_dir, f"{cache_key}.ttrk")
+
+    try:
+        with open(cache_file, "rb") as fp:
+            compact_data = fp.read()
+    except OSError:
+        # Missing or evicted by another process
+        return None
+
+    try:
+        decision_paths = decode_compact_decision_paths(compact_data)
+    except (
+        OSError,
+        EOFError,
+        ValueError,
+        KeyError,
+        IndexError,
+        zlib.error,
+        struct.error,
+    ):
+        # A damaged entry is a miss, and it is removed so that the new result
+        # replaces it
+        try:
+            os.unlink(cache_file)
+        except OSError:
+            pass
+        return None
+
+    try:
+        # Mark this entry as recently used
+        os.utime(cache_file)
+    except OSError:
+        pass
+
+    return decision_paths
+
+
+def _save_cached_decision_paths(cache_dir, cache_key, decision_paths, size_limit):
+    """Save decision paths in the cache directory, and evict the least recently
+    used entries if the cache is larger than its size limit. Entries are
+    written to a temporary file and renamed, so concurrent readers never see
+    a partial entry.
+
+    Args:
+        cache_dir (str): Cache directory
+        cache_key (str): Cache key generated by _get_cache_key()
+        decision_paths (dict): Decision paths to cache
+        size_limit (int): Max total size of cache entries in bytes
+    """
+
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(cache_dir, f"{cache_key}.ttrk")
+
+    compact_data = encode_compact_decision_paths(decision_paths)
+
+    fd, temp_file = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(compact_data)
+        os.replace(temp_file, cache_file)
+    except BaseException:
+        os.unlink(temp_file)
+        raise
+
+    # Evict from the least recently used entry. Temporary files of writes in
+    # progress take space too, but only finished entries are evicted.
+    entries = []
+    temp_size = 0
+    for entry in os.scandir(cache_dir):
+        is_temp = entry.name.endswith(".tmp")
+        # Keep the new entry even if it has the same mtime as older ones
+        if not (is_temp or entry.name.endswith(".ttrk")) or entry.path == cache_file:
+            continue
+        try:
+            entry_stat = entry.stat()
+        except OSError:
+            continue
+        if is_temp:
+            temp_size += entry_stat.st_size
+        else:
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+
+    entries.sort()
+    total_size = sum(size for _, size, _ in entries) + len(compact_data) + temp_size
+
+    for _, size, path in entries:
+        if total_size <= size_limit:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            # Another process has removed it
+            pass
+        total_size -= size
+
+
+def _get_feature_info(feature_names, feature_description, columns):
+    """Fill in the default feature names and descriptions.
+
+    Args:
+        feature_names ([str]): Feature names, or None to use `columns`
+        feature_description (dict): Feature descriptions, or None to describe
+            each feature with its own name
+        columns ([str]): Column names of the data, or None
+
+    Returns:
+        [str]: Feature names
+        dict: Feature descriptions
+    """
+
+    if feature_names is None:
+        if columns is None:
+            raise ValueError(
+                "Error: feature_names is required if the data has no column names."
+            )
+        feature_names = columns
+
+    if feature_description is None:
+        feature_description = {}
+        for f in feature_names:
+            name = re.sub(r"(.*):.*", r"\1", f)
+            if name not in feature_description:
+                feature_description[name] = {
+                    "info": name,
+                    "type": "count",
+                    "short": name,
+                }
+
+    return feature_names, feature_description
+
+
+def transform_trie_to_rules(
+    trie,
+    data_df,
+    feature_names=None,
+    feature_description=None,
+    pack_bits=False,
+    rule_cache=None,
+    n_jobs=1,
+    dedup_trees=False,
+    max_objective=None,
+    top_k=None,
+    filter_index=False,
+    cache_dir=None,
+    cache_size_limit=1 << 30,
+    approximate=False,
+    sample_size=None,
+    max_error=0.01,
+    confidence=0.95,
+    random_state=0,
+    chunk_size=None,
+    splits=None,
+    quiet=False,
+    callback=None,
+    return_stats=False,
+):
+    """Transform Rashomon trie json string to hierarchical rules for TimberTrek
+
+    Args:
+        trie (dict | str | file): Rashomon trie json. It can be a loaded dict,
+            or a path or file object of the json file. A path or file is
+            parsed incrementally, and each tree is evaluated as soon as it is
+            read, so the whole trie is never loaded into memory.
+        data_df (pd.DataFrame | np.array | str | iter): Dataset to compute tree
+            accuracies, where the last column is the label. It can be a data
+            frame, an array, a path of a `.npy` file or a csv file, or any
+            iterable of row blocks (data frames or 2D arrays), e.g.,
+            `pd.read_csv(path, chunksize=n)`. A `.npy` file is memory-mapped,
+            and a path, a memory-mapped array, or an iterable is read in row
+            blocks once, so the data does not need to fit in memory. It can
+            also be a scipy.sparse matrix or a data frame with sparse columns
+            (e.g., binarized data with thousands of features): each tree
+            only expands the columns it splits on. Sparse data does not
+            support `chunk_size`, `approximate`, `pack_bits`, `rule_cache`, or
+            `splits`.
+        feature_names ([str]): A list of feature names. Each name has format like
+            'age:<26'. If it is not given, uses the data frame hearders as feature
+            names. It is required if the data has no column names.
+        feature_description (dict): A dictionary that maps feature name to their
+            descriptions. If it is not given, original feature names will be
+            used (might be hard for readers to understand).
+        pack_bits (bool): Whether to pack the data into bitsets and count leaf
+            samples with popcounts. It requires all values in `data_df` to be
+            0 or 1, and it is much faster on large datasets. Defaults to False.
+        rule_cache (dict): A rule cache generated by make_rule_cache(). Trees
+            sharing a decision path reuse its sample counts from this cache,
+            and you can read the hit rate with get_rule_cache_stats(). The
+            cache works on bitsets, so it also turns on `pack_bits`.
+        n_jobs (int): # of processes to evaluate trees in parallel. -1 means
+            using all CPUs. The dataset is shared with the processes through
+            shared memory. Defaults to 1.
+        dedup_trees (bool): Whether to evaluate identical trees only once.
+            Trees with the same structure (see get_canonical_tree_key()) are
+            mapped to the first such tree: their `treeMap` entry is
+            [representative tree id, objective, accuracy]. Trees that only
+            make the same predictions, e.g., same splits in a different order,
+            are kept apart, as their splits and leaf counts differ. Defaults
+            to False.
+        max_objective (float): Only include trees with an objective no larger
+            than it, e.g., to view a tighter Rashomon set. Other trees are
+            never decoded, evaluated, or exported. Defaults to None.
+        top_k (int): Only include the k trees with the smallest objectives.
+            It can be combined with `max_objective`. Tree ids stay the same as
+            in the full trie. Defaults to None.
+        filter_index (bool): Whether to add the search panel filter indexes
+            generated by get_filter_index() as `filterIndex`, so that the
+            filters stay responsive with many trees. Defaults to False.
+        cache_dir (str): Directory to cache the result in. A call with the same
+            trie, data, feature names, feature description, and options loads
+            the cached result instead of evaluating the trees. Several
+            processes can share the directory. Defaults to None (no cache).
+        cache_size_limit (int): Max total size of the cache directory in
+            bytes. Least recently used results are evicted first. Defaults to
+            1 GiB.
+        approximate (bool): Whether to evaluate trees on a row sample
+            stratified by the label, and scale the counts to the whole data.
+            The result gets an `approximation` entry: {'sampleNum',
+            'dataNum', 'confidence', 'treeIDs', 'intervals', 'exact',
+            'exactNum', 'maxError'}, where `intervals` has the accuracy
+            confidence interval of each tree in `treeIDs`, `exact` tells if
+            the tree's values are exact, and 'exactNum' and 'maxError' (the
+            largest interval half-width of other trees) summarize them. Use
+            refine_decision_paths() to get exact values for some trees later.
+            Defaults to False.
+        sample_size (int): # rows to sample if `approximate` is True. If it is
+            not given, it is computed from `max_error`.
+        max_error (float): Max half-width of the accuracy confidence intervals
+            if `approximate` is True and `sample_size` is not given. Defaults
+            to 0.01.
+        confidence (float): Confidence level of the accuracy intervals.
+            Defaults to 0.95.
+        random_state (int): Seed of the row sample. Defaults to 0.
+        chunk_size (int): # rows to read at a time. If it is given, the data is
+            always read in row blocks, and leaf counts are accumulated over the
+            blocks. Block evaluation runs in one process and does not support
+            `approximate`. Defaults to None (65536 rows if the data is read in
+            blocks).
+        splits (str | dict): Data splits to evaluate trees on in the same
+            pass, e.g., train, validation, and test sets, or protected groups.
+            It can be the name of a column in `data_df` that holds the split
+            name of each row (the column is not a feature, and the main counts
+            use all rows), or {split name: dataset} of extra datasets in the
+            same format as `data_df`. Each leaf node gets an 's' entry with
+            the [# samples, # correct samples] of each split, each `treeMap`
+            entry gets a 4th item with the accuracy of each split (None for an
+            empty split), and the result gets a `splits` entry with the split
+            names in the same order. It requires in-memory data and does not
+            support `approximate`, `pack_bits`, or `rule_cache`. Defaults to
+            None.
+        quiet (bool): Whether to hide the progress bar. Defaults to False.
+        callback (function): Function to call with progress and metrics
+            events, e.g., to feed them to your own logging:
+            {'type': 'progress', 'stage', 'done', 'total'} as trees (or data
+            chunks) are evaluated, {'type': 'stage', 'stage', 'time',
+            'peakMemory'} when a stage ends, and {'type': 'end', 'stats'} at
+            the end. Defaults to None.
+        return_stats (bool): Whether to also return the stats of this call:
+            {'time', 'stages': {stage: {'time', 'peakMemory'}}, 'cacheHit',
+            'sampleNum', 'treeNum', 'uniqueTreeNum', 'ruleNum', 'ruleCache'},
+            where 'uniqueTreeNum' is the # trees after `dedup_trees`, and
+            'ruleCache' has the get_rule_cache_stats() of `rule_cache`. Time
+            is in seconds. Peak memory (bytes of the traced peak above the
+            stage start) is only recorded if tracemalloc is tracing, e.g.,
+            after tracemalloc.start(); otherwise it is None. The traced peak
+            is not reset, so callers can still read their own peak. Defaults
+            to False.
+
+    Returns:
+        A string of json object of the hierarchical decision rules, or a tuple
+            (decision paths, stats) if `return_stats` is True
+    """
+
+    stats = {"stages": {}, "cacheHit": False, "sampleNum": None}
+    start_time = time.perf_counter()
+
+    def finish(decision_paths):
+        tree_map = decision_paths["treeMap"]
+        stats["time"] = time.perf_counter() - start_time
+        stats["treeNum"] = len(tree_map)
+        stats["uniqueTreeNum"] = sum(
+            1 for tree_entry in tree_map.values() if not isinstance(tree_entry[0], int)
+        )
+        stats["ruleNum"] = _count_rule_leaves(decision_paths["trie"])[0]
+        stats["ruleCache"] = None
+        if rule_cache is not None:
+            stats["ruleCache"] = get_rule_cache_stats(rule_cache)
+
+        if callback is not None:
+            callback({"type": "end", "stats": stats})
+
+        if return_stats:
+            return decision_paths, stats
+        return decision_paths
+
+    sparse = _is_sparse_data(data_df)
+    if sparse and (
+        chunk_size is not None
+        or approximate
+        or pack_bits
+        or rule_cache is not None
+        or splits is not None
+    ):
+        raise ValueError(
+            "Error: sparse data is not supported with chunk_size, approximate, "
+            "pack_bits, rule_cache, or splits."
+        )
+
+    # Read the data in row blocks if it might not fit in memory
+    chunked = not sparse and (
+        chunk_size is not None
+        or isinstance(data_df, (str, os.PathLike, np.memmap))
+        or not (isinstance(data_df, np.ndarray) or hasattr(data_df, "iloc"))
+    )
+
+    if splits is not None and (
+        chunked or approximate or pack_bits or rule_cache is not None
+    ):
+        raise ValueError(
+            "Error: splits are not supported with chunked data, approximate, "
+            "pack_bits, or rule_cache."
+        )
+
+    group_ids, split_spec = None, None
+
+    with _track_stage(stats, "load_data", callback):
+        if splits is not None:
+            data, group_ids, split_spec, columns = _get_split_data(data_df, splits)
+            x_all, y_all = data[:, :-1], data[:, -1]
+        elif sparse:
+            x_all, y_all, columns = _get_sparse_data(data_df)
+        elif chunked:
+            if approximate:
+                raise ValueError("Error: approximate evaluation needs in-memory data.")
+            data_chunks, columns = _open_data_chunks(data_df, chunk_size or 1 << 16)
+        else:
+            columns = None
+            if hasattr(data_df, "columns"):
+                columns = data_df.columns.tolist()
+
+            # Extract the x data from the dataframe (here we use all data to evaluate)
+            data = data_df.to_numpy() if hasattr(data_df, "to_numpy") else data_df
+            x_all, y_all = data[:, :-1], data[:, -1]
+
+    feature_names, feature_description = _get_feature_info(
+        feature_names, feature_description, columns
+    )
+
+    cache_key = None
+    if cache_dir is not None:
+        with _track_stage(stats, "load_cache", callback):
+            _sweep_cache_dir(cache_dir)
+
+            options = {
+                "dedup_trees": dedup_trees,
+                "max_objective": max_objective,
+                "top_k": top_k,
+                "filter_index": filter_index,
+                "approximate": approximate,
+            }
+            if approximate:
+                options.update(
+                    sample_size=sample_size,
+                    max_error=max_error,
+                    confidence=confidence,
+                    random_state=random_state,
+                )
+
+            if sparse:
+                key_data = {**x_all, "y": y_all}
+            elif chunked:
+                key_data = data_df
+            else:
+                key_data = data
+
+            if split_spec is not None:
+                options.update(splits=split_spec["names"])
+                key_data = np.column_stack([data, group_ids])
+
+            cache_key = _get_cache_key(
+                trie, key_data, feature_names, feature_description, options
+            )
+
+            decision_paths = None
+            if cache_key is not None:
+                decision_paths = _load_cached_decision_paths(cache_dir, cache_key)
+
+        if decision_paths is not None:
+            stats["cacheHit"] = True
+            return finish(decision_paths)
+
+    pack_bits = pack_bits or rule_cache is not None
+
+    if n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+
+    # Construct and evaluate trees one at a time
+    with _track_stage(stats, "select_trees", callback):
+        if isinstance(trie, dict):
+            tree_stream = select_trie_trees(iter_trie_trees(trie), max_objective, top_k)
+            tree_num = None
+            if top_k is None:
+                tree_num = sum(
+                    1 for _ in select_trie_trees(iter_trie_trees(trie), max_objective)
+                )
+        else:
+            # Stream the trie so that it is never fully loaded
+            tree_stream = select_trie_trees(
+                stream_trie_trees(trie), max_objective, top_k
+            )
+            tree_num = None
+
+        if top_k is not None:
+            # The best trees are known only after reading the whole trie, so
+            # keep them packed until they are evaluated
+            tree_arrays = compile_tree_arrays(tree_stream)
+            tree_stream = iter_tree_arrays(tree_arrays)
+            tree_num = tree_arrays["count"]
+
+    rule_builder = _make_rule_node("root")
+    tree_entries = {}
+    canonical_map = {} if dedup_trees else None
+
+    tree_items = _iter_tree_items(
+        tree_stream, rule_builder, tree_entries, canonical_map
+    )
+
+    # Count samples and accuracies of trees in place. Trees are decoded and
+    # their rules are built as they are evaluated, so it is one stage.
+    with _track_stage(stats, "evaluate_trees", callback):
+        if chunked:
+            stats["sampleNum"] = _evaluate_trees_chunked(
+                tree_items, data_chunks, pack_bits, rule_cache, quiet, callback
+            )
+        else:
+            if approximate:
+                if sample_size is None:
+                    sample_size = get_approximate_sample_size(max_error, confidence)
+                sample_rows, strata = sample_rows_stratified(
+                    y_all, sample_size, random_state
+                )
+                x_eval, y_eval = x_all[sample_rows], y_all[sample_rows]
+            else:
+                x_eval, y_eval = x_all, y_all
+
+            stats["sampleNum"] = len(y_eval)
+            _evaluate_trees(
+                tree_items,
+                x_eval,
+                y_eval,
+                pack_bits,
+                rule_cache,
+                n_jobs,
+                tree_num=tree_num,
+                quiet=quiet,
+                callback=callback,
+                group_ids=group_ids,
+                split_spec=split_spec,
+            )
+
+    with _track_stage(stats, "build_output", callback):
+        # Parallel workers can finish out of order, so keep the trie order
+        decision_rule_hierarchy = rule_builder[0]
+        new_tree_map = {tid: tree_entries[tid] for tid in sorted(tree_entries)}
+
+        # Scale the counts on the sampled rows to the whole data
+        if approximate:
+            z = NormalDist().inv_cdf(0.5 + confidence / 2)
+            intervals = {}
+            for tid, tree_entry in new_tree_map.items():
+                if not isinstance(tree_entry[0], int):
+                    tree_entry[2], intervals[tid] = _scale_sampled_tree(
+                        tree_entry[0], strata, z
+                    )
+
+        # Identical trees share the accuracies of their representative
+        for tree_entry in new_tree_map.values():
+            if isinstance(tree_entry[0], int):
+                tree_entry.extend(new_tree_map[tree_entry[0]][2:])
+
+        # Get the feature encodings
+        feature_map = get_feature_map(feature_names, feature_description)
+
+        decision_rule_hierarchy_dict = {}
+        decision_rule_hierarchy_dict["trie"] = decision_rule_hierarchy
+        decision_rule_hierarchy_dict["featureMap"] = feature_map
+        decision_rule_hierarchy_dict["treeMap"] = new_tree_map
+
+        if split_spec is not None:
+            decision_rule_hierarchy_dict["splits"] = split_spec["names"]
+
+        if filter_index:
+            decision_rule_hierarchy_dict["filterIndex"] = get_filter_index(
+                decision_rule_hierarchy_dict
+            )
+
+        if approximate:
+            tree_ids = list(new_tree_map)
+            approximation = {
+                "sampleNum": len(sample_rows),
+                "dataNum": len(y_all),
+                "confidence": confidence,
+                "treeIDs": tree_ids,
+                "intervals": [
+                    intervals.get(tid) or intervals[new_tree_map[tid][0]]
+                    for tid in tree_ids
+                ],
+                # Sampling all rows gives exact values
+                "exact": [len(sample_rows) == len(y_all)] * len(tree_ids),
+            }
+            _summarize_approximation(approximation)
+            decision_rule_hierarchy_dict["approximation"] = approximation
+
+    if cache_key is not None:
+        with _track_stage(stats, "save_cache", callback):
+            _save_cached_decision_paths(
+                cache_dir, cache_key, decision_rule_hierarchy_dict, cache_size_limit
+            )
+
+    return finish(decision_rule_hierarchy_dict)
+
+
+def transform_tries_to_rules(
+    tries,
+    data_df,
+    feature_names=None,
+    feature_description=None,
+    pack_bits=False,
+    rule_cache=None,
+    n_jobs=1,
+    dedup_trees=False,
+    max_objective=None,
+    top_k=None,
+    filter_index=False,
+    quiet=False,
+    callback=None,
+    return_stats=False,
+):
+    """Transform a batch of Rashomon tries that share one dataset, e.g.,
+    Rashomon sets over a grid of multipliers and regularizations. Tighter sets
+    are subsets of looser ones, so a tree in several tries is evaluated only
+    once, and all distinct trees are evaluated together (in parallel with
+    `n_jobs`). It gives the same decision paths as calling
+    transform_trie_to_rules() on each trie.
+
+    Args:
+        tries (dict | list): {name: trie} or a list of tries. Each trie can be
+            a loaded dict, or a path or file object of the json file.
+        data_df (pd.DataFrame | np.array | scipy.sparse matrix): Dataset to
+            compute tree accuracies, where the last column is the label. Sparse
+            data is evaluated as in transform_trie_to_rules().
+        feature_names ([str]): See transform_trie_to_rules()
+        feature_description (dict): See transform_trie_to_rules()
+        pack_bits (bool): See transform_trie_to_rules()
+        rule_cache (dict): See transform_trie_to_rules()
+        n_jobs (int): # of processes to evaluate the distinct trees in
+            parallel. -1 means using all CPUs. Defaults to 1.
+        dedup_trees (bool): See transform_trie_to_rules(). Identical trees
+            are only merged within each trie.
+        max_objective (float): Applies to every trie, see
+            transform_trie_to_rules()
+        top_k (int): Applies to every trie, see transform_trie_to_rules()
+        filter_index (bool): See transform_trie_to_rules()
+        quiet (bool): Whether to hide the progress bar. Defaults to False.
+        callback (function): See transform_trie_to_rules()
+        return_stats (bool): Whether to also return the stats of this call:
+            {'time', 'stages': {stage: {'time', 'peakMemory'}}, 'treeNum',
+            'uniqueTreeNum'}, where 'treeNum' is the total # trees in all
+            tries, and 'uniqueTreeNum' is the # distinct trees that were
+            evaluated. Defaults to False.
+
+    Returns:
+        dict | list: Decision paths of each trie, keyed in the same way as
+            `tries`, or a tuple (decision paths, stats) if `return_stats` is
+            True. A tree in several tries is evaluated once, and each tree
+            map gets its own copy of its hierarchy tree, so changing one
+            output in place leaves the others as they are.
+    """
+
+    stats = {"stages": {}}
+    start_time = time.perf_counter()
+
+    if isinstance(tries, dict):
+        names, trie_list = list(tries), list(tries.values())
+    else:
+        names, trie_list = None, list(tries)
+
+    sparse = _is_sparse_data(data_df)
+    if not (sparse or isinstance(data_df, np.ndarray) or hasattr(data_df, "iloc")):
+        raise ValueError("Error: batch transform needs in-memory data.")
+
+    if sparse and (pack_bits or rule_cache is not None):
+        raise ValueError(
+            "Error: sparse data is not supported with pack_bits or rule_cache."
+        )
+
+    with _track_stage(stats, "load_data", callback):
+        if sparse:
+            x_all, y_all, columns = _get_sparse_data(data_df)
+        else:
+            columns = None
+            if hasattr(data_df, "columns"):
+                columns = data_df.columns.tolist()
+
+            data = data_df.to_numpy() if hasattr(data_df, "to_numpy") else data_df
+            x_all, y_all = data[:, :-1], data[:, -1]
+
+    feature_names, feature_description = _get_feature_info(
+        feature_names, feature_description, columns
+    )
+
+    pack_bits = pack_bits or rule_cache is not None
+
+    if n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+
+    # Pack the trees of all tries with one string table, so that a tree has
+    # the same tokens in every trie
+    with _track_stage(stats, "select_trees", callback):
+        string_ids = {}
+        all_tree_arrays = []
+        for trie in trie_list:
+            if isinstance(trie, dict):
+                tree_stream = iter_trie_trees(trie)
+            else:
+                tree_stream = stream_trie_trees(trie)
+
+            all_tree_arrays.append(
+                compile_tree_arrays(
+                    select_trie_trees(tree_stream, max_objective, top_k), string_ids
+                )
+            )
+
+        # Map each tree of each trie to its distinct tree
+        strings = list(string_ids)
+        unique_map = {}
+        unique_strings = []
+        all_unique_ids = []
+
+        for tree_arrays in all_tree_arrays:
+            offsets = tree_arrays["offsets"].tolist()
+            tokens = tree_arrays["tokens"]
+            unique_ids = []
+
+            for i in range(tree_arrays["count"]):
+                tree_tokens = tokens[offsets[i] : offsets[i + 1]]
+                tree_key = tree_tokens.tobytes()
+
+                uid = unique_map.get(tree_key)
+                if uid is None:
+                    uid = len(unique_strings)
+                    unique_map[tree_key] = uid
+                    unique_strings.append([strings[t] for t in tree_tokens.tolist()])
+
+                unique_ids.append(uid)
+
+            all_unique_ids.append(unique_ids)
+
+    stats["treeNum"] = sum(tree_arrays["count"] for tree_arrays in all_tree_arrays)
+    stats["uniqueTreeNum"] = len(unique_strings)
+
+    # Evaluate each distinct tree once. Its entry is [hierarchy tree, None,
+    # accuracy], and tries fill in their own objectives.
+    unique_entries = []
+    unique_tables = []
+
+    def iter_unique_items():
+        for uid, tree_strings in enumerate(unique_strings):
+            tree_table = decode_tree(tree_strings)
+            nodes = _get_table_hierarchy_tree(tree_table)
+            tree_entry = [nodes[0], None]
+            unique_entries.append(tree_entry)
+            unique_tables.append(tree_table)
+            yield uid, tree_strings, tree_entry, (nodes, tree_table)
+
+    with _track_stage(stats, "evaluate_trees", callback):
+        _evaluate_trees(
+            iter_unique_items(),
+            x_all,
+            y_all,
+            pack_bits,
+            rule_cache,
+            n_jobs,
+            tree_num=len(unique_strings),
+            quiet=quiet,
+            callback=callback,
+        )
+
+    with _track_stage(stats, "build_output", callback):
+        unique_rules = {}
+        canonical_keys = {}
+        all_decision_paths = []
+
+        # The first trie takes the evaluated tree, and later tries get copies,
+        # so that changing one output in place does not change the others
+        used_uids = set()
+
+        for tree_arrays, unique_ids in zip(all_tree_arrays, all_unique_ids):
+            rule_builder = _make_rule_node("root")
+            new_tree_map = {}
+            canonical_map = {}
+
+            for tid, objective, uid in zip(
+                tree_arrays["ids"].tolist(),
+                tree_arrays["objectives"].tolist(),
+                unique_ids,
+            ):
+                if uid not in unique_rules:
+                    unique_rules[uid] = _get_table_decision_rules(unique_tables[uid])
+                _add_decision_rules(
+                    rule_builder, unique_rules[uid], tid, keep_position=False
+                )
+
+                if dedup_trees:
+                    if uid not in canonical_keys:
+                        canonical_keys[uid] = get_canonical_tree_key(unique_tables[uid])
+
+                    rep_tid = canonical_map.setdefault(canonical_keys[uid], tid)
+                    if rep_tid != tid:
+                        new_tree_map[tid] = [rep_tid, round(objective, 5)]
+                        continue
+
+                tree_entry = unique_entries[uid]
+                tree = tree_entry[0]
+                if uid in used_uids:
+                    tree = _copy_hierarchy_tree(tree)
+                used_uids.add(uid)
+
+                new_tree_map[tid] = [tree, round(objective, 5)]
+                new_tree_map[tid].extend(tree_entry[2:])
+
+            # Identical trees share the accuracies of their representative
+            for tree_entry in new_tree_map.values():
+                if isinstance(tree_entry[0], int):
+                    tree_entry.extend(new_tree_map[tree_entry[0]][2:])
+
+            decision_paths = {
+                "trie": rule_builder[0],
+                "featureMap": get_feature_map(feature_names, feature_description),
+                "treeMap": new_tree_map,
+            }
+
+            if filter_index:
+                decision_paths["filterIndex"] = get_filter_index(decision_paths)
+
+            all_decision_paths.append(decision_paths)
+
+    if names is not None:
+        all_decision_paths = dict(zip(names, all_decision_paths))
+
+    stats["time"] = time.perf_counter() - start_time
+
+    if callback is not None:
+        callback({"type": "end", "stats": stats})
+
+    if return_stats:
+        return all_decision_paths, stats
+    return all_decision_paths
+
+
+def transform_trie_to_rules_async(trie, data_df, **kwargs):
+    """Run transform_trie_to_rules() in a background thread, so that the
+    notebook kernel stays responsive while a large Rashomon set converts.
+
+    Args:
+        trie (dict | str | file): Rashomon trie json, see
+            transform_trie_to_rules()
+        data_df (pd.DataFrame | np.array | str | iter): Dataset, see
+            transform_trie_to_rules()
+        **kwargs: Other arguments of transform_trie_to_rules(). The progress
+            bar is hidden unless `quiet` is False.
+
+    Returns:
+        concurrent.futures.Future: Future of the decision paths. Its
+            `progress` attribute {'stage', 'done', 'total'} is updated as
+            trees are evaluated. Call cancel() to stop the conversion at the
+            next progress event. Use `await asyncio.wrap_future(future)` to
+            wait for it in asyncio code (e.g., a Jupyter cell), or pass it to
+            visualize() to render the widget once it is done.
+    """
+
+    future = Future()
+    future.progress = {"stage": None, "done": 0, "total": None}
+
+    user_callback = kwargs.pop("callback", None)
+    kwargs.setdefault("quiet", True)
+
+    def callback(event):
+        # Events are the checkpoints to stop a cancelled conversion
+        if future.cancelled():
+            raise CancelledError()
+
+        if event["type"] == "progress":
+            future.progress = {
+                "stage": event["stage"],
+                "done": event["done"],
+                "total": event["total"],
+            }
+
+        if user_callback is not None:
+            user_callback(event)
+
+    def run():
+        try:
+            result = transform_trie_to_rules(trie, data_df, callback=callback, **kwargs)
+            future.set_result(result)
+        except CancelledError:
+            pass
+        except InvalidStateError:
+            # The future is cancelled after the last checkpoint
+            pass
+        except BaseException as error:
+            if not future.cancelled():
+                future.set_exception(error)
+
+    thread = threading.Thread(target=run, name="timbertrek-transform", daemon=True)
+    thread.start()
+
+    return future
+
+
+# Layout of the compact decision paths: magic, version, and header size
+_COMPACT_MAGIC = b"TTRK"
+_COMPACT_VERSION = 1
+_COMPACT_DTYPES = {
+    "int32": "<i4",
+    "uint32": "<u4",
+    "uint8": "u1",
+    "float64": "<f8",
+}
+
+# Optional entries of the decision paths that are kept in the json header
+_COMPACT_EXTRA_KEYS = ("filterIndex", "approximation", "splits")
+
+
+def encode_compact_decision_paths(decision_paths):
+    """Encode decision paths into a gzip-compressed binary payload for the
+    notebook widget. Rule trie and hierarchy tree nodes are stored in preorder
+    as typed arrays, and all node names are interned into one string table.
+
+    The payload starts with b'TTRK', the format version and the json header
+    size (uint32 each), followed by the json header and 8-byte aligned little
+    endian arrays. The header has the string table, the feature map, the
+    [dtype, byte offset, length] of each array, and the optional filter index,
+    approximation, and split name entries. Split counts and accuracies are
+    stored as arrays of # splits values per node and per tree.
+
+    Args:
+        decision_paths (dict): Decision paths generated by
+            transform_trie_to_rules()
+
+    Returns:
+        bytes: Gzip-compressed payload
+    """
+
+    strings = []
+    string_ids = {}
+
+    def _intern(string):
+        if string not in string_ids:
+            string_ids[string] = len(strings)
+            strings.append(string)
+        return string_ids[string]
+
+    arrays = {
+        "ruleString": [],
+        "ruleChildNum": [],
+        "ruleTree": [],
+        "treeID": [],
+        "treeObjective": [],
+        "treeAccuracy": [],
+        "treeRepresentative": [],
+        "treeNodeOffset": [0],
+        "nodeString": [],
+        "nodeSampleNum": [],
+        "nodeCorrectNum": [],
+        "nodeChildNum": [],
+    }
+
+    # Split accuracies of each tree and split counts of each node, if any
+    split_num = len(decision_paths.get("splits", []))
+    if split_num > 0:
+        arrays["treeSplitAccuracy"] = []
+        arrays["nodeSplitCounts"] = []
+
+    # Rule trie in preorder
+    working_stack = [decision_paths["trie"]]
+    while len(working_stack) > 0:
+        node = working_stack.pop()
+        children = node.get("c", [])
+        arrays["ruleString"].append(_intern(node["f"]))
+        arrays["ruleChildNum"].append(len(children))
+        arrays["ruleTree"].append(node.get("t", -1))
+        working_stack.extend(reversed(children))
+
+    for tid, tree_entry in decision_paths["treeMap"].items():
+        arrays["treeID"].append(int(tid))
+        arrays["treeObjective"].append(tree_entry[1])
+        arrays["treeAccuracy"].append(tree_entry[2])
+
+        if split_num > 0:
+            arrays["treeSplitAccuracy"].extend(
+                np.nan if acc is None else acc for acc in tree_entry[3]
+            )
+
+        # An identical tree stores its representative's id without nodes
+        if isinstance(tree_entry[0], int):
+            arrays["treeRepresentative"].append(tree_entry[0])
+            arrays["treeNodeOffset"].append(len(arrays["nodeString"]))
+            continue
+
+        arrays["treeRepresentative"].append(-1)
+
+        working_stack = [tree_entry[0]]
+        while len(working_stack) > 0:
+            node = working_stack.pop()
+            children = node.get("c", [])
+
+            # Nodes without sample counts are marked by -1
+            f = list(node["f"]) + [-1] * (3 - len(node["f"]))
+            arrays["nodeString"].append(_intern(f[0]))
+            arrays["nodeSampleNum"].append(f[1])
+            arrays["nodeCorrectNum"].append(f[2])
+            arrays["nodeChildNum"].append(len(children))
+            working_stack.extend(reversed(children))
+
+            if split_num > 0:
+                if "s" in node:
+                    arrays["nodeSplitCounts"].extend(v for c in node["s"] for v in c)
+                else:
+                    arrays["nodeSplitCounts"].extend([-1] * (2 * split_num))
+
+        arrays["treeNodeOffset"].append(len(arrays["nodeString"]))
+
+    dtypes = {
+        "ruleChildNum": "uint32",
+        "treeObjective": "float64",
+        "treeAccuracy": "float64",
+        "treeSplitAccuracy": "float64",
+        "treeNodeOffset": "uint32",
+        "nodeChildNum": "uint8",
+    }
+
+    array_specs = {}
+    array_bytes = []
+    offset = 0
+
+    for name, values in arrays.items():
+        dtype = dtypes.get(name, "int32")
+        cur_bytes = np.asarray(values, dtype=_COMPACT_DTYPES[dtype]).tobytes()
+        array_specs[name] = [dtype, offset, len(values)]
+        padding = -len(cur_bytes) % 8
+        array_bytes.append(cur_bytes + b"\0" * padding)
+        offset += len(cur_bytes) + padding
+
+    header = {
+        "strings": strings,
+        "featureMap": [[k, v] for k, v in decision_paths["featureMap"].items()],
+        "arrays": array_specs,
+    }
+
+    for key in _COMPACT_EXTRA_KEYS:
+        if key in decision_paths:
+            header[key] = decision_paths[key]
+    header_bytes = dumps(header, separators=(",", ":")).encode("utf-8")
+
+    # Align the arrays to 8 bytes from the start of the payload
+    header_bytes += b" " * (-(len(header_bytes) + 12) % 8)
+
+    payload = b"".join(
+        [
+            _COMPACT_MAGIC,
+            struct.pack("<II", _COMPACT_VERSION, len(header_bytes)),
+            header_bytes,
+        ]
+        + array_bytes
+    )
+
+    return gzip.compress(payload, compresslevel=6, mtime=0)
+
+
+def decode_compact_decision_paths(compact_data):
+    """Decode a payload generated by encode_compact_decision_paths() back into
+    decision paths.
+
+    Args:
+        compact_data (bytes): Gzip-compressed payload
+
+    Returns:
+        dict: Decision paths with `trie`, `featureMap`, and `treeMap` keys
+    """
+
+    payload = gzip.decompress(compact_data)
+
+    if payload[:4] != _COMPACT_MAGIC:
+        raise ValueError("Error: the payload is not compact decision paths.")
+
+    version, header_size = struct.unpack("<II", payload[4:12])
+    if version != _COMPACT_VERSION:
+        raise ValueError(f"Error: unsupported compact payload version {version}.")
+
+    header = loads(payload[12 : 12 + header_size].decode("utf-8"))
+    strings = header["strings"]
+    split_num = len(header.get("splits", []))
+    arrays = {}
+
+    for name, (dtype, offset, length) in header["arrays"].items():
+        arrays[name] = np.frombuffer(
+            payload,
+            dtype=_COMPACT_DTYPES[dtype],
+            count=length,
+            offset=12 + header_size + offset,
+        ).tolist()
+
+    def _build_preorder(start, end, make_node):
+        # Rebuild a preorder tree; each stack item is [node, # children left]
+        root = None
+        working_stack = []
+
+        for i in range(start, end):
+            node, child_num = make_node(i)
+
+            if root is None:
+                root = node
+            else:
+                parent = working_stack[-1]
+                parent[0]["c"].append(node)
+                parent[1] -= 1
+                if parent[1] == 0:
+                    working_stack.pop()
+
+            if child_num > 0:
+                node.setdefault("c", [])
+                working_stack.append([node, child_num])
+
+        return root
+
+    def _make_rule_node(i):
+        node = {"f": strings[arrays["ruleString"][i]]}
+        if arrays["ruleTree"][i] >= 0:
+            node["t"] = arrays["ruleTree"][i]
+        else:
+            node["c"] = []
+        return node, arrays["ruleChildNum"][i]
+
+    def _make_tree_node(i):
+        f = [
+            strings[arrays["nodeString"][i]],
+            arrays["nodeSampleNum"][i],
+            arrays["nodeCorrectNum"][i],
+        ]
+        if f[1] < 0:
+            f = f[:1]
+        node = {"f": f}
+
+        if split_num > 0:
+            counts = arrays["nodeSplitCounts"][
+                i * 2 * split_num : (i + 1) * 2 * split_num
+            ]
+            if counts[0] >= 0:
+                node["s"] = [counts[j : j + 2] for j in range(0, len(counts), 2)]
+
+        return node, arrays["nodeChildNum"][i]
+
+    trie = _build_preorder(0, len(arrays["ruleString"]), _make_rule_node)
+
+    tree_map = {}
+    offsets = arrays["treeNodeOffset"]
+
+    for i, tid in enumerate(arrays["treeID"]):
+        if arrays["treeRepresentative"][i] >= 0:
+            tree = arrays["treeRepresentative"][i]
+        else:
+            tree = _build_preorder(offsets[i], offsets[i + 1], _make_tree_node)
+
+        tree_map[tid] = [
+            tree,
+            arrays["treeObjective"][i],
+            arrays["treeAccuracy"][i],
+        ]
+
+        if split_num > 0:
+            split_accs = arrays["treeSplitAccuracy"][
+                i * split_num : (i + 1) * split_num
+            ]
+            tree_map[tid].append([None if np.isnan(a) else a for a in split_accs])
+
+    decision_paths = {}
+    decision_paths["trie"] = trie
+    decision_paths["featureMap"] = {k: v for k, v in header["featureMap"]}
+    decision_paths["treeMap"] = tree_map
+
+    for key in _COMPACT_EXTRA_KEYS:
+        if key in header:
+            decision_paths[key] = header[key]
+
+    return decision_paths
+
+
+def _count_rule_leaves(node):
+    """Count the decision rules and unique trees below a rule trie node.
+
+    Args:
+        node (dict): A node in the decision rule hierarchy
+
+    Returns:
+        tuple: (# rule leaves, set of tree ids)
+    """
+
+    leaf_num = 0
+    tree_ids = set()
+    working_stack = [node]
+
+    while len(working_stack) > 0:
+        cur_node = working_stack.pop()
+        if cur_node["f"] == "_":
+            leaf_num += 1
+            tree_ids.add(cur_node["t"])
+        else:
+            working_stack.extend(cur_node["c"])
+
+    return leaf_num, tree_ids
+
+
+def _get_rule_node_counts(node):
+    """Count the decision rules and unique trees below every non-leaf node of
+    a rule trie in one pass, so that truncated subtries do not need to walk
+    their subtrees again.
+
+    Args:
+        node (dict): Root node of the rule trie (or a subtrie)
+
+    Returns:
+        dict: {id(node): (# rule leaves, # unique trees)} for non-leaf nodes
+    """
+
+    node_counts = {}
+    # Rule leaf # and tree ids of non-leaf nodes whose parents are not done
+    child_results = {}
+    working_stack = [(node, False)]
+
+    while len(working_stack) > 0:
+        cur_node, children_done = working_stack.pop()
+        if cur_node["f"] == "_":
+            continue
+
+        if not children_done:
+            working_stack.append((cur_node, True))
+            working_stack.extend((c, False) for c in cur_node["c"])
+            continue
+
+        leaf_num = 0
+        tree_ids = set()
+        for c in cur_node["c"]:
+            if c["f"] == "_":
+                leaf_num += 1
+                tree_ids.add(c["t"])
+                continue
+
+            c_leaf_num, c_tree_ids = child_results.pop(id(c))
+            leaf_num += c_leaf_num
+
+            # Merge the smaller set into the larger one
+            if len(c_tree_ids) > len(tree_ids):
+                tree_ids, c_tree_ids = c_tree_ids, tree_ids
+            tree_ids.update(c_tree_ids)
+
+        node_counts[id(cur_node)] = (leaf_num, len(tree_ids))
+        child_results[id(cur_node)] = (leaf_num, tree_ids)
+
+    return node_counts
+
+
+def get_rule_subtrie(trie, node_path=(), depth=None, node_counts=None):
+    """Get a subtrie of the decision rule hierarchy for lazy loading.
+
+    Args:
+        trie (dict): Decision rule hierarchy (`trie` of the decision paths)
+        node_path (iter, optional): Child indexes from the root to the subtrie
+            root. Defaults to () (the whole trie).
+        depth (int, optional): # of levels to include below the subtrie root.
+            Nodes at the last level keep no children, and get 'v': # rules
+            and 'n': # unique trees below them. Other non-leaf nodes only get
+            'n'. Defaults to None (include all levels without counts).
+        node_counts (dict, optional): Counts of the trie's nodes from
+            _get_rule_node_counts(), to reuse across requests. Defaults to
+            None (count the nodes below the subtrie root).
+
+    Returns:
+        dict: The subtrie
+    """
+
+    root = trie
+    for i in node_path:
+        if root["f"] == "_" or not 0 <= i < len(root["c"]):
+            raise ValueError(f"Error: no rule node at path {list(node_path)}.")
+        root = root["c"][i]
+
+    if depth is None:
+        return root
+
+    if node_counts is None:
+        node_counts = _get_rule_node_counts(root)
+
+    def _copy_node(node, cur_depth):
+        if node["f"] == "_":
+            return dict(node)
+
+        leaf_num, tree_num = node_counts[id(node)]
+        if cur_depth == depth:
+            return {"f": node["f"], "c": [], "v": leaf_num, "n": tree_num}
+
+        new_node = {"f": node["f"], "c": [], "n": tree_num}
+        working_stack.append((node, new_node, cur_depth))
+        return new_node
+
+    working_stack = []
+    new_root = _copy_node(root, 0)
+
+    while len(working_stack) > 0:
+        node, new_node, cur_depth = working_stack.pop()
+        for c in node["c"]:
+            new_node["c"].append(_copy_node(c, cur_depth + 1))
+
+    return new_root
+
+
+class _DecisionPathsHandler(BaseHTTPRequestHandler):
+    """Answer the widget's data requests with parts of the decision paths.
+    Every path starts with the server's random token (/<token>/meta), so
+    other pages in the browser cannot read the data.
+
+    /meta: {'featureMap', 'treeNum'}, and 'filterIndex' if it is available
+    /trie?path=0,2&depth=2: get_rule_subtrie() of the rule trie. The node
+        counts of truncated subtries are computed once per server.
+    /trees?ids=1,5: {tree id: tree map entry}. Representatives of deduplicated
+        trees are included. All trees are returned if `ids` is not given.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        decision_paths = self.server.decision_paths
+
+        token, _, endpoint = url.path[1:].partition("/")
+        if not secrets.compare_digest(token, self.server.token):
+            self._send_json({"error": "Invalid token"}, 403)
+            return
+
+        endpoint = "/" + endpoint
+
+        try:
+            if endpoint == "/meta":
+                response = {
+                    "featureMap": decision_paths["featureMap"],
+                    "treeNum": len(decision_paths["treeMap"]),
+                }
+                if "filterIndex" in decision_paths:
+                    response["filterIndex"] = decision_paths["filterIndex"]
+
+            elif endpoint == "/trie":
+                node_path = _parse_int_list(params.get("path", [""])[0])
+                depth = params.get("depth", [None])[0]
+                depth = None if depth is None else int(depth)
+                node_counts = None
+                if depth is not None:
+                    node_counts = _get_server_node_counts(self.server)
+                response = get_rule_subtrie(
+                    decision_paths["trie"], node_path, depth, node_counts
+                )
+
+            elif endpoint == "/trees":
+                tree_map = decision_paths["treeMap"]
+                if "ids" in params:
+                    tree_ids = _parse_int_list(params["ids"][0])
+                else:
+                    tree_ids = list(tree_map)
+
+                response = {}
+                for tid in tree_ids:
+                    if tid not in tree_map:
+                        raise ValueError(f"Error: no tree with id {tid}.")
+                    response[tid] = tree_map[tid]
+                    if isinstance(tree_map[tid][0], int):
+                        response[tree_map[tid][0]] = tree_map[tree_map[tid][0]]
+
+            else:
+                self._send_json({"error": f"Unknown path {endpoint}"}, 404)
+                return
+
+        except ValueError as e:
+            self._send_json({"error": str(e)}, 400)
+            return
+
+        self._send_json(response)
+
+    def _send_json(self, response, status=200):
+        body = dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        # The widget's iframe has the notebook's origin, and the token in the
+        # url keeps other origins out
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Do not print every request in the notebook
+        return
+
+
+def _parse_int_list(text):
+    """Parse a comma-separated list of integers from a query parameter."""
+    try:
+        return [int(item) for item in text.split(",") if item != ""]
+    except ValueError:
+        raise ValueError(f"Error: '{text}' is not a list of integers.")
+
+
+# Data servers of the widgets from visualize(..., serve=True), keyed by the
+# widgets' iframe ids
+_data_servers = {}
+
+
+def serve_decision_paths(decision_paths, host="127.0.0.1", port=0):
+    """Start a local HTTP server in a background thread that sends parts of
+    the decision paths to the widget on request, so that the widget does not
+    need to wait for the whole Rashomon set before drawing.
+
+    Args:
+        decision_paths (dict): Decision paths generated by
+            transform_trie_to_rules()
+        host (str, optional): Host to listen on. Defaults to '127.0.0.1'.
+        port (int, optional): Port to listen on. Defaults to 0 (any free port).
+
+    Returns:
+        ThreadingHTTPServer: The running server. Its `url` attribute is the
+            base url of the data endpoints, which includes a random token that
+            every request needs. server.shutdown() stops it.
+    """
+
+    server = ThreadingHTTPServer((host, port), _DecisionPathsHandler)
+    server.daemon_threads = True
+    server.decision_paths = decision_paths
+    server.token = secrets.token_urlsafe(16)
+    server.url = f"http://{host}:{server.server_address[1]}/{server.token}"
+
+    # Rule node counts for truncated subtries, computed on the first request
+    server.node_counts = None
+    server.node_counts_lock = threading.Lock()
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+
+def _get_server_node_counts(server):
+    """Get the rule node counts of a data server's trie, and count them once
+    on the first request.
+
+    Args:
+        server (ThreadingHTTPServer): Server from serve_decision_paths()
+
+    Returns:
+        dict: Counts from _get_rule_node_counts()
+    """
+
+    with server.node_counts_lock:
+        if server.node_counts is None:
+            server.node_counts = _get_rule_node_counts(server.decision_paths["trie"])
+        return server.node_counts
+
+
+def stop_data_servers():
+    """Shut down the data servers of the widgets rendered with
+    visualize(..., serve=True). These widgets can no longer load data.
+    """
+
+    while len(_data_servers) > 0:
+        _, server = _data_servers.popitem()
+        server.shutdown()
+        server.server_close()
+
+
+# The base64 JS bundle, and whether it is injected into the notebook page
+_js_bundle = {"base64": None, "injected": False}
+
+
+def _get_js_bundle_base64():
+    """Read the bundled JS file and encode it with base64. The result is
+    cached, so the bundle is only read and encoded once.
+
+    Returns:
+        str: Base64 string of the JS bundle
+    """
+
+    if _js_bundle["base64"] is None:
+        js_b = pkgutil.get_data(__name__, "timbertrek.js")
+
+        # Read local JS file (for development only)
+        # with open("./timbertrek.js", "r") as fp:
+        #     js_string = fp.read()
+        # js_b = bytes(js_string, encoding="utf-8")
+
+        _js_bundle["base64"] = base64.b64encode(js_b).decode("utf-8")
+
+    return _js_bundle["base64"]
+
+
+def inject_js_bundle(force=False):
+    """Add the JS bundle to the notebook page once, so that widgets rendered
+    by visualize(..., shared_bundle=True) load it from the page instead of
+    embedding their own copy. The bundle is kept as a blob URL on the page's
+    window.
+
+    Args:
+        force (bool): Inject the bundle even if it has been injected in this
+            kernel session, e.g., after reloading the notebook page. Defaults
+            to False.
+    """
+
+    if _js_bundle["injected"] and not force:
+        return
+
+    injector_js = f"""
+        <script>
+        (function() {{
+            if (window.timbertrekBundleURL !== undefined) return;
+            const binary = atob('{_get_js_bundle_base64()}');
+            const bytes = Uint8Array.from(binary, c => c.charCodeAt(0));
+            const blob = new Blob([bytes], {{ type: 'text/javascript' }});
+            window.timbertrekBundleURL = URL.createObjectURL(blob);
+        }}())
+        </script>
+    """
+
+    display_html(injector_js, raw=True)
+    _js_bundle["injected"] = True
+
+
+def _make_html(
+    decision_paths,
+    width,
+    compact=False,
+    shared_bundle=False,
+    server_url=None,
+    initial_depth=2,
+):
+    """
+    Function to create an HTML string to bundle TimberTrek's html, css, and js.
+    We use base64 to encode the js so that we can use inline defer for <script>
+
+    We add another script to pass Python data as inline json, and dispatch an
+    event to transfer the data
+
+    Args:
+        decision_paths(dict): Decision paths in a hierarchical dict
+        width(int): Width of the main visualization window
+        compact(bool): Pass the data as a compact gzip payload in base64
+            instead of inline json
+        shared_bundle(bool): Load the JS bundle injected by
+            inject_js_bundle() from the parent page instead of inlining it
+        server_url(str): Base url of a data server started by
+            serve_decision_paths(). If it is given, no data is inlined, and
+            the widget loads the data from the server.
+        initial_depth(int): # of rule trie levels to load from the data
+            server before the first paint
+
+    Return:
         HTML code with deferred JS code in base64 format
     """
     # HTML template for TimberTrek widget
     html_top = """<!DOCTYPE html><html lang="en"><head><meta charset="UTF-8" /><meta name="viewport" content="width=device-width, initial-scale=1.0" /><title>TimberTrek</title><style>html{font-size:16px;-moz-osx-font-smoothing:grayscale;-webkit-font-smoothing:antialiased;text-rendering:optimizeLegibility;-webkit-text-size-adjust:100%;-moz-text-size-adjust:100%}html,body{position:relative;width:100%;height:100%}body{margin:0;padding:0;box-sizing:border-box;font-family:-apple-system,BlinkMacSystemFont,Segoe UI,Roboto,Oxygen-Sans,Ubuntu,Cantarell,Helvetica Neue,sans-serif;color:#4a4a4a;font-size:1em;font-weight:400;line-height:1.5}*,:after,:before{box-sizing:inherit}a{color:#0064c8;text-decoration:none}a:hover{text-decoration:underline}a:visited{color:#0050a0}label{display:block}input,button,select,textarea{font-family:inherit;font-size:inherit;-webkit-padding:.4em 0;padding:.4em;margin:0 0 .5em;box-sizing:border-box;border:1px solid #ccc;border-radius:2px}input:disabled{color:#ccc}button{color:#333;background-color:#f4f4f4;outline:none}button:disabled{color:#999}button:not(:disabled):active{background-color:#ddd}button:focus{border-color:#666}</style>"""
     html_bottom = """</head><body></body></html>"""
 
-    # Read the bundled JS file
-    js_b = pkgutil.get_data(__name__, "timbertrek.js")
-
-    # Read local JS file (for development only)
-    # with open("./timbertrek.js", "r") as fp:
-    #     js_string = fp.read()
-    # js_b = bytes(js_string, encoding="utf-8")
-
-    # Encode the JS & CSS with base 64
-    js_base64 = base64.b64encode(js_b).decode("utf-8")
-
     # Convert json dict to string
-    data_json = dumps(decision_paths)
+    if server_url is not None:
+        data_json = "null"
+        compact_json = "null"
+    elif compact:
+        compact_data = encode_compact_decision_paths(decision_paths)
+        data_json = "null"
+        compact_json = dumps(base64.b64encode(compact_data).decode("utf-8"))
+    else:
+        data_json = dumps(decision_paths)
+        compact_json = "null"
 
     # Pass data into JS by using another script to dispatch an event
     messenger_js = f"""
         (function() {{
             const event = new Event('timbertrekData');
             event.data = {data_json};
+            event.compactData = {compact_json};
+            event.serverURL = {dumps(server_url)};
+            event.initialDepth = {initial_depth};
             event.width = {width};
             document.dispatchEvent(event);
         }}())
     """
+    if shared_bundle:
+        # Run the bundle from the parent page, and send the data after it loads
+        messenger_js = f"""
+            (function() {{
+                const bundleURL = window.parent.timbertrekBundleURL;
+                if (bundleURL === undefined) {{
+                    document.body.textContent =
+                        'TimberTrek JS bundle is not found. Please run ' +
+                        'timbertrek.inject_js_bundle(force=True).';
+                    return;
+                }}
+                const script = document.createElement('script');
+                script.src = bundleURL;
+                script.onload = () => {{ {messenger_js} }};
+                document.head.appendChild(script);
+            }}())
+        """
+        js_base64_list = []
+    else:
+        # Use the cached base 64 JS bundle
+        js_base64_list = [_get_js_bundle_base64()]
+
     messenger_js = messenger_js.encode()
-    messenger_js_base64 = base64.b64encode(messenger_js).decode("utf-8")
+    js_base64_list.append(base64.b64encode(messenger_js).decode("utf-8"))
 
     # Inject the JS to the html template
-    html_str = (
-        html_top
-        + """<script defer src='data:text/javascript;base64,{}'></script>""".format(
-            js_base64
-        )
-        + """<script defer src='data:text/javascript;base64,{}'></script>""".format(
-            messenger_js_base64
+    html_str = html_top
+    for js_base64 in js_base64_list:
+        html_str += (
+            """<script defer src='data:text/javascript;base64,{}'></script>""".format(
+                js_base64
+            )
         )
-        + html_bottom
-    )
+    html_str += html_bottom
 
     return html.escape(html_str)
 
 
-def visualize(decision_paths, width=500, height=650):
-    """
-    Render TimberTrek in the output cell.
-
-    Args:
-        decision_paths(dict): Decision paths in a hierarchical dict
-        width(int): Width of the main visualization window
-        height(int): Height of the whole window
+def _make_iframe(
+    decision_paths,
+    width,
+    height,
+    compact,
+    shared_bundle,
+    serve,
+    initial_depth,
+    callback,
+):
+    """Create the iframe of a TimberTrek widget. See visualize() for the
+    arguments.
 
-    Return:
-        HTML code with deferred JS code in base64 format
+    Returns:
+        str: HTML code of the iframe
     """
 
     # Simple validations
@@ -746,11 +4477,22 @@ def visualize(decision_paths, width=500, height=650):
         "treeMap" in decision_paths
     ), "decision_paths` is not valid (no `treeMap` key)."
 
-    html_str = _make_html(decision_paths, width)
-
     # Randomly generate an ID for the iframe to avoid collision
     iframe_id = "timbertrek-iframe-" + str(int(random.random() * 1e8))
 
+    server_url = None
+    if serve:
+        # Each widget owns its server, so earlier widgets keep loading data
+        server = serve_decision_paths(decision_paths)
+        _data_servers[iframe_id] = server
+        server_url = server.url
+
+    with _track_stage({"stages": {}}, "make_html", callback) as record:
+        html_str = _make_html(
+            decision_paths, width, compact, shared_bundle, server_url, initial_depth
+        )
+        record["bytes"] = len(html_str.encode("utf-8"))
+
     iframe = f"""
         <iframe
             srcdoc="{html_str}"
@@ -761,5 +4503,146 @@ def visualize(decision_paths, width=500, height=650):
         </iframe>
     """
 
+    return iframe
+
+
+def _make_pending_html(future, height, message=None):
+    """Create the placeholder of a widget whose decision paths are pending.
+
+    Args:
+        future (Future): Pending result of transform_trie_to_rules_async()
+        height (int): Height of the placeholder
+        message (str, optional): Message to show instead of the progress
+
+    Returns:
+        str: HTML code of the placeholder
+    """
+
+    if message is None:
+        progress = future.progress
+        message = "Generating decision paths..."
+        if progress["done"] > 0:
+            total = "" if progress["total"] is None else f"/{progress['total']}"
+            message = f"Generating decision paths ({progress['done']}{total})..."
+
+    return f"""
+        <div style="height: {height}px; font-family: sans-serif; color: #666;">
+            {html.escape(message)}
+        </div>
+    """
+
+
+def _visualize_pending(future, height, make_iframe, interval=0.5):
+    """Show a placeholder with the progress of pending decision paths, and
+    replace it with the widget once they are ready.
+
+    Args:
+        future (Future): Pending result of transform_trie_to_rules_async()
+        height (int): Height of the placeholder
+        make_iframe (function): Function to create the widget iframe from the
+            decision paths
+        interval (float): Seconds between progress updates. Defaults to 0.5.
+    """
+
+    display_id = "timbertrek-pending-" + str(int(random.random() * 1e8))
+    display(
+        {"text/html": _make_pending_html(future, height)},
+        raw=True,
+        display_id=display_id,
+    )
+
+    def watch():
+        while not future.done():
+            wait([future], timeout=interval)
+            if not future.done():
+                update_display(
+                    {"text/html": _make_pending_html(future, height)},
+                    raw=True,
+                    display_id=display_id,
+                )
+
+        if future.cancelled():
+            content = _make_pending_html(future, height, "Conversion is cancelled.")
+        elif future.exception() is not None:
+            content = _make_pending_html(
+                future, height, f"Conversion failed: {future.exception()!r}"
+            )
+        else:
+            decision_paths = future.result()
+            if isinstance(decision_paths, tuple):
+                # The stats of return_stats=True are not rendered
+                decision_paths = decision_paths[0]
+            content = make_iframe(decision_paths)
+
+        update_display({"text/html": content}, raw=True, display_id=display_id)
+
+    thread = threading.Thread(target=watch, daemon=True)
+    thread.start()
+
+
+def visualize(
+    decision_paths,
+    width=500,
+    height=650,
+    compact=False,
+    shared_bundle=False,
+    serve=False,
+    initial_depth=2,
+    callback=None,
+):
+    """
+    Render TimberTrek in the output cell.
+
+    Args:
+        decision_paths(dict | Future): Decision paths in a hierarchical dict,
+            or a pending result of transform_trie_to_rules_async(). A pending
+            result shows its progress, and is rendered once it is done.
+        width(int): Width of the main visualization window
+        height(int): Height of the whole window
+        compact(bool): Pass the data to the widget as a gzip-compressed binary
+            payload. It makes the output cell several times smaller for large
+            Rashomon sets. It requires a browser with DecompressionStream.
+        shared_bundle(bool): Add the JS bundle to the notebook page once per
+            kernel session (see inject_js_bundle()), and let this widget load
+            it from the page instead of embedding a copy. It makes notebooks
+            with many widgets much smaller, but the widgets only render on
+            pages where the bundle has been injected.
+        serve(bool): Send the data from a local server started by
+            serve_decision_paths() instead of embedding it. The widget draws
+            the first `initial_depth` levels of the rule trie right away, and
+            loads deeper levels of a sector when users zoom into it. The full
+            data is only loaded when the search panel is opened. The browser
+            needs to reach the kernel's localhost, so it does not work with
+            remote kernels. Each served widget keeps its own server until
+            stop_data_servers() is called.
+        initial_depth(int): # of rule trie levels to load at a time, if
+            `serve` is True
+        callback(function): Function to call with the stage event of the HTML
+            generation: {'type': 'stage', 'stage': 'make_html', 'time',
+            'peakMemory', 'bytes'}, see transform_trie_to_rules()
+
+    Return:
+        HTML code with deferred JS code in base64 format
+    """
+
+    if shared_bundle:
+        inject_js_bundle()
+
+    def make_iframe(decision_paths):
+        return _make_iframe(
+            decision_paths,
+            width,
+            height,
+            compact,
+            shared_bundle,
+            serve,
+            initial_depth,
+            callback,
+        )
+
+    if isinstance(decision_paths, Future):
+        _visualize_pending(decision_paths, height, make_iframe)
+        return
+
     # Display the iframe
-    display_html(iframe, raw=True)
+    display_html(make_iframe(decision_paths), raw=True)
@@ -38,7 +38,20 @@ export interface LabelPosition {
  * Custom event for notebook message events
  */
 export interface NotebookEvent extends Event {
-  data: HierarchyJSON;
+  data: HierarchyJSON | null;
+
+  /**
+   * Base64 string of the gzip compact decision paths. It is only given when
+   * data is null.
+   */
+  compactData: string | null;
+
+  /**
+   * Base url of the data server to load the data from. It is only given when
+   * data and compactData are null.
+   */
+  serverURL: string | null;
+  initialDepth: number;
   width: number;
 }
 
@@ -100,6 +113,12 @@ export interface TreeNode {
    * Array of children
    */
   c: TreeNode[];
+
+  /**
+   * Number of samples and correctly classified samples of each data split
+   * (leaf nodes only, if the tree is evaluated on data splits)
+   */
+  s?: [number, number][];
 }
 
 export interface SankeyHierarchyPointNode
@@ -108,10 +127,13 @@ export interface SankeyHierarchyPointNode
 }
 
 /**
- * A map from tree ID to the tree's hierarchy dict, objective, and accuracy
+ * A map from tree ID to the tree's hierarchy dict, objective, and accuracy.
+ * If trees are deduplicated, an identical tree stores the ID of its
+ * representative tree instead of a hierarchy dict. If trees are evaluated on
+ * data splits, the last item has the accuracy of each split.
  */
 export interface TreeMap {
-  [treeID: number]: [TreeNode, number, number];
+  [treeID: number]: [TreeNode | number, number, number, (number | null)[]?];
 }
 
 export interface HierarchyJSON {
@@ -123,6 +145,69 @@ export interface HierarchyJSON {
   featureMap: FeatureMap;
 
   treeMap: TreeMap;
+
+  /**
+   * Optional precomputed indexes for the tree filters
+   */
+  filterIndex?: FilterIndex;
+
+  /**
+   * Optional names of the data splits that trees are evaluated on
+   */
+  splits?: string[];
+}
+
+/**
+ * Levels below a rule node that are loaded from the data server, and the
+ * trees that end in these levels
+ */
+export interface Subtrie {
+  trie: RuleNode;
+  treeMap: TreeMap;
+}
+
+/**
+ * Function to load the levels below a rule node, given the child indexes from
+ * the root to that node and the # of levels to load
+ */
+export type SubtrieLoader = (
+  nodePath: number[],
+  depth: number
+) => Promise<Subtrie>;
+
+/**
+ * Precomputed indexes for the tree filters. Per-tree arrays follow the order
+ * of treeIDs.
+ */
+export interface FilterIndex {
+  treeIDs: number[];
+  heights: number[];
+  minSamples: number[];
+
+  /**
+   * Tree IDs sorted by accuracy, and their accuracies
+   */
+  accuracyOrder: number[];
+  sortedAccuracies: number[];
+
+  /**
+   * Tree IDs sorted by min leaf sample, and their min leaf samples
+   */
+  minSampleOrder: number[];
+  sortedMinSamples: number[];
+
+  /**
+   * Map feature ID to IDs of trees using that feature
+   */
+  featureTrees: { [featureID: string]: number[] };
+
+  /**
+   * Map depth (root is 1) to a map from feature ID to IDs of trees using that
+   * feature at that depth
+   */
+  depthFeatureTrees: {
+    [depth: string]: { [featureID: string]: number[] };
+  };
 }
 
 export interface RuleNode {
@@ -159,6 +244,18 @@ export interface RuleNode {
    * Only leaf node has this property
    */
   u?: boolean;
+
+  /**
+   * Number of rules below this node. Only nodes whose children are not loaded
+   * from the data server yet have this property.
+   */
+  v?: number;
+
+  /**
+   * Number of unique trees below this node. Only nodes of a partially loaded
+   * rule trie have this property.
+   */
+  n?: number;
 }
 
 // Define the arc path generator
@@ -1,7 +1,7 @@
 import type { Writable } from 'svelte/store';
 import { tick } from 'svelte';
 import d3 from '../../utils/d3-import';
-import { round } from '../../utils/utils';
+import { round, getTreeMapMap } from '../../utils/utils';
 import { config } from '../../config';
 import type { SearchStoreValue } from '../../stores';
 import { getSearchStoreDefaultValue } from '../../stores';
@@ -120,10 +120,7 @@ export class SearchPanel {
     this.data = data;
 
     // Convert treeMap into a real Map
-    this.treeMapMap = new Map<number, [TreeNode, number, number]>();
-    Object.keys(data.treeMap).forEach(k => {
-      this.treeMapMap.set(+k, data.treeMap[+k] as [TreeNode, number, number]);
-    });
+    this.treeMapMap = getTreeMapMap(data.treeMap);
 
     const result = this.#processData();
     this.accuracyDensities = result.accuracyDensities;
@@ -1,5 +1,6 @@
 import d3 from '../../utils/d3-import';
-import { setsAreEqual } from '../../utils/utils';
+import { setsAreEqual, getTreeMapMap } from '../../utils/utils';
+import { mergeRuleSubtrie } from '../../utils/data-server';
 import { config } from '../../config';
 import type { Writable } from 'svelte/store';
 import { SunburstAction } from '../../stores';
@@ -48,10 +49,12 @@ import type {
   ArcDomainData,
   ArcPartition,
   FeatureInfo,
+  FilterIndex,
   HierarchyJSON,
   HierarchyNode,
   Padding,
   RuleNode,
+  SubtrieLoader,
   TreeNode,
   SelectedTrees
 } from '../TimberTypes';
@@ -86,11 +89,21 @@ export class Sunburst {
   yScale: d3.ScaleLinear<number, number, never>;
   textFontScale: d3.ScaleLinear<number, number, never>;
 
+  rawData: HierarchyJSON;
   data: RuleNode;
   dataRoot: d3.HierarchyNode<RuleNode>;
   treeMapMap: Map<number, [TreeNode, number, number]>;
   partition: HierarchyNode;
 
+  // Function to load deeper levels from the data server, and the depth of
+  // the pending requests keyed by their node paths
+  subtrieLoader: SubtrieLoader | null;
+  subtrieRequests: Map<string, number>;
+
+  // Precomputed filter indexes, if they are shipped with the data
+  filterIndex: FilterIndex | null;
+  heightTreesMap: Map<number, number[]> | null;
+
   totalPathNum: number;
   totalTreeNum: number;
 
@@ -224,7 +237,8 @@ export class Sunburst {
     treeWindowStore,
     pinnedTreeStore,
     searchStore,
-    sunburstUpdated
+    sunburstUpdated,
+    subtrieLoader = null
   }: {
     component: HTMLElement;
     data: HierarchyJSON;
@@ -234,6 +248,7 @@ export class Sunburst {
     pinnedTreeStore: Writable<PinnedTreeStoreValue>;
     searchStore: Writable<SearchStoreValue>;
     sunburstUpdated: () => void;
+    subtrieLoader?: SubtrieLoader | null;
   }) {
     // Set up view box
     this.svg = d3
@@ -260,13 +275,17 @@ export class Sunburst {
     // this.height = height - this.padding.top - this.padding.bottom;
 
     // Transform the data
+    this.rawData = data;
     this.data = data.trie;
+    this.subtrieLoader = subtrieLoader;
+    this.subtrieRequests = new Map<string, number>();
 
     // Convert treeMap into a real Map
-    this.treeMapMap = new Map<number, [TreeNode, number, number]>();
-    Object.keys(data.treeMap).forEach(k => {
-      this.treeMapMap.set(+k, data.treeMap[+k] as [TreeNode, number, number]);
-    });
+    this.treeMapMap = getTreeMapMap(data.treeMap);
+
+    // Group trees by their heights for the height filter
+    this.filterIndex = data.filterIndex ?? null;
+    this.heightTreesMap = this.#getHeightTreesMap();
 
     // Get the feature map
     this.featureMap = new Map<number, string[]>();
@@ -283,8 +302,8 @@ export class Sunburst {
 
     this.dataRoot = d3
       .hierarchy(this.data, d => d.c)
-      // Count the leaves (trees)
-      .sum(d => (d.f === '_' ? 1 : 0));
+      // Count the leaves (trees), or the rules below a node not loaded yet
+      .sum(d => (d.f === '_' ? 1 : d.v ?? 0));
     this.partition = this.#partitionData();
 
     // The initial head node is the root
@@ -391,6 +410,9 @@ export class Sunburst {
     this.viewInitialized = true;
     console.timeEnd('Draw sunburst');
 
+    // Load the drawn levels that are not loaded from the data server yet
+    this.loadVisibleSubtries();
+
     // if (this.pinnedTreeStoreValue.pinnedTrees.length < 1) {
     //   setTimeout(() => {
     //     this.tempShowPinnedTree();
@@ -398,6 +420,193 @@ export class Sunburst {
     // }
   }
 
+  /**
+   * Redraw the view with decision paths that have more levels loaded from the
+   * data server. The view keeps the same zoomed sector, depth range, and
+   * filters, instead of starting over.
+   * @param newData Decision paths with more (or all) levels loaded
+   */
+  mergeData(newData: HierarchyJSON) {
+    // Remember the zoomed sectors by their rule paths, which stay the same
+    const getRulePath = (node: HierarchyNode) =>
+      node
+        .ancestors()
+        .reverse()
+        .slice(1)
+        .map(a => a.data.f);
+
+    const headPath = getRulePath(this.curHeadNode);
+    const headDepthGap =
+      this.sunburstStoreValue.depthHigh - this.sunburstStoreValue.depthLow;
+    const stackPaths = this.arcDomainStack.map(d => ({
+      path: getRulePath(d.node),
+      depthGap: d.depthGap
+    }));
+
+    // Rebuild the hierarchy from the new data
+    this.rawData = newData;
+    this.data = newData.trie;
+    this.treeMapMap = getTreeMapMap(newData.treeMap);
+    this.filterIndex = newData.filterIndex ?? null;
+    this.heightTreesMap = this.#getHeightTreesMap();
+
+    this.featureCount = new Map<string, number>();
+    this.featureValueCount = new Map<string, Map<string, number>>();
+    this.dataRoot = d3
+      .hierarchy(this.data, d => d.c)
+      .sum(d => (d.f === '_' ? 1 : d.v ?? 0));
+    this.partition = this.#partitionData();
+    this.totalTreeNum = this.partition.treeNum;
+    this.totalPathNum = this.partition.value!;
+
+    // The new trie can be deeper than the loaded levels
+    const depthMax = this.partition.height;
+    this.sunburstStoreValue.depthMax = depthMax;
+
+    for (let i = 1; i < depthMax; i++) {
+      if (!this.searchStoreValue.curDepthFeatures.has(i)) {
+        const allFeatureIDs = new Set([...this.featureMap.keys()]);
+        this.searchStoreValue.curDepthFeatures.set(i, allFeatureIDs);
+        this.localDepthFeatures.set(i, new Set(allFeatureIDs));
+      }
+    }
+
+    const findNode = (path: string[]) => {
+      let node: HierarchyNode | undefined = this.partition;
+      for (const f of path) {
+        node = node?.children?.find(c => c.data.f === f);
+      }
+      return node ?? this.partition;
+    };
+
+    // Domain of a sector when it is the head, as in arcClicked()
+    const yGap = 1 / (depthMax + 1);
+    const getDomain = (node: HierarchyNode, depthGap: number) => {
+      const depthLow = node.depth === 0 ? 1 : node.depth;
+      const depthHigh = Math.min(depthLow + depthGap, depthMax);
+      return {
+        x0: node.x0,
+        x1: node.x1,
+        y0: node.y0,
+        y1: (depthHigh + 1) * yGap
+      };
+    };
+
+    this.arcDomainStack = stackPaths.map(d => {
+      const node = findNode(d.path);
+      return { ...getDomain(node, d.depthGap), node, depthGap: d.depthGap };
+    });
+
+    this.curHeadNode = findNode(headPath);
+    this.sunburstStoreValue.depthLow =
+      this.curHeadNode.depth === 0 ? 1 : this.curHeadNode.depth;
+    this.sunburstStoreValue.depthHigh = Math.min(
+      this.sunburstStoreValue.depthLow + headDepthGap,
+      depthMax
+    );
+
+    const depthColors = new Array<string>(depthMax).fill('');
+    this.curHeadNode.ancestors().forEach(a => {
+      if (a.depth > 0) {
+        depthColors[a.depth - 1] = this.getFeatureColor(a.data.f);
+      }
+    });
+    this.sunburstStoreValue.depthColors = depthColors;
+    this.sunburstStore.set(this.sunburstStoreValue);
+    this.searchStore.set(this.searchStoreValue);
+
+    // Redraw the arcs and zoom into the same sector
+    this.svg.select('.content-group').remove();
+    this.initView();
+    this.arcZoom(getDomain(this.curHeadNode, headDepthGap));
+
+    // New trees start selected, then the current filters apply to them
+    this.selectedTrees = {
+      accuracy: new Set(this.treeMapMap.keys()),
+      minSample: new Set(this.treeMapMap.keys()),
+      height: new Set(this.treeMapMap.keys()),
+      depth: new Set(this.treeMapMap.keys()),
+      allFeature: new Set(this.treeMapMap.keys())
+    };
+
+    if (this.searchStoreValue.shown) {
+      this.syncAccuracyRange();
+      this.syncMinSampleRange();
+      this.syncHeightRange();
+      this.syncDepthFeatures();
+      this.syncAllFeatures();
+    }
+
+    this.sunburstUpdated();
+  }
+
+  /**
+   * Load the levels of the current sector that are drawn but not loaded from
+   * the data server yet, plus one level below them so that users can show a
+   * deeper level next. The view is redrawn once they arrive.
+   */
+  loadVisibleSubtries() {
+    if (this.subtrieLoader === null) return;
+
+    const headNode = this.curHeadNode;
+    const depthHigh = this.sunburstStoreValue.depthHigh;
+
+    // Nodes with `v` have their children not loaded yet
+    const hasUnloadedNode = headNode
+      .descendants()
+      .some(d => d.data.v !== undefined && d.depth <= depthHigh);
+    if (!hasUnloadedNode) return;
+
+    // The data server finds the head node by its child indexes
+    const nodePath = headNode
+      .ancestors()
+      .reverse()
+      .slice(1)
+      .map(a => a.parent!.data.c.indexOf(a.data));
+    const depth = depthHigh - headNode.depth + 1;
+
+    const requestKey = nodePath.join(',');
+    if ((this.subtrieRequests.get(requestKey) ?? 0) >= depth) return;
+    this.subtrieRequests.set(requestKey, depth);
+
+    const rawData = this.rawData;
+    this.subtrieLoader(nodePath, depth)
+      .then(subtrie => {
+        // Skip the subtrie if other data has replaced the partial data
+        if (this.rawData !== rawData) return;
+
+        mergeRuleSubtrie(rawData.trie, nodePath, subtrie.trie);
+        Object.assign(rawData.treeMap, subtrie.treeMap);
+        this.mergeData(rawData);
+      })
+      .catch(error => {
+        console.error(error);
+      })
+      .finally(() => {
+        if (this.subtrieRequests.get(requestKey) === depth) {
+          this.subtrieRequests.delete(requestKey);
+        }
+      });
+  }
+
+  /**
+   * Group trees by their heights from the filter index
+   * @returns Map from height to tree IDs, or null without a filter index
+   */
+  #getHeightTreesMap() {
+    if (this.filterIndex === null) return null;
+
+    const heightTreesMap = new Map<number, number[]>();
+    for (let i = 0; i < this.filterIndex.treeIDs.length; i++) {
+      const height = this.filterIndex.heights[i];
+      if (!heightTreesMap.has(height)) {
+        heightTreesMap.set(height, []);
+      }
+      heightTreesMap.get(height)!.push(this.filterIndex.treeIDs[i]);
+    }
+    return heightTreesMap;
+  }
+
   /**
    * Parse the feature name and value from feature's `f` field
    * @param f Feature's `f` field, it can be a number, '_', or 'root'
@@ -608,9 +817,10 @@ export class Sunburst {
       }
     });
 
-    // Transfer the ID set to its length at each node
+    // Transfer the ID set to its length at each node. Partially loaded nodes
+    // come with their tree count.
     partition.each(d => {
-      d.treeNum = d.uniqueTreeIDs?.size || 0;
+      d.treeNum = d.data.n ?? (d.uniqueTreeIDs?.size || 0);
       d.uniqueTreeIDs = null;
     });
 
@@ -777,6 +987,7 @@ export class Sunburst {
           );
 
           this.sunburstStore.set(this.sunburstStoreValue);
+          this.loadVisibleSubtries();
           break;
         }
         case SunburstAction.None: {
@@ -129,6 +129,9 @@ export function arcClicked(
   this.curHeadNode = newHead!;
   this.sunburstUpdated();
   this.arcZoom(targetDomain);
+
+  // Load the new sector's levels that are not loaded from the data server
+  this.loadVisibleSubtries();
 }
 
 /**
@@ -8,19 +8,88 @@ import d3 from '../../utils/d3-import';
 
 let textUpdateTimer: number | null = null;
 
+/**
+ * Find the first index in a sorted array whose value is not smaller than (or
+ * larger than, if `after` is true) the target
+ * @param values Sorted array
+ * @param target Target value
+ * @param after Whether to skip values equal to the target
+ * @returns Index in [0, values.length]
+ */
+const bisect = (values: number[], target: number, after: boolean) => {
+  let low = 0;
+  let high = values.length;
+  while (low < high) {
+    const mid = (low + high) >>> 1;
+    if (values[mid] < target || (after && values[mid] === target)) {
+      low = mid + 1;
+    } else {
+      high = mid;
+    }
+  }
+  return low;
+};
+
+/**
+ * Get IDs of trees whose values are in [low, high] with binary searches
+ * @param order Tree IDs sorted by their values
+ * @param sortedValues Values of the trees in `order`
+ * @param low Lower bound
+ * @param high Upper bound
+ * @returns Set of tree IDs
+ */
+const getTreesInRange = (
+  order: number[],
+  sortedValues: number[],
+  low: number,
+  high: number
+) => {
+  const start = bisect(sortedValues, low, false);
+  const end = bisect(sortedValues, high, true);
+  return new Set(order.slice(start, end));
+};
+
+/**
+ * Get IDs of trees that are not in any of the excluded tree ID lists
+ * @param treeIDs All tree IDs
+ * @param excludedTreeLists Lists of tree IDs to exclude
+ * @returns Set of tree IDs
+ */
+const getTreesExcluding = (
+  treeIDs: number[],
+  excludedTreeLists: number[][]
+) => {
+  const selectedTrees = new Set(treeIDs);
+  for (const excludedTrees of excludedTreeLists) {
+    for (const treeID of excludedTrees) {
+      selectedTrees.delete(treeID);
+    }
+  }
+  return selectedTrees;
+};
+
 /**
  * Sync the sunburst chart with the selected accuracy range
  * @param this Sunburst
  */
 export function syncAccuracyRange(this: Sunburst) {
   // Step 1: traverse the tree map to find which trees meet the criteria
-  this.treeMapMap.forEach((v, k) => {
-    if (v[2] >= this.localAccuracyLow && v[2] <= this.localAccuracyHigh) {
-      this.selectedTrees.accuracy.add(k);
-    } else {
-      this.selectedTrees.accuracy.delete(k);
-    }
-  });
+  if (this.filterIndex !== null) {
+    this.selectedTrees.accuracy = getTreesInRange(
+      this.filterIndex.accuracyOrder,
+      this.filterIndex.sortedAccuracies,
+      this.localAccuracyLow,
+      this.localAccuracyHigh
+    );
+  } else {
+    this.treeMapMap.forEach((v, k) => {
+      if (v[2] >= this.localAccuracyLow && v[2] <= this.localAccuracyHigh) {
+        this.selectedTrees.accuracy.add(k);
+      } else {
+        this.selectedTrees.accuracy.delete(k);
+      }
+    });
+  }
 
   // The selected trees are the intersection of all filters
   const selectedTreeIDs = new Set<number>();
@@ -87,16 +156,25 @@ export function syncAccuracyRange(this: Sunburst) {
  */
 export function syncMinSampleRange(this: Sunburst) {
   // Step 1: traverse the tree map to find which trees meet the criteria
-  if (this.searchStoreValue.treeMinSampleMap === null) return;
-
-  for (const [treeID, minSample] of this.searchStoreValue.treeMinSampleMap) {
-    if (
-      minSample >= this.localMinSampleLow &&
-      minSample <= this.localMinSampleHigh
-    ) {
-      this.selectedTrees.minSample.add(treeID);
-    } else {
-      this.selectedTrees.minSample.delete(treeID);
+  if (this.filterIndex !== null) {
+    this.selectedTrees.minSample = getTreesInRange(
+      this.filterIndex.minSampleOrder,
+      this.filterIndex.sortedMinSamples,
+      this.localMinSampleLow,
+      this.localMinSampleHigh
+    );
+  } else {
+    if (this.searchStoreValue.treeMinSampleMap === null) return;
+
+    for (const [treeID, minSample] of this.searchStoreValue.treeMinSampleMap) {
+      if (
+        minSample >= this.localMinSampleLow &&
+        minSample <= this.localMinSampleHigh
+      ) {
+        this.selectedTrees.minSample.add(treeID);
+      } else {
+        this.selectedTrees.minSample.delete(treeID);
+      }
     }
   }
 
@@ -164,16 +242,24 @@ export function syncMinSampleRange(this: Sunburst) {
  * @param this Sunburst
  */
 export function syncHeightRange(this: Sunburst) {
-  if (this.searchStoreValue.treeHeightMap === null) return;
-
   // Step 1: traverse the tree map to find which trees meet the criteria
-  this.searchStoreValue.treeHeightMap.forEach((h, t) => {
-    if (this.localHeightRange.has(h)) {
-      this.selectedTrees.height.add(t);
-    } else {
-      this.selectedTrees.height.delete(t);
+  if (this.heightTreesMap !== null) {
+    const selectedHeightTrees = new Set<number>();
+    for (const height of this.localHeightRange) {
+      this.heightTreesMap.get(height)?.forEach(t => selectedHeightTrees.add(t));
     }
-  });
+    this.selectedTrees.height = selectedHeightTrees;
+  } else {
+    if (this.searchStoreValue.treeHeightMap === null) return;
+
+    this.searchStoreValue.treeHeightMap.forEach((h, t) => {
+      if (this.localHeightRange.has(h)) {
+        this.selectedTrees.height.add(t);
+      } else {
+        this.selectedTrees.height.delete(t);
+      }
+    });
+  }
 
   // The selected trees are the intersection of three filters
   const selectedTreeIDs = new Set<number>();
@@ -244,26 +330,45 @@ export function syncHeightRange(this: Sunburst) {
  * @param this Sunburst
  */
 export function syncDepthFeatures(this: Sunburst) {
-  if (this.searchStoreValue.treeDepthFeaturesMap === null) return;
-
   // Step 1: traverse the tree map to find which trees meet the criteria
-  for (const [treeID, depthFeatures] of this.searchStoreValue
-    .treeDepthFeaturesMap) {
-    let treeSelected = true;
-
-    oneTreeLoop: for (const [depth, featureIDs] of depthFeatures) {
-      for (const featureID of featureIDs) {
-        if (!this.localDepthFeatures.get(depth)!.has(featureID)) {
-          treeSelected = false;
-          break oneTreeLoop;
+  if (this.filterIndex !== null) {
+    // Remove trees using any unselected feature at any depth
+    const excludedTreeLists: number[][] = [];
+    for (const [depth, featureTrees] of Object.entries(
+      this.filterIndex.depthFeatureTrees
+    )) {
+      const curFeatures = this.localDepthFeatures.get(parseInt(depth));
+      for (const [featureID, treeIDs] of Object.entries(featureTrees)) {
+        if (!curFeatures?.has(parseInt(featureID))) {
+          excludedTreeLists.push(treeIDs);
         }
       }
     }
+    this.selectedTrees.depth = getTreesExcluding(
+      this.filterIndex.treeIDs,
+      excludedTreeLists
+    );
+  } else {
+    if (this.searchStoreValue.treeDepthFeaturesMap === null) return;
+
+    for (const [treeID, depthFeatures] of this.searchStoreValue
+      .treeDepthFeaturesMap) {
+      let treeSelected = true;
+
+      oneTreeLoop: for (const [depth, featureIDs] of depthFeatures) {
+        for (const featureID of featureIDs) {
+          if (!this.localDepthFeatures.get(depth)!.has(featureID)) {
+            treeSelected = false;
+            break oneTreeLoop;
+          }
+        }
+      }
 
-    if (treeSelected) {
-      this.selectedTrees.depth.add(treeID);
-    } else {
-      this.selectedTrees.depth.delete(treeID);
+      if (treeSelected) {
+        this.selectedTrees.depth.add(treeID);
+      } else {
+        this.selectedTrees.depth.delete(treeID);
+      }
     }
   }
 
@@ -336,26 +441,42 @@ export function syncDepthFeatures(this: Sunburst) {
  * @param this Sunburst
  */
 export function syncAllFeatures(this: Sunburst) {
-  if (this.searchStoreValue.treeDepthFeaturesMap === null) return;
-
   // Step 1: traverse the tree map to find which trees that meet selected features
-  for (const [treeID, depthFeatures] of this.searchStoreValue
-    .treeDepthFeaturesMap) {
-    let treeSelected = true;
-
-    oneTreeLoop: for (const [depth, featureIDs] of depthFeatures) {
-      for (const featureID of featureIDs) {
-        if (!this.localAllFeatures.has(featureID)) {
-          treeSelected = false;
-          break oneTreeLoop;
-        }
+  if (this.filterIndex !== null) {
+    // Remove trees using any unselected feature
+    const excludedTreeLists: number[][] = [];
+    for (const [featureID, treeIDs] of Object.entries(
+      this.filterIndex.featureTrees
+    )) {
+      if (!this.localAllFeatures.has(parseInt(featureID))) {
+        excludedTreeLists.push(treeIDs);
       }
     }
+    this.selectedTrees.allFeature = getTreesExcluding(
+      this.filterIndex.treeIDs,
+      excludedTreeLists
+    );
+  } else {
+    if (this.searchStoreValue.treeDepthFeaturesMap === null) return;
+
+    for (const [treeID, depthFeatures] of this.searchStoreValue
+      .treeDepthFeaturesMap) {
+      let treeSelected = true;
+
+      oneTreeLoop: for (const [depth, featureIDs] of depthFeatures) {
+        for (const featureID of featureIDs) {
+          if (!this.localAllFeatures.has(featureID)) {
+            treeSelected = false;
+            break oneTreeLoop;
+          }
+        }
+      }
 
-    if (treeSelected) {
-      this.selectedTrees.allFeature.add(treeID);
-    } else {
-      this.selectedTrees.allFeature.delete(treeID);
+      if (treeSelected) {
+        this.selectedTrees.allFeature.add(treeID);
+      } else {
+        this.selectedTrees.allFeature.delete(treeID);
+      }
     }
   }
 
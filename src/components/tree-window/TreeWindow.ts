@@ -113,6 +113,16 @@ export class TreeWindow {
     // this.#drawCurTree();
   }
 
+  /**
+   * Replace the trees that the window can show
+   * @param treeMapMap Map from tree ID to the tree, objective, and accuracy
+   */
+  updateTreeMap(treeMapMap: Map<number, [TreeNode, number, number]>) {
+    this.treeMap = treeMapMap;
+    this.treeWindowStoreValue.treeMap = this.treeMap;
+    this.treeWindowStore.set(this.treeWindowStoreValue);
+  }
+
   /**
    * Initialize the store.
    */
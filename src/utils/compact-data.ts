@@ -0,0 +1,222 @@
+import type {
+  HierarchyJSON,
+  FeatureMap,
+  FilterIndex,
+  RuleNode,
+  TreeMap,
+  TreeNode
+} from '../components/TimberTypes';
+
+/**
+ * Header of the compact decision paths payload from the notebook widget
+ */
+interface CompactHeader {
+  strings: string[];
+  featureMap: [number, string[]][];
+  arrays: { [name: string]: [string, number, number] };
+  filterIndex?: FilterIndex;
+  splits?: string[];
+}
+
+type CompactArray = Int32Array | Uint32Array | Uint8Array | Float64Array;
+
+const COMPACT_MAGIC = 'TTRK';
+const COMPACT_VERSION = 1;
+
+// DecompressionStream is not in the DOM types of our TypeScript version
+type GzipStream = TransformStream<Uint8Array, Uint8Array>;
+interface DecompressionStreamWindow {
+  DecompressionStream: new (format: string) => GzipStream;
+}
+
+/**
+ * Decompress gzip bytes with the browser's DecompressionStream
+ * @param bytes Gzip bytes
+ * @returns Decompressed bytes
+ */
+const gunzip = async (bytes: Uint8Array) => {
+  const { DecompressionStream } =
+    window as unknown as DecompressionStreamWindow;
+  const stream = new Blob([bytes])
+    .stream()
+    .pipeThrough(new DecompressionStream('gzip'));
+  return await new Response(stream).arrayBuffer();
+};
+
+/**
+ * Rebuild a tree from nodes stored in preorder with their # of children
+ * @param start Index of the root node
+ * @param end Index after the last node
+ * @param makeNode Function to create the node and get its # of children
+ * @returns Root node
+ */
+const buildPreorder = <T extends { c?: T[] }>(
+  start: number,
+  end: number,
+  makeNode: (i: number) => [T, number]
+) => {
+  let root: T | null = null;
+  const workingStack: [T, number][] = [];
+
+  for (let i = start; i < end; i++) {
+    const [node, childNum] = makeNode(i);
+
+    if (root === null) {
+      root = node;
+    } else {
+      const parent = workingStack[workingStack.length - 1];
+      parent[0].c!.push(node);
+      parent[1] -= 1;
+      if (parent[1] === 0) workingStack.pop();
+    }
+
+    if (childNum > 0) {
+      if (node.c === undefined) node.c = [];
+      workingStack.push([node, childNum]);
+    }
+  }
+
+  return root!;
+};
+
+/**
+ * Decode the compact decision paths generated by the Python function
+ * encode_compact_decision_paths()
+ * @param compactData Base64 string of the gzip payload
+ * @returns Decision paths
+ */
+export const decodeCompactData = async (compactData: string) => {
+  const binary = atob(compactData);
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i++) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+
+  const buffer = await gunzip(bytes);
+  const view = new DataView(buffer);
+
+  const magic = new TextDecoder().decode(new Uint8Array(buffer, 0, 4));
+  if (magic !== COMPACT_MAGIC) {
+    throw Error('The payload is not compact decision paths.');
+  }
+
+  const version = view.getUint32(4, true);
+  if (version !== COMPACT_VERSION) {
+    throw Error(`Unsupported compact payload version ${version}.`);
+  }
+
+  // Arrays are 8-byte aligned after the header, so we can view them in place
+  const headerSize = view.getUint32(8, true);
+  const header = JSON.parse(
+    new TextDecoder().decode(new Uint8Array(buffer, 12, headerSize))
+  ) as CompactHeader;
+  const arrayStart = 12 + headerSize;
+
+  const arrays = new Map<string, CompactArray>();
+  for (const [name, [dtype, offset, length]] of Object.entries(
+    header.arrays
+  )) {
+    const byteOffset = arrayStart + offset;
+    switch (dtype) {
+      case 'int32':
+        arrays.set(name, new Int32Array(buffer, byteOffset, length));
+        break;
+      case 'uint32':
+        arrays.set(name, new Uint32Array(buffer, byteOffset, length));
+        break;
+      case 'uint8':
+        arrays.set(name, new Uint8Array(buffer, byteOffset, length));
+        break;
+      case 'float64':
+        arrays.set(name, new Float64Array(buffer, byteOffset, length));
+        break;
+      default:
+        throw Error(`Unknown array type ${dtype}.`);
+    }
+  }
+
+  const strings = header.strings;
+  const ruleString = arrays.get('ruleString')!;
+  const ruleChildNum = arrays.get('ruleChildNum')!;
+  const ruleTree = arrays.get('ruleTree')!;
+  const nodeString = arrays.get('nodeString')!;
+  const nodeSampleNum = arrays.get('nodeSampleNum')!;
+  const nodeCorrectNum = arrays.get('nodeCorrectNum')!;
+  const nodeChildNum = arrays.get('nodeChildNum')!;
+
+  // Split counts and accuracies are stored as # splits values per node / tree
+  const splitNum = header.splits === undefined ? 0 : header.splits.length;
+  const nodeSplitCounts = arrays.get('nodeSplitCounts');
+  const treeSplitAccuracy = arrays.get('treeSplitAccuracy');
+
+  const trie = buildPreorder<RuleNode>(0, ruleString.length, i => {
+    const node: RuleNode =
+      ruleTree[i] >= 0
+        ? { f: strings[ruleString[i]], c: [], t: ruleTree[i] }
+        : { f: strings[ruleString[i]], c: [] };
+    return [node, ruleChildNum[i]];
+  });
+
+  const treeID = arrays.get('treeID')!;
+  const treeObjective = arrays.get('treeObjective')!;
+  const treeAccuracy = arrays.get('treeAccuracy')!;
+  const treeRepresentative = arrays.get('treeRepresentative')!;
+  const treeNodeOffset = arrays.get('treeNodeOffset')!;
+
+  const treeMap: TreeMap = {};
+  for (let i = 0; i < treeID.length; i++) {
+    let tree: TreeNode | number = treeRepresentative[i];
+    if (treeRepresentative[i] < 0) {
+      tree = buildPreorder<TreeNode>(
+        treeNodeOffset[i],
+        treeNodeOffset[i + 1],
+        j => {
+          const node: TreeNode = {
+            f: [strings[nodeString[j]], nodeSampleNum[j], nodeCorrectNum[j]],
+            c: []
+          };
+          if (
+            nodeSplitCounts !== undefined &&
+            nodeSplitCounts[j * 2 * splitNum] >= 0
+          ) {
+            node.s = [];
+            for (let k = 0; k < splitNum; k++) {
+              const offset = (j * splitNum + k) * 2;
+              node.s.push([
+                nodeSplitCounts[offset],
+                nodeSplitCounts[offset + 1]
+              ]);
+            }
+          }
+          return [node, nodeChildNum[j]];
+        }
+      );
+    }
+    const treeEntry: TreeMap[number] = [
+      tree,
+      treeObjective[i],
+      treeAccuracy[i]
+    ];
+
+    if (treeSplitAccuracy !== undefined) {
+      const splitAccuracies: (number | null)[] = [];
+      for (let k = i * splitNum; k < (i + 1) * splitNum; k++) {
+        const accuracy = treeSplitAccuracy[k];
+        splitAccuracies.push(Number.isNaN(accuracy) ? null : accuracy);
+      }
+      treeEntry[3] = splitAccuracies;
+    }
+
+    treeMap[treeID[i]] = treeEntry;
+  }
+
+  const featureMap: FeatureMap = {};
+  for (const [k, v] of header.featureMap) {
+    featureMap[k] = v;
+  }
+
+  const data: HierarchyJSON = { trie, featureMap, treeMap };
+  if (header.filterIndex !== undefined) data.filterIndex = header.filterIndex;
+  if (header.splits !== undefined) data.splits = header.splits;
+  return data;
+};
@@ -0,0 +1,192 @@
+import type {
+  HierarchyJSON,
+  FeatureMap,
+  FilterIndex,
+  RuleNode,
+  Subtrie,
+  TreeMap
+} from '../components/TimberTypes';
+
+/**
+ * Response of the data server's /meta endpoint
+ */
+interface ServerMeta {
+  featureMap: FeatureMap;
+  treeNum: number;
+  filterIndex?: FilterIndex;
+}
+
+/**
+ * Fetch a json response from the data server started by the Python function
+ * serve_decision_paths()
+ * @param serverURL Base url of the data server, including its token path
+ * @param endpoint Endpoint path, e.g., '/trie'
+ * @param params Query parameters
+ * @returns Parsed json response
+ */
+const fetchServerJSON = async <T>(
+  serverURL: string,
+  endpoint: string,
+  params: Record<string, string> = {}
+) => {
+  // Append the endpoint to keep the token path of the base url
+  const url = new URL(`${serverURL}${endpoint}`);
+  for (const [k, v] of Object.entries(params)) {
+    url.searchParams.set(k, v);
+  }
+
+  const response = await fetch(url.toString());
+  if (!response.ok) {
+    throw Error(`Failed to load ${url.toString()} (${response.status}).`);
+  }
+  return (await response.json()) as T;
+};
+
+/**
+ * Collect the IDs of trees that have a leaf in a (partial) rule trie
+ * @param trie Rule trie
+ * @returns Set of tree IDs
+ */
+const getLeafTreeIDs = (trie: RuleNode) => {
+  const treeIDs = new Set<number>();
+  const workingStack = [trie];
+  while (workingStack.length > 0) {
+    const node = workingStack.pop()!;
+    if (node.t !== undefined) {
+      treeIDs.add(node.t);
+    } else {
+      workingStack.push(...node.c);
+    }
+  }
+  return treeIDs;
+};
+
+/**
+ * Load the first levels of the rule trie and the trees that end in these
+ * levels. Nodes at the last level have no children, but carry their # of
+ * rules (v) and # of unique trees (n), so the sunburst can size them.
+ * @param serverURL Base url of the data server
+ * @param initialDepth # of rule trie levels to load
+ * @returns Partial decision paths to draw the first paint
+ */
+export const loadInitialServerData = async (
+  serverURL: string,
+  initialDepth: number
+) => {
+  const [meta, trie] = await Promise.all([
+    fetchServerJSON<ServerMeta>(serverURL, '/meta'),
+    fetchServerJSON<RuleNode>(serverURL, '/trie', {
+      depth: `${initialDepth}`
+    })
+  ]);
+
+  // Only load trees that already have a leaf in the loaded levels
+  const treeIDs = getLeafTreeIDs(trie);
+
+  let treeMap: TreeMap = {};
+  if (treeIDs.size > 0) {
+    treeMap = await fetchServerJSON<TreeMap>(serverURL, '/trees', {
+      ids: [...treeIDs].join(',')
+    });
+  }
+
+  const data: HierarchyJSON = {
+    trie,
+    featureMap: meta.featureMap,
+    treeMap
+  };
+  if (meta.filterIndex !== undefined) data.filterIndex = meta.filterIndex;
+  return data;
+};
+
+/**
+ * Load the first levels below a rule node, and the trees that end in these
+ * levels but are not loaded yet
+ * @param serverURL Base url of the data server
+ * @param nodePath Child indexes from the root to the rule node
+ * @param depth # of levels to load below the rule node
+ * @param loadedTreeMap Trees that are already loaded
+ * @returns The subtrie and its new trees
+ */
+export const loadServerSubtrie = async (
+  serverURL: string,
+  nodePath: number[],
+  depth: number,
+  loadedTreeMap: TreeMap
+) => {
+  const trie = await fetchServerJSON<RuleNode>(serverURL, '/trie', {
+    path: nodePath.join(','),
+    depth: `${depth}`
+  });
+
+  const treeIDs = [...getLeafTreeIDs(trie)].filter(
+    t => loadedTreeMap[t] === undefined
+  );
+
+  let treeMap: TreeMap = {};
+  if (treeIDs.length > 0) {
+    treeMap = await fetchServerJSON<TreeMap>(serverURL, '/trees', {
+      ids: treeIDs.join(',')
+    });
+  }
+
+  const subtrie: Subtrie = { trie, treeMap };
+  return subtrie;
+};
+
+/**
+ * Merge a subtrie from the data server into the partially loaded rule trie.
+ * Nodes that are loaded in the trie but not in the subtrie are kept.
+ * @param trie Partially loaded rule trie
+ * @param nodePath Child indexes from the root to the subtrie's root
+ * @param subtrie Subtrie from loadServerSubtrie()
+ */
+export const mergeRuleSubtrie = (
+  trie: RuleNode,
+  nodePath: number[],
+  subtrie: RuleNode
+) => {
+  let root = trie;
+  for (const i of nodePath) {
+    root = root.c[i];
+  }
+
+  const workingStack: [RuleNode, RuleNode][] = [[root, subtrie]];
+  while (workingStack.length > 0) {
+    const [node, loadedNode] = workingStack.pop()!;
+
+    // The loaded node's children are not loaded either
+    if (loadedNode.v !== undefined || node.f === '_') continue;
+
+    if (node.v !== undefined) {
+      node.c = loadedNode.c;
+      node.n = loadedNode.n;
+      delete node.v;
+    } else {
+      for (let i = 0; i < node.c.length; i++) {
+        workingStack.push([node.c[i], loadedNode.c[i]]);
+      }
+    }
+  }
+};
+
+/**
+ * Load the whole rule trie and tree map from the data server
+ * @param serverURL Base url of the data server
+ * @returns Decision paths
+ */
+export const loadFullServerData = async (serverURL: string) => {
+  const [meta, trie, treeMap] = await Promise.all([
+    fetchServerJSON<ServerMeta>(serverURL, '/meta'),
+    fetchServerJSON<RuleNode>(serverURL, '/trie'),
+    fetchServerJSON<TreeMap>(serverURL, '/trees')
+  ]);
+
+  const data: HierarchyJSON = {
+    trie,
+    featureMap: meta.featureMap,
+    treeMap
+  };
+  if (meta.filterIndex !== undefined) data.filterIndex = meta.filterIndex;
+  return data;
+};
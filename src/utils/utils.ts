@@ -1,5 +1,6 @@
 import d3 from './d3-import';
 import type { Icon } from './my-types';
+import type { TreeMap, TreeNode } from '../components/TimberTypes';
 // import type { SvelteComponent } from 'svelte';
 
 /**
@@ -219,3 +220,22 @@ export const splitFileName = (file: File) => {
   const extension = name.slice(lastDot + 1);
   return [value, extension];
 };
+
+/**
+ * Convert a tree map object into a Map. Trees that are stored as a reference
+ * to an identical representative tree share the representative's hierarchy.
+ * @param treeMap Tree map from the decision paths JSON
+ * @returns Map from tree ID to [hierarchy, objective, accuracy]
+ */
+export const getTreeMapMap = (treeMap: TreeMap) => {
+  const treeMapMap = new Map<number, [TreeNode, number, number]>();
+
+  Object.keys(treeMap).forEach(k => {
+    const [tree, objective, accuracy] = treeMap[+k];
+    const treeNode =
+      typeof tree === 'number' ? (treeMap[tree][0] as TreeNode) : tree;
+    treeMapMap.set(+k, [treeNode, objective, accuracy]);
+  });
+
+  return treeMapMap;
+};